@@ -0,0 +1,14 @@
+import logging
+import sys
+
+
+def get_console_logger(name: str) -> logging.Logger:
+    """Return a logger that shows the results of a benchmark on the console.
+
+    Importing `bube` sends the log records to `application.log`, the results of the benchmarks are printed to stdout as
+    well, so that they can be piped like the output of the CLI commands.
+    """
+    logger = logging.getLogger(name)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    logger.setLevel(logging.INFO)
+    return logger
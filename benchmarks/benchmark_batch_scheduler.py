@@ -0,0 +1,92 @@
+"""Throughput versus p99 latency of single-image requests with and without the micro-batching scheduler.
+
+Every client thread repeatedly embeds one image, similar to a client uploading a single photo to `/embeddings` or
+`/feex`. Each configuration runs in a fresh process, because the scheduler reads its settings from the environment
+when `bube` is imported.
+
+Usage:
+    python -m benchmarks.benchmark_batch_scheduler --clients 50 --requests 10 --height 480 --width 640
+"""
+
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+
+import numpy as np
+
+from benchmarks import get_console_logger
+from bube.config import config
+from bube.services.batch_scheduler import EmbeddingBatchScheduler
+from bube.services.image_embedding_model import ImageEmbeddingModel
+
+logger = get_console_logger(__name__)
+
+
+def configure_scheduler(max_wait_ms: float | None, max_batch_size: int) -> None:
+    """Set the scheduler settings for the next process, which reads them from the environment on import."""
+    os.environ["BATCH_SCHEDULER_ENABLED"] = str(max_wait_ms is not None)
+    if max_wait_ms is not None:
+        os.environ["BATCH_SCHEDULER_MAX_WAIT_MS"] = str(max_wait_ms)
+        os.environ["BATCH_SCHEDULER_MAX_BATCH_SIZE"] = str(max_batch_size)
+
+
+def run_configuration(args: argparse.Namespace, result_queue: multiprocessing.Queue) -> None:
+    """Embed the image from all clients concurrently and report throughput, p50 and p99 latency."""
+    model = ImageEmbeddingModel()
+    embed = EmbeddingBatchScheduler().compute_embedding_single if config.BATCH_SCHEDULER_ENABLED else None
+    embed = embed or model.compute_embedding_single
+
+    rng = np.random.default_rng(0)
+    image = rng.uniform(0, 255, size=(args.height, args.width, 3)).astype(np.float32)
+    embed(image.copy())  # warm up
+
+    latencies = []
+    lock = threading.Lock()
+
+    def client() -> None:
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            embed(image.copy())
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    result_queue.put((len(latencies) / duration, np.percentile(latencies, 50), np.percentile(latencies, 99)))
+
+
+def main() -> None:
+    """Run every scheduler configuration in a fresh process and print a table of the results."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=10, help="requests per client")
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, nargs="+", default=[2.0, 5.0, 10.0, 20.0])
+    args = parser.parse_args()
+
+    logger.info(f"{args.clients} clients x {args.requests} requests, image {args.height}x{args.width}")
+    logger.info(f"{'configuration':<28}{'images/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    ctx = multiprocessing.get_context("spawn")
+    for max_wait_ms in [None, *args.max_wait_ms]:
+        configure_scheduler(max_wait_ms, args.max_batch_size)
+        result_queue = ctx.Queue()
+        process = ctx.Process(target=run_configuration, args=(args, result_queue))
+        process.start()
+        throughput, p50, p99 = result_queue.get()
+        process.join()
+        name = "no scheduler" if max_wait_ms is None else f"wait {max_wait_ms} ms, batch {args.max_batch_size}"
+        logger.info(f"{name:<28}{throughput:>10.1f}{p50 * 1000:>10.1f}{p99 * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Time to the first batch and total time of reading a large folder, sequential vs. streaming discovery.
+
+The `LocalImgReader` lists the folder and reads all image headers before the first batch is created, the
+`StreamingImgReader` scans the folder recursively, reads the headers in parallel and emits a batch as soon as enough
+images with the same resolution were found. Only the headers are read, the images aren't decoded, so the benchmark
+measures discovery and probing. On network storage, the difference grows with the latency of each file access.
+If no folder is given, a folder tree with small synthetic JPEGs is created in a temporary directory.
+
+Usage:
+    python -m benchmarks.benchmark_discovery --image-root /path/to/images --probe-workers 1 4 16
+"""
+
+import argparse
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from benchmarks import get_console_logger
+from bube.services.local_image_service import LocalImgReader, StreamingImgReader
+
+logger = get_console_logger(__name__)
+
+
+def create_images(folder: Path, num_images: int, num_folders: int) -> None:
+    """Save small JPEGs with a few different resolutions, spread over `num_folders` subfolders."""
+    rng = np.random.default_rng(0)
+    sizes = [(64, 48), (48, 64), (80, 60)]
+    for i in range(num_images):
+        subfolder = folder / f"case_{i % num_folders:03d}"
+        subfolder.mkdir(exist_ok=True)
+        width, height = sizes[i % len(sizes)]
+        pixels = rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(subfolder / f"image_{i:06d}.jpg", quality=90)
+
+
+def measure_sequential(image_root: str, batch_size: int, probe_workers: int) -> tuple[float, float]:
+    """Return the seconds until the first batch and in total with the `LocalImgReader`."""
+    start = time.perf_counter()
+    image_paths = LocalImgReader.get_image_paths(image_root=image_root, all_img_files=True)
+    reader = LocalImgReader(filenames=image_paths, max_batch_size=batch_size, probe_workers=probe_workers)
+    # the first batch is available once all headers are read
+    first_batch = time.perf_counter() - start
+    len(reader)
+    return first_batch, time.perf_counter() - start
+
+
+def measure_streaming(image_root: str, batch_size: int, probe_workers: int) -> tuple[float, float]:
+    """Return the seconds until the first batch and in total with the `StreamingImgReader`."""
+    start = time.perf_counter()
+    reader = StreamingImgReader(
+        LocalImgReader.iter_image_files(image_root), max_batch_size=batch_size, probe_workers=probe_workers
+    )
+    first_batch = None
+    # only discovery and probing, the batches aren't decoded
+    with ThreadPoolExecutor(max_workers=probe_workers) as pool:
+        for _ in reader._iter_filled_batches(pool):  # noqa: SLF001
+            if first_batch is None:
+                first_batch = time.perf_counter() - start
+    return first_batch or 0.0, time.perf_counter() - start
+
+
+def main() -> None:
+    """Compare both readers for each number of probe workers and print a table."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image-root", type=str, default=None)
+    parser.add_argument("--num-images", type=int, default=5000, help="number of synthetic images")
+    parser.add_argument("--num-folders", type=int, default=50, help="number of synthetic subfolders")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--probe-workers", type=int, nargs="+", default=[1, 4, 16])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_root = args.image_root
+        if not image_root:
+            image_root = tmp_dir
+            create_images(Path(tmp_dir), args.num_images, args.num_folders)
+
+        logger.info(f"{'reader':>10}{'workers':>9}{'first batch s':>15}{'total s':>10}")
+        for probe_workers in args.probe_workers:
+            for name, measure in [("sequential", measure_sequential), ("streaming", measure_streaming)]:
+                first_batch, total = measure(image_root, args.batch_size, probe_workers)
+                logger.info(f"{name:>10}{probe_workers:>9}{first_batch:>15.3f}{total:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
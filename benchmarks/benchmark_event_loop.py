@@ -0,0 +1,94 @@
+"""Responsiveness of the API while large embedding requests are processed.
+
+Large upload requests are sent to `/embeddings` concurrently, while `/health` and a small single-image request are
+polled in parallel. If blocking work ran on the event loop, the health check latency would grow to the duration of a
+full inference; with the execution pools it stays in the range of milliseconds.
+
+Usage:
+    python -m benchmarks.benchmark_event_loop --large-requests 8 --images-per-request 8 --height 1536 --width 2048
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import time
+
+import httpx
+import numpy as np
+from PIL import Image
+
+os.environ.setdefault("BUBE_MODE", "embedding")
+
+from benchmarks import get_console_logger
+from bube import app
+
+logger = get_console_logger(__name__)
+
+
+def create_jpeg(height: int, width: int) -> bytes:
+    """Encode an image of random noise, which JPEG can't compress well."""
+    rng = np.random.default_rng(0)
+    buffer = io.BytesIO()
+    Image.fromarray(rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+async def poll(client: httpx.AsyncClient, stop: asyncio.Event, request: dict, interval: float) -> list[float]:
+    """Send the request repeatedly until `stop` is set and return the latencies in seconds."""
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.request(**request)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+def describe(name: str, latencies: list[float]) -> str:
+    """Format a table row with the count, p50, p99 and maximum latency in milliseconds."""
+    p50, p99 = np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000
+    return f"{name:<22}{len(latencies):>8}{p50:>10.1f}{p99:>10.1f}{max(latencies) * 1000:>10.1f}"
+
+
+async def main(args: argparse.Namespace) -> None:
+    """Send the large requests while polling `/health` and a small request, then print the latencies."""
+    large_image = create_jpeg(args.height, args.width)
+    small_image = create_jpeg(224, 224)
+    large_files = [("images", (f"large_{i}.jpg", large_image, "image/jpeg")) for i in range(args.images_per_request)]
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bube", timeout=args.timeout) as client:
+        health_request = {"method": "GET", "url": "/health"}
+        small_files = [("images", ("small.jpg", small_image, "image/jpeg"))]
+        small_request = {"method": "POST", "url": "/embeddings", "files": small_files}
+        await client.request(**small_request)  # warm up
+
+        stop = asyncio.Event()
+        health_poller = asyncio.create_task(poll(client, stop, health_request, args.interval))
+        small_poller = asyncio.create_task(poll(client, stop, small_request, args.interval))
+
+        start = time.perf_counter()
+        await asyncio.gather(*[client.post("/embeddings", files=large_files) for _ in range(args.large_requests)])
+        duration = time.perf_counter() - start
+        stop.set()
+        health_latencies, small_latencies = await health_poller, await small_poller
+
+    logger.info(
+        f"{args.large_requests} large requests with {args.images_per_request} images each took {duration:.1f} s"
+    )
+    logger.info(f"{'request':<22}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    logger.info(describe("GET /health", health_latencies))
+    logger.info(describe("POST /embeddings small", small_latencies))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--large-requests", type=int, default=8)
+    parser.add_argument("--images-per-request", type=int, default=8)
+    parser.add_argument("--height", type=int, default=1536)
+    parser.add_argument("--width", type=int, default=2048)
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between two polling requests")
+    parser.add_argument("--timeout", type=float, default=600.0, help="seconds until a request is aborted")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,119 @@
+"""Recall and query latency of the IVF-PQ index of `IvfPqVectorDB` compared to the exact search of `NumpyVectorDB`.
+
+Synthetic, clustered 2048-dimensional embeddings (groups of near-duplicates, like the photos of a case) are stored in a
+temporary database, the index is trained on them and queried with slightly perturbed copies of stored embeddings.
+The exact search is the ground truth for two measures:
+    recall@k          share of the exact k nearest neighbours which are found
+    recall@threshold  share of the exact neighbours within the duplicate threshold (0.6) which are found
+The index is queried with different `IVFPQ_DB_NPROBE` values, the other settings are taken from the config.
+
+Usage:
+    python -m benchmarks.benchmark_ivfpq --num-embeddings 100000 --nlist 1024 --num-subspaces 64 --nprobe 4 16 64
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks import get_console_logger
+from bube.config import config
+from bube.models import SUSPICIOUS_DISTANCE, EmbeddingBatch, ImageEmbeddingNeighbour
+from bube.repository import IvfPqVectorDB, NumpyVectorDB
+
+DIMENSIONS = 2048
+
+logger = get_console_logger(__name__)
+
+
+def create_embeddings(num_embeddings: int, group_size: int, rng: np.random.Generator) -> np.ndarray:
+    """Create unit embeddings in groups of `group_size` near-duplicates."""
+    centers = rng.normal(size=(-(-num_embeddings // group_size), DIMENSIONS)).astype(np.float32)
+    embeddings = np.repeat(centers, group_size, axis=0)[:num_embeddings]
+    embeddings += rng.normal(scale=0.3, size=embeddings.shape).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def run_queries(
+    vector_db: NumpyVectorDB, queries: EmbeddingBatch, threshold: float | None, k: int
+) -> tuple[list[set[str]], np.ndarray]:
+    """Run every query and return the filenames of the found neighbours and the latencies in milliseconds."""
+    results = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        neighbours: list[ImageEmbeddingNeighbour] = vector_db.get_neighbours(query, threshold=threshold, limit=k)
+        latencies.append(time.perf_counter() - start)
+        results.append({neighbour.filename for neighbour in neighbours})
+    return results, np.array(latencies) * 1000
+
+
+def recall(results: list[set[str]], truth: list[set[str]]) -> float:
+    """Share of the neighbours in the ground truth, which were found."""
+    return sum(len(result & expected) for result, expected in zip(results, truth, strict=True)) / max(
+        sum(map(len, truth)), 1
+    )
+
+
+def main() -> None:
+    """Store the embeddings, train the index and compare it to the exact search for each nprobe in a table."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-embeddings", type=int, default=100000)
+    parser.add_argument("--group-size", type=int, default=5, help="number of near-duplicates per group")
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=config.IVFPQ_DB_NLIST)
+    parser.add_argument("--num-subspaces", type=int, default=config.IVFPQ_DB_NUM_SUBSPACES)
+    parser.add_argument("--rerank-factor", type=int, default=config.IVFPQ_DB_RERANK_FACTOR)
+    parser.add_argument("--train-size", type=int, default=config.IVFPQ_DB_TRAIN_SIZE)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    embeddings = create_embeddings(args.num_embeddings, args.group_size, rng)
+    query_ids = rng.choice(len(embeddings), size=args.num_queries, replace=False)
+    query_embeddings = embeddings[query_ids] + rng.normal(scale=0.01, size=(args.num_queries, DIMENSIONS))
+    queries = EmbeddingBatch(["query"] * args.num_queries, query_embeddings)
+
+    with tempfile.TemporaryDirectory() as db_path:
+        config.NUMPY_DB_PATH = db_path
+        config.IVFPQ_DB_NLIST = args.nlist
+        config.IVFPQ_DB_NUM_SUBSPACES = args.num_subspaces
+        config.IVFPQ_DB_RERANK_FACTOR = args.rerank_factor
+        # the index is trained explicitly after all embeddings are stored
+        config.IVFPQ_DB_TRAIN_SIZE = args.num_embeddings + 1
+
+        vector_db = IvfPqVectorDB()
+        logger.info(f"Storing {args.num_embeddings} embeddings")
+        for start in range(0, len(embeddings), 10000):
+            block = embeddings[start : start + 10000]
+            vector_db.store_embeddings(EmbeddingBatch([f"{start + i}.jpg" for i in range(len(block))], block))
+        config.IVFPQ_DB_TRAIN_SIZE = args.train_size
+        start = time.perf_counter()
+        # the training is started when the database is opened, like `python -m bube build-index`
+        IvfPqVectorDB().build_index()
+        logger.info(f"Trained index in {time.perf_counter() - start:.1f}s")
+
+        exact_db = NumpyVectorDB()
+        truth_k, latencies = run_queries(exact_db, queries, None, args.k)
+        truth_threshold, _ = run_queries(exact_db, queries, SUSPICIOUS_DISTANCE, 100)
+        logger.info(f"{'search':>12}{'recall@k':>12}{'recall@thr':>12}{'p50 ms':>10}{'p95 ms':>10}{'bytes/vec':>11}")
+        p50, p95 = np.percentile(latencies, [50, 95])
+        logger.info(f"{'exact':>12}{1:>12.3f}{1:>12.3f}{p50:>10.2f}{p95:>10.2f}{DIMENSIONS * 4:>11}")
+
+        for nprobe in args.nprobe:
+            config.IVFPQ_DB_NPROBE = nprobe
+            index_db = IvfPqVectorDB()
+            results_k, latencies = run_queries(index_db, queries, None, args.k)
+            results_threshold, _ = run_queries(index_db, queries, SUSPICIOUS_DISTANCE, 100)
+            p50, p95 = np.percentile(latencies, [50, 95])
+            logger.info(
+                f"{f'nprobe={nprobe}':>12}{recall(results_k, truth_k):>12.3f}"
+                f"{recall(results_threshold, truth_threshold):>12.3f}{p50:>10.2f}{p95:>10.2f}"
+                f"{index_db.bytes_per_embedding:>11}"
+            )
+
+
+if __name__ == "__main__":
+    main()
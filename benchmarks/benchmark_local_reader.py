@@ -0,0 +1,77 @@
+"""Images/sec of the local image pipeline depending on the number of decode workers.
+
+For each worker count, the batches of a folder are decoded with the `StreamingImgReader`, once without
+inference (decode throughput) and once with inference (end-to-end throughput like `LocalImageService`).
+If no folder is given, a folder with synthetic JPEGs is created in a temporary directory.
+
+Usage:
+    python -m benchmarks.benchmark_local_reader --image-root /path/to/images --workers 1 2 4 8
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from benchmarks import get_console_logger
+from bube.services.image_embedding_model import ImageEmbeddingModel
+from bube.services.local_image_service import LocalImgReader, StreamingImgReader
+
+logger = get_console_logger(__name__)
+
+
+def create_images(folder: Path, num_images: int, height: int, width: int) -> None:
+    """Save JPEGs of random noise, which are as expensive to decode as photos of the same size."""
+    rng = np.random.default_rng(0)
+    for i in range(num_images):
+        pixels = rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(folder / f"image_{i:05d}.jpg", quality=90)
+
+
+def measure(
+    image_paths: list[str], batch_size: int, workers: int, prefetch: int, model: ImageEmbeddingModel | None
+) -> float:
+    """Read all batches (and embed them, if a model is given) and return the throughput in images per second."""
+    reader = StreamingImgReader(image_paths, max_batch_size=batch_size, num_workers=workers, prefetch_batches=prefetch)
+    start = time.perf_counter()
+    num_images = 0
+    for batch, _ in reader:
+        if model:
+            model.compute_embedding_batch(batch)
+        num_images += len(batch)
+    return num_images / (time.perf_counter() - start)
+
+
+def main() -> None:
+    """Measure the decode and end-to-end throughput for each number of workers and print a table."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image-root", type=str, default=None)
+    parser.add_argument("--num-images", type=int, default=64, help="number of synthetic images")
+    parser.add_argument("--height", type=int, default=1536)
+    parser.add_argument("--width", type=int, default=2048)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--prefetch", type=int, default=2)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_root = args.image_root
+        if not image_root:
+            image_root = tmp_dir
+            create_images(Path(tmp_dir), args.num_images, args.height, args.width)
+
+        image_paths = LocalImgReader.get_image_paths(image_root=image_root, all_img_files=True)
+        model = ImageEmbeddingModel()
+        logger.info(f"{len(image_paths)} images in batches of up to {args.batch_size} images")
+        logger.info(f"{'workers':>8}{'decode img/s':>15}{'end-to-end img/s':>19}")
+        for workers in args.workers:
+            decode_throughput = measure(image_paths, args.batch_size, workers, args.prefetch, model=None)
+            total_throughput = measure(image_paths, args.batch_size, workers, args.prefetch, model=model)
+            logger.info(f"{workers:>8}{decode_throughput:>15.1f}{total_throughput:>19.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""CPU throughput and accuracy of the model variants with reduced precision on the test assets.
+
+The variants are created next to the model with `python -m bube quantize-model`, missing variants are skipped.
+
+Usage:
+    python -m benchmarks.benchmark_model_precision --image-root tests/test_assets --max-side 1024
+"""
+
+import argparse
+from pathlib import Path
+
+from benchmarks import get_console_logger
+from bube.services.image_embedding_model import ImageEmbeddingModel
+from bube.services.image_embedding_model.image_embedding_model import get_precision_model_path
+from bube.services.image_embedding_model.model_quantization import PRECISIONS, evaluate_accuracy
+from bube.services.local_image_service import LocalImgReader
+
+logger = get_console_logger(__name__)
+
+
+def main() -> None:
+    """Evaluate every existing variant against the model and print a table."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image-root", type=str, default="tests/test_assets")
+    parser.add_argument("--model-path", type=str, default=ImageEmbeddingModel.default_model_path())
+    parser.add_argument("--max-side", type=int, default=None)
+    args = parser.parse_args()
+
+    image_paths = sorted(LocalImgReader.iter_image_files(args.image_root))
+    logger.info(
+        f"{'precision':>13}{'img/s':>9}{'speedup':>9}{'agreement':>11}{'mean |Δd|':>11}{'max |Δd|':>10}{'gate':>6}"
+    )
+    for precision in PRECISIONS:
+        variant_path = get_precision_model_path(args.model_path, precision)
+        if not Path(variant_path).is_file():
+            logger.info(f"{precision:>13}  skipped, {variant_path} not found")
+            continue
+        report = evaluate_accuracy(args.model_path, variant_path, image_paths, max_side=args.max_side)
+        speedup = report.reference_seconds_per_image / report.seconds_per_image
+        agreement = 100 * report.decision_agreement
+        logger.info(
+            f"{precision:>13}{1 / report.seconds_per_image:>9.2f}{speedup:>9.2f}{agreement:>10.1f}%"
+            f"{report.mean_distance_deviation:>11.4f}{report.max_distance_deviation:>10.4f}"
+            f"{'pass' if report.passed() else 'fail':>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
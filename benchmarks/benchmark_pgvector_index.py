@@ -0,0 +1,160 @@
+"""Recall@k versus query latency of the pgvector HNSW and IVFFlat indexes compared to the exact scan.
+
+A separate table is filled with synthetic, clustered 2048-dimensional embeddings (groups of near-duplicates, like the
+photos of a case). The queries are slightly perturbed copies of stored embeddings. The exact scan is the ground truth,
+then both index types are built on `embedding::halfvec(2048)` (like the managed index of `PgVector`) and queried with
+different `hnsw.ef_search` and `ivfflat.probes` settings.
+The connection settings are taken from the config, so the benchmark can run against a local Postgres with pgvector:
+
+    docker run -e POSTGRES_PASSWORD=mypassword -p 5432:5432 pgvector/pgvector:pg17
+
+Usage:
+    python -m benchmarks.benchmark_pgvector_index --num-embeddings 20000 --ef-search 20 40 100 --probes 1 5 10
+"""
+
+import argparse
+import time
+
+import numpy as np
+import psycopg2
+from psycopg2 import sql as pgsql
+from psycopg2.extras import execute_values
+
+from benchmarks import get_console_logger
+from bube.config import config
+
+DIMENSIONS = 2048
+
+logger = get_console_logger(__name__)
+
+
+def create_embeddings(num_embeddings: int, group_size: int, rng: np.random.Generator) -> np.ndarray:
+    """Create unit embeddings in groups of `group_size` near-duplicates."""
+    centers = rng.normal(size=(-(-num_embeddings // group_size), DIMENSIONS)).astype(np.float32)
+    embeddings = np.repeat(centers, group_size, axis=0)[:num_embeddings]
+    embeddings += rng.normal(scale=0.3, size=embeddings.shape).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def to_vector(embedding: np.ndarray) -> str:
+    """Format an embedding as pgvector literal."""
+    return "[" + ",".join(map(str, embedding.tolist())) + "]"
+
+
+def fill_table(cursor: psycopg2.extensions.cursor, table: pgsql.Identifier, embeddings: np.ndarray) -> None:
+    """Recreate the benchmark table and insert the embeddings with their position as id."""
+    cursor.execute(pgsql.SQL("DROP TABLE IF EXISTS {};").format(table))
+    cursor.execute(pgsql.SQL("CREATE TABLE {} (id INTEGER PRIMARY KEY, embedding VECTOR(2048));").format(table))
+    insert_query = pgsql.SQL("INSERT INTO {} (id, embedding) VALUES %s;").format(table)
+    for start in range(0, len(embeddings), 1000):
+        rows = [(start + i, to_vector(embedding)) for i, embedding in enumerate(embeddings[start : start + 1000])]
+        execute_values(cursor, insert_query, rows)
+    cursor.execute(pgsql.SQL("ANALYZE {};").format(table))
+
+
+def run_queries(
+    cursor: psycopg2.extensions.cursor, query: pgsql.Composed, queries: list[str], k: int
+) -> tuple[list[set[int]], np.ndarray]:
+    """Run every query and return the ids of the found neighbours and the latencies in milliseconds."""
+    results = []
+    latencies = []
+    for search_embedding in queries:
+        start = time.perf_counter()
+        cursor.execute(query, (search_embedding, k))
+        results.append({row[0] for row in cursor.fetchall()})
+        latencies.append(time.perf_counter() - start)
+    return results, np.array(latencies) * 1000
+
+
+def log_result(name: str, results: list[set[int]], truth: list[set[int]], latencies: np.ndarray, k: int) -> None:
+    """Log a table row with the recall@k and the p50 and p95 latency."""
+    recall = np.mean([len(result & expected) / k for result, expected in zip(results, truth, strict=True)])
+    p50, p95 = np.percentile(latencies, [50, 95])
+    logger.info(f"{name:>24}{recall:>10.3f}{p50:>10.2f}{p95:>10.2f}")
+
+
+def main() -> None:
+    """Fill the table, then query it with the exact scan and each index setting and print a table."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--table", type=str, default="feex_index_benchmark")
+    parser.add_argument("--num-embeddings", type=int, default=20000)
+    parser.add_argument("--group-size", type=int, default=5, help="number of near-duplicates per group")
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--m", type=int, default=config.PGVECTOR_DB_HNSW_M)
+    parser.add_argument("--ef-construction", type=int, default=config.PGVECTOR_DB_HNSW_EF_CONSTRUCTION)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[10, 20, 40, 100, 200])
+    parser.add_argument("--lists", type=int, default=config.PGVECTOR_DB_IVFFLAT_LISTS)
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 5, 10, 20, 50])
+    parser.add_argument("--keep-table", action="store_true", help="don't drop the benchmark table afterwards")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    embeddings = create_embeddings(args.num_embeddings, args.group_size, rng)
+    query_ids = rng.choice(len(embeddings), size=args.num_queries, replace=False)
+    query_embeddings = embeddings[query_ids] + rng.normal(scale=0.01, size=(args.num_queries, DIMENSIONS))
+    queries = [to_vector(embedding.astype(np.float32)) for embedding in query_embeddings]
+
+    table = pgsql.Identifier(args.table)
+    index = pgsql.Identifier(f"{args.table}_index")
+    connection = psycopg2.connect(
+        host=config.PGVECTOR_DB_HOST,
+        port=config.PGVECTOR_DB_PORT,
+        user=config.PGVECTOR_DB_USER,
+        password=config.PGVECTOR_DB_PWD.get_secret_value(),
+        dbname=config.PGVECTOR_DB_DATABASE_NAME,
+        sslmode="require" if config.PGVECTOR_DB_HTTP_SSL else "disable",
+    )
+    connection.autocommit = True
+    exact_query = pgsql.SQL("SELECT id FROM {} ORDER BY embedding <-> %s::VECTOR(2048) LIMIT %s;").format(table)
+    ann_query = pgsql.SQL(
+        "SELECT id FROM {} ORDER BY embedding::HALFVEC(2048) <-> %s::VECTOR(2048)::HALFVEC(2048) LIMIT %s;"
+    ).format(table)
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+            logger.info(f"Inserting {args.num_embeddings} embeddings into {args.table}")
+            fill_table(cursor, table, embeddings)
+
+            logger.info(f"{'search':>24}{'recall':>10}{'p50 ms':>10}{'p95 ms':>10}")
+            truth, latencies = run_queries(cursor, exact_query, queries, args.k)
+            log_result("exact", truth, truth, latencies, args.k)
+
+            index_configs = [
+                (
+                    "hnsw",
+                    "m = {}, ef_construction = {}",
+                    [args.m, args.ef_construction],
+                    "hnsw.ef_search",
+                    args.ef_search,
+                ),
+                ("ivfflat", "lists = {}", [args.lists], "ivfflat.probes", args.probes),
+            ]
+            for index_type, build_params, build_values, search_param, search_values in index_configs:
+                start = time.perf_counter()
+                cursor.execute(
+                    pgsql.SQL(
+                        "CREATE INDEX {} ON {} USING {} ((embedding::halfvec(2048)) halfvec_l2_ops) WITH ({});"
+                    ).format(
+                        index,
+                        table,
+                        pgsql.SQL(index_type),
+                        pgsql.SQL(build_params).format(*map(pgsql.Literal, build_values)),
+                    )
+                )
+                logger.info(f"Built {index_type} index in {time.perf_counter() - start:.1f}s")
+                for value in search_values:
+                    cursor.execute(pgsql.SQL("SET {} = {};").format(pgsql.SQL(search_param), pgsql.Literal(value)))
+                    results, latencies = run_queries(cursor, ann_query, queries, args.k)
+                    log_result(f"{search_param}={value}", results, truth, latencies, args.k)
+                cursor.execute(pgsql.SQL("DROP INDEX {};").format(index))
+    finally:
+        if not args.keep_table:
+            with connection.cursor() as cursor:
+                cursor.execute(pgsql.SQL("DROP TABLE IF EXISTS {};").format(table))
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Auto-tuning of the ONNX Runtime thread settings for the CPU cores of this host.
+
+Every combination of intra-op threads, execution mode and concurrent requests is measured on random images. The
+concurrent requests simulate the inference pool of the API (`INFERENCE_POOL_WORKERS`), whose requests share the cores.
+The fastest setting is printed as config.
+
+Usage:
+    python -m benchmarks.benchmark_session_options --resolution 1024 768 --batch-size 4 --concurrency 1 4
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import onnxruntime as ort
+
+from benchmarks import get_console_logger
+from bube.services.image_embedding_model import ImageEmbeddingModel
+from bube.services.image_embedding_model.image_embedding_model import create_session_options
+from bube.services.image_embedding_model.image_preprocessing import preprocess_imgs
+
+logger = get_console_logger(__name__)
+
+
+def measure(session: ort.InferenceSession, batch: np.ndarray, concurrency: int, num_batches: int) -> float:
+    """Run `num_batches` batches with `concurrency` threads on the session and return the images per second."""
+    input_name = session.get_inputs()[0].name
+    # the first run allocates the memory of the session, which is not counted
+    session.run(None, {input_name: batch})
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda _: session.run(None, {input_name: batch}), range(num_batches)))
+    return num_batches * len(batch) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    """Measure every setting, print a table and the fastest setting for each number of concurrent requests."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-path", type=str, default=ImageEmbeddingModel.default_model_path())
+    parser.add_argument("--resolution", type=int, nargs=2, default=[1024, 768], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--num-batches", type=int, default=8, help="batches per measurement")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1], help="numbers of concurrent requests")
+    args = parser.parse_args()
+
+    num_cores = os.cpu_count() or 1
+    width, height = args.resolution
+    images = np.random.default_rng(0).integers(0, 256, size=(args.batch_size, height, width, 3), dtype=np.uint8)
+    batch = preprocess_imgs(images)
+    # the default of ONNX Runtime (one thread per core), fewer threads and one thread per request
+    thread_counts = sorted({num_cores, max(num_cores // 2, 1), *(max(num_cores // c, 1) for c in args.concurrency)})
+    settings = [(threads, "sequential", None) for threads in thread_counts]
+    if num_cores > 1:
+        settings += [(threads, "parallel", 2) for threads in thread_counts]
+
+    logger.info(f"{num_cores} CPU cores, batches of {args.batch_size} images in {width}x{height}")
+    logger.info(f"{'intra-op':>9}{'mode':>12}{'inter-op':>9}{'requests':>9}{'img/s':>9}")
+    results = []
+    for intra_op_threads, execution_mode, inter_op_threads in settings:
+        session_options = create_session_options(
+            intra_op_num_threads=intra_op_threads,
+            inter_op_num_threads=inter_op_threads,
+            execution_mode=execution_mode,
+        )
+        session = ort.InferenceSession(args.model_path, session_options, providers=["CPUExecutionProvider"])
+        for concurrency in args.concurrency:
+            throughput = measure(session, batch, concurrency, args.num_batches)
+            results.append((throughput, intra_op_threads, execution_mode, inter_op_threads, concurrency))
+            inter_op = "-" if inter_op_threads is None else str(inter_op_threads)
+            logger.info(f"{intra_op_threads:>9}{execution_mode:>12}{inter_op:>9}{concurrency:>9}{throughput:>9.2f}")
+
+    for concurrency in args.concurrency:
+        _, intra_op_threads, execution_mode, inter_op_threads, _ = max(
+            (result for result in results if result[4] == concurrency), key=lambda result: result[0]
+        )
+        logger.info(f"\nFastest setting for {concurrency} concurrent requests:")
+        logger.info(f"ORT_INTRA_OP_NUM_THREADS = {intra_op_threads}")
+        if inter_op_threads is not None:
+            logger.info(f"ORT_INTER_OP_NUM_THREADS = {inter_op_threads}")
+        logger.info(f"ORT_EXECUTION_MODE = {execution_mode}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Batch sizes and throughput of the local image pipeline with and without shape buckets.
+
+Usage:
+    python -m benchmarks.benchmark_shape_buckets --image-root tests/test_assets --bucket-sizes 32 64 128
+"""
+
+import argparse
+import time
+
+from benchmarks import get_console_logger
+from bube.services.image_embedding_model import ImageEmbeddingModel
+from bube.services.local_image_service import LocalImgReader, StreamingImgReader
+
+logger = get_console_logger(__name__)
+
+
+def main() -> None:
+    """Report the batches, padding and throughput for each bucket size and print a table."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image-root", type=str, default="tests/test_assets")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--bucket-sizes", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--skip-inference", action="store_true", help="only report the batch statistics")
+    args = parser.parse_args()
+
+    model = ImageEmbeddingModel()
+    logger.info(f"{'bucket size':>12}{'batches':>9}{'mean batch':>12}{'padding %':>11}{'img/s':>9}")
+    for bucket_size in [None, *args.bucket_sizes]:
+        reader = LocalImgReader(
+            image_root=args.image_root,
+            all_img_files=True,
+            max_batch_size=args.batch_size,
+            shape_bucket_size=bucket_size,
+        )
+        num_images = len(reader._filenames)  # noqa: SLF001
+        unpadded_reader = LocalImgReader(image_root=args.image_root, all_img_files=True)
+        real_pixels = sum(
+            len(batch) * width * height
+            for batch, (width, height) in zip(unpadded_reader._batches, unpadded_reader._batch_resolutions, strict=True)  # noqa: SLF001
+        )
+        padded_pixels = sum(
+            len(batch) * width * height
+            for batch, (width, height) in zip(reader._batches, reader._batch_resolutions, strict=True)  # noqa: SLF001
+        )
+        padding = 100 * (padded_pixels - real_pixels) / real_pixels
+
+        throughput = float("nan")
+        if not args.skip_inference:
+            start = time.perf_counter()
+            streaming_reader = StreamingImgReader(
+                reader._filenames,  # noqa: SLF001
+                max_batch_size=args.batch_size,
+                shape_bucket_size=bucket_size,
+            )
+            for batch, _ in streaming_reader:
+                model.compute_embedding_batch(batch)
+            throughput = num_images / (time.perf_counter() - start)
+
+        name = "none" if bucket_size is None else str(bucket_size)
+        logger.info(f"{name:>12}{len(reader):>9}{num_images / len(reader):>12.2f}{padding:>11.1f}{throughput:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Accuracy report for reduced-resolution decoding (MAX_INPUT_SIDE) on the test assets.
+
+Every variant of a test image (blur, crop, rotate, ...) is compared with its original image and every original image
+with all other original images. The resulting distances and classifications (duplicate, suspicious or different) are
+compared between the full resolution and each maximum input side, together with the time needed per image.
+
+Usage:
+    python -m benchmarks.report_max_side_accuracy --image-root tests/test_assets --max-sides 2048 1024 768 512
+"""
+
+import argparse
+import itertools
+import time
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks import get_console_logger
+from bube.models import classify_distance
+from bube.services.image_embedding_model import ImageEmbeddingModel, decode_img
+
+logger = get_console_logger(__name__)
+
+
+def squared_distance(a: np.ndarray, b: np.ndarray) -> float:
+    """Squared L2 distance, the metric of the duplicate check with the default databases (Chroma, NumPy and IVF-PQ)."""
+    return float(np.sum((a - b) ** 2))
+
+
+def embed_folder(image_root: Path, max_side: int | None) -> tuple[dict[str, np.ndarray], float]:
+    """Embed all JPEGs of the folder and return the embeddings by filename and the seconds per image."""
+    model = ImageEmbeddingModel()
+    embeddings = {}
+    start = time.perf_counter()
+    for path in sorted(image_root.glob("*.jpg")):
+        embeddings[path.name] = model.compute_embedding_single(decode_img(str(path), max_side=max_side))
+    return embeddings, (time.perf_counter() - start) / len(embeddings)
+
+
+def get_pairs(filenames: list[str]) -> list[tuple[str, str]]:
+    """Pair every variant with its original image and all original images with each other."""
+    originals = [name for name in filenames if "_" not in name.removeprefix("feex_")]
+    variant_pairs = [(f"{name[:13]}.jpg", name) for name in filenames if name not in originals]
+    variant_pairs = [(original, name) for original, name in variant_pairs if original in originals]
+    return variant_pairs + list(itertools.combinations(originals, 2))
+
+
+def main() -> None:
+    """Compare the classifications for each maximum input side with the full resolution and print a table."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image-root", type=Path, default=Path("tests/test_assets"))
+    parser.add_argument("--max-sides", type=int, nargs="+", default=[2048, 1024, 768, 512])
+    parser.add_argument("--verbose", action="store_true", help="list every pair with a changed classification")
+    args = parser.parse_args()
+
+    reference, reference_time = embed_folder(args.image_root, max_side=None)
+    pairs = get_pairs(list(reference))
+    reference_distances = np.array([squared_distance(reference[a], reference[b]) for a, b in pairs])
+    reference_classes = [classify_distance(distance) for distance in reference_distances]
+
+    logger.info(f"{len(reference)} images, {len(pairs)} pairs")
+    logger.info(
+        f"{'max side':>9}{'s/img':>8}{'speedup':>9}{'agreement':>11}{'mean |Δd|':>11}{'max |Δd|':>10}{'emb. dist':>11}"
+    )
+    logger.info(f"{'full':>9}{reference_time:>8.3f}{1:>9.2f}{100:>10.1f}%{0:>11.4f}{0:>10.4f}{0:>11.4f}")
+    for max_side in args.max_sides:
+        embeddings, seconds_per_image = embed_folder(args.image_root, max_side=max_side)
+        distances = np.array([squared_distance(embeddings[a], embeddings[b]) for a, b in pairs])
+        classes = [classify_distance(distance) for distance in distances]
+        agreement = 100 * np.mean([a == b for a, b in zip(classes, reference_classes, strict=True)])
+        delta = np.abs(distances - reference_distances)
+        # distance of each embedding to the full resolution embedding of the same image
+        self_distance = np.mean([np.linalg.norm(embeddings[name] - reference[name]) for name in reference])
+        logger.info(
+            f"{max_side:>9}{seconds_per_image:>8.3f}{reference_time / seconds_per_image:>9.2f}{agreement:>10.1f}%"
+            f"{delta.mean():>11.4f}{delta.max():>10.4f}{self_distance:>11.4f}"
+        )
+        if args.verbose:
+            for (a, b), cls, reference_cls in zip(pairs, classes, reference_classes, strict=True):
+                if cls != reference_cls:
+                    logger.info(f"    {a} - {b}: {reference_cls} -> {cls}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,13 @@ setup_logging()
 
 app = FastAPI()
 
+
+@app.get("/health", tags=["Health"])
+async def health() -> dict[str, str]:
+    """Health check, which is answered on the event loop without touching the model or the database."""
+    return {"status": "ok"}
+
+
 embedding_controller = EmbeddingController()
 app.include_router(embedding_controller.router)
 
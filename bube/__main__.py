@@ -1,5 +1,3 @@
-import uvicorn
+from .cli import main
 
-from .config import config
-
-uvicorn.run("bube:app", host=config.BUBE_APP_HOST, port=config.BUBE_APP_PORT)
+main()
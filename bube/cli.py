@@ -0,0 +1,196 @@
+import argparse
+import itertools
+import logging
+from pathlib import Path
+
+import uvicorn
+
+from .config import config
+from .repository import EmbeddingProjection, NumpyVectorDB, PgVector, VectorDBRepository
+from .services import FEEXService
+from .services.image_embedding_model import ImageEmbeddingModel
+from .services.local_image_service import LocalImgReader
+
+logger = logging.getLogger(__name__)
+
+
+def serve(_args: argparse.Namespace) -> None:
+    """Start the API."""
+    uvicorn.run("bube:app", host=config.BUBE_APP_HOST, port=config.BUBE_APP_PORT)
+
+
+def fit_projection(args: argparse.Namespace) -> None:
+    """Fit the projection to short search vectors on the embeddings stored in `NUMPY_DB_PATH`."""
+    vector_db = NumpyVectorDB()
+    projection = EmbeddingProjection.fit(
+        vector_db.iter_embeddings(sample_size=args.sample_size),
+        dimensions=args.dimensions,
+        whiten=args.whiten,
+        model_fingerprint=ImageEmbeddingModel().model_fingerprint,
+    )
+    projection.save(args.output)
+    logger.info(
+        f"Saved projection to {projection.dimensions} dimensions to {args.output}, "
+        f"explained variance: {projection.explained_variance_ratio:.3f}"
+    )
+
+
+def ingest(args: argparse.Namespace) -> None:
+    """Embed and store all new or changed images of a local image root into the configured database."""
+    stats = FEEXService().ingest_local_images(
+        args.image_root, checkpoint_size=args.checkpoint_size, prune_deleted=args.prune_deleted
+    )
+    logger.info(f"Ingested {args.image_root}:\n{stats.summary()}")
+
+
+def cluster(args: argparse.Namespace) -> None:
+    """Find all duplicate clusters among the stored embeddings and write them as JSON report."""
+    report = FEEXService().find_duplicate_clusters(args.threshold, block_size=args.block_size, num_workers=args.workers)
+    Path(args.output).write_text(report.model_dump_json(indent=2))
+    logger.info(f"Wrote {report.num_of_clusters} clusters of {report.num_of_embeddings} embeddings to {args.output}")
+
+
+def build_index(_args: argparse.Namespace) -> None:
+    """Build the approximate search index of the configured database, while the API keeps serving requests."""
+    FEEXService().build_index()
+    logger.info(f"Built the index of the {config.DB_TYPE} database.")
+
+
+def export_model(args: argparse.Namespace) -> None:
+    """Export the variant of the model with uint8 input, which is used automatically once it exists."""
+    # onnx is only needed for the export, so it is not imported when the service starts
+    from .services.image_embedding_model.model_export import export_uint8_model  # noqa: PLC0415
+
+    output_path = export_uint8_model(args.model_path or ImageEmbeddingModel.default_model_path(), args.output)
+    logger.info(f"Exported the model with uint8 input and built-in preprocessing to {output_path}")
+
+
+def quantize_model(args: argparse.Namespace) -> None:
+    """Create a variant of the model with reduced precision and check its accuracy on the evaluation images."""
+    # onnx is only needed for the quantization, so it is not imported when the service starts
+    from .services.image_embedding_model.model_quantization import (  # noqa: PLC0415
+        evaluate_accuracy,
+        quantize_model,
+    )
+
+    model_path = args.model_path or ImageEmbeddingModel.default_model_path()
+    calibration_images = []
+    if args.calibration_root:
+        calibration_images = list(
+            itertools.islice(LocalImgReader.iter_image_files(args.calibration_root), args.calibration_size)
+        )
+    output_path = quantize_model(
+        model_path, args.precision, calibration_images, output_path=args.output, max_side=args.max_side
+    )
+    evaluation_images = sorted(LocalImgReader.iter_image_files(args.evaluation_root))
+    # the decisions are compared in the distance metric of the configured database, like the duplicate check
+    vector_db_class = PgVector if config.DB_TYPE == "pgvector" else VectorDBRepository
+    report = evaluate_accuracy(
+        model_path,
+        output_path,
+        evaluation_images,
+        max_side=args.max_side,
+        pairwise_distances=vector_db_class.pairwise_distances,
+    )
+    logger.info(f"Accuracy of {output_path} compared to {model_path}:\n{report.summary()}")
+    if not report.passed(args.max_distance_deviation, args.min_decision_agreement):
+        Path(output_path).unlink()
+        logger.error("The variant failed the accuracy gate and was removed.")
+        raise SystemExit(1)
+    logger.info(f"The variant passed the accuracy gate, it is used with MODEL_PRECISION={args.precision}.")
+
+
+def main() -> None:
+    """Parse the command line arguments and run the command, the API is started if no command is given."""
+    parser = argparse.ArgumentParser(prog="python -m bube")
+    parser.set_defaults(run=serve)
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("serve", help="start the API (default)").set_defaults(run=serve)
+
+    fit_parser = subparsers.add_parser(
+        "fit-projection", help="fit the PCA projection for candidate generation on the stored embeddings"
+    )
+    fit_parser.add_argument("--dimensions", type=int, default=config.EMBEDDING_PROJECTION_DIMENSIONS)
+    fit_parser.add_argument("--whiten", action="store_true", help="scale the projected dimensions to unit variance")
+    fit_parser.add_argument("--sample-size", type=int, default=100000, help="number of embeddings to fit on")
+    fit_parser.add_argument(
+        "--output", type=str, default=config.EMBEDDING_PROJECTION_PATH or EmbeddingProjection.default_path()
+    )
+    fit_parser.set_defaults(run=fit_projection)
+
+    ingest_parser = subparsers.add_parser(
+        "ingest", help="embed and store the images of a local image root, an interrupted run is resumed"
+    )
+    ingest_parser.add_argument("image_root", type=str)
+    ingest_parser.add_argument(
+        "--checkpoint-size",
+        type=int,
+        default=config.INGEST_CHECKPOINT_SIZE,
+        help="number of images which are stored with one upsert before the progress is saved",
+    )
+    ingest_parser.add_argument(
+        "--prune-deleted", action="store_true", help="delete the embeddings of images which don't exist anymore"
+    )
+    ingest_parser.set_defaults(run=ingest)
+
+    cluster_parser = subparsers.add_parser(
+        "cluster",
+        help="find all groups of duplicates among the stored embeddings and write a JSON report",
+        description="Find all groups of duplicates among the stored embeddings and write a JSON report. Chroma "
+        "collections with more than CLUSTER_CHROMA_MAX_EMBEDDINGS embeddings are refused, because Chroma can only be "
+        "read in offset pages, which takes quadratic time.",
+    )
+    cluster_parser.add_argument(
+        "--threshold",
+        type=float,
+        # the distance at which a file is reported as duplicate by the duplicate check
+        default=(100 - config.DUPLICATE_THRESHOLD_PERCENTAGE) / 100,
+        help="maximum distance of two files in the same cluster",
+    )
+    cluster_parser.add_argument("--output", type=str, default="duplicate_clusters.json")
+    cluster_parser.add_argument("--block-size", type=int, default=config.CLUSTER_BLOCK_SIZE)
+    cluster_parser.add_argument(
+        "--workers", type=int, default=config.CLUSTER_NUM_WORKERS, help="defaults to the number of CPU cores"
+    )
+    cluster_parser.set_defaults(run=cluster)
+
+    subparsers.add_parser(
+        "build-index", help="build the approximate search index of the configured database (pgvector, ivfpq)"
+    ).set_defaults(run=build_index)
+
+    export_parser = subparsers.add_parser(
+        "export-model", help="export the model with uint8 input and built-in preprocessing (requires onnx)"
+    )
+    export_parser.add_argument("--model-path", type=str, default=None, help="defaults to the bundled model")
+    export_parser.add_argument("--output", type=str, default=None, help="defaults to <model>.uint8.onnx")
+    export_parser.set_defaults(run=export_model)
+
+    quantize_parser = subparsers.add_parser(
+        "quantize-model",
+        help="create a variant of the model with reduced precision, which has to pass an accuracy gate (requires onnx)",
+    )
+    quantize_parser.add_argument("--precision", choices=["fp16", "int8", "int8-dynamic"], required=True)
+    quantize_parser.add_argument("--model-path", type=str, default=None, help="defaults to the bundled model")
+    quantize_parser.add_argument("--output", type=str, default=None, help="defaults to <model>.<precision>.onnx")
+    quantize_parser.add_argument(
+        "--calibration-root", type=str, default=None, help="representative images, required for int8"
+    )
+    quantize_parser.add_argument("--calibration-size", type=int, default=200, help="number of calibration images")
+    quantize_parser.add_argument(
+        "--evaluation-root", type=str, default="tests/test_assets", help="images the accuracy is evaluated on"
+    )
+    quantize_parser.add_argument("--max-side", type=int, default=config.MAX_INPUT_SIDE)
+    quantize_parser.add_argument("--max-distance-deviation", type=float, default=0.05)
+    quantize_parser.add_argument(
+        "--min-decision-agreement",
+        type=float,
+        default=0.99,
+        help="share of the image pairs whose decision (duplicate, suspicious or different) must not change",
+    )
+    quantize_parser.set_defaults(run=quantize_model)
+
+    args = parser.parse_args()
+    if args.run is not serve:
+        # the commands report their progress on the console as well
+        logging.getLogger().addHandler(logging.StreamHandler())
+    args.run(args)
@@ -12,7 +12,7 @@ class Config(BaseSettings):
     BUBE_APP_HOST: str = "0.0.0.0"  # noqa: S104
 
     # DB Config (if BUBE_MODE == "app")
-    DB_TYPE: Literal["chroma", "pgvector"] = "chroma"
+    DB_TYPE: Literal["chroma", "pgvector", "numpy", "ivfpq"] = "chroma"
 
     CHROMA_DB_MODE: Literal["embedded", "http"] = "embedded"
     CHROMA_DB_EMBEDDED_PATH: str = "./data/chroma_db/"
@@ -22,6 +22,23 @@ class Config(BaseSettings):
     CHROMA_DB_HTTP_SSL: bool = True
     CHROMA_DB_DATABASE_NAME: str = "img_embeddings"
 
+    NUMPY_DB_PATH: str = "./data/numpy_db/"
+    NUMPY_DB_BLOCK_SIZE: int = 65536
+    # Compressed IVF-PQ index (DB_TYPE == "ivfpq"), the embeddings are stored in NUMPY_DB_PATH
+    IVFPQ_DB_NLIST: int = 1024
+    # bytes of the PQ code per embedding, has to divide 2048
+    IVFPQ_DB_NUM_SUBSPACES: int = 64
+    IVFPQ_DB_NPROBE: int = 16
+    IVFPQ_DB_RERANK_FACTOR: int = 4
+    IVFPQ_DB_TRAIN_SIZE: int = 65536
+    IVFPQ_DB_TRAIN_ITERATIONS: int = 10
+    # Short search vectors for candidate generation (DB_TYPE == "numpy" or "ivfpq"), the projection is fitted with
+    # `python -m bube fit-projection` and stored next to the model, if no path is set
+    EMBEDDING_PROJECTION_ENABLED: bool = False
+    EMBEDDING_PROJECTION_PATH: Optional[str] = None
+    EMBEDDING_PROJECTION_DIMENSIONS: int = 256
+    EMBEDDING_PROJECTION_RERANK_FACTOR: int = 4
+
     PGVECTOR_DB_HOST: str = "localhost"
     PGVECTOR_DB_PORT: int = 5432
     PGVECTOR_DB_USER: str = "postgres"
@@ -29,11 +46,77 @@ class Config(BaseSettings):
     PGVECTOR_DB_HTTP_SSL: bool = False
     PGVECTOR_DB_DATABASE_NAME: str = "postgres"
     PGVECTOR_DB_TABLE_NAME: str = "feex_embeddings"
+    # connections kept open in the pool, defaults to PGVECTOR_DB_POOL_MAX_SIZE
+    PGVECTOR_DB_POOL_MIN_SIZE: Optional[int] = None
+    PGVECTOR_DB_POOL_MAX_SIZE: int = 8
+    PGVECTOR_DB_CONNECT_TIMEOUT: int = 10
+    # Half precision storage of the embeddings (halves the table size)
+    PGVECTOR_DB_STORAGE_TYPE: Literal["vector", "halfvec"] = "vector"
+    # Approximate nearest neighbour index, "exact" scans the whole table
+    PGVECTOR_DB_INDEX_TYPE: Literal["exact", "hnsw", "ivfflat", "hnsw_binary"] = "exact"
+    # with a binary index, limit * PGVECTOR_DB_RERANK_FACTOR candidates are re-ranked with the exact distance
+    PGVECTOR_DB_RERANK_FACTOR: int = 4
+    PGVECTOR_DB_HNSW_M: int = 16
+    PGVECTOR_DB_HNSW_EF_CONSTRUCTION: int = 64
+    PGVECTOR_DB_HNSW_EF_SEARCH: int = 100
+    PGVECTOR_DB_IVFFLAT_LISTS: int = 100
+    PGVECTOR_DB_IVFFLAT_PROBES: int = 10
 
     LOG_LEVEL: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = "DEBUG"
 
     USE_GPU: bool = True
+    # Precision of the model, the variants with reduced precision are created with `python -m bube quantize-model`
+    MODEL_PRECISION: Literal["float32", "fp16", "int8", "int8-dynamic"] = "float32"
+    # Use the variant of the model with uint8 input and built-in preprocessing, if it was exported next to the model
+    MODEL_UINT8_INPUT: bool = True
+    # Session options of ONNX Runtime, by default one thread per CPU core is used for each inference
+    ORT_INTRA_OP_NUM_THREADS: Optional[int] = None
+    # Threads for independent branches of the graph, only used with the parallel execution mode
+    ORT_INTER_OP_NUM_THREADS: Optional[int] = None
+    ORT_EXECUTION_MODE: Literal["sequential", "parallel"] = "sequential"
+    ORT_GRAPH_OPTIMIZATION_LEVEL: Literal["disable", "basic", "extended", "all"] = "all"
+    # The arena keeps freed memory for the next inferences, without it the memory of large images is released
+    ORT_ENABLE_CPU_MEM_ARENA: bool = True
+    ORT_ENABLE_MEM_PATTERN: bool = True
+    # If set, the optimized model is saved in this directory and loaded on the next start without optimizing it again
+    ORT_OPTIMIZED_MODEL_DIR: Optional[str] = None
+    # If set, images are downscaled while decoding, so that their longest side is at most MAX_INPUT_SIDE pixels
+    MAX_INPUT_SIDE: Optional[int] = None
     LOCAL_IMAGE_BATCH_SIZE: int = 4
+    # If set, batches are filled up to this number of pixels instead of LOCAL_IMAGE_BATCH_SIZE images
+    LOCAL_IMAGE_BATCH_PIXEL_BUDGET: Optional[int] = None
+    # If set, resolutions are rounded up to multiples of this size and images are padded to share batches
+    LOCAL_IMAGE_SHAPE_BUCKET_SIZE: Optional[int] = None
+    LOCAL_IMAGE_RECURSIVE: bool = True
+    LOCAL_IMAGE_PROBE_WORKERS: int = 16
+    # Manifest per image root, so re-runs only embed new or changed images
+    LOCAL_IMAGE_MANIFEST_ENABLED: bool = False
+    LOCAL_IMAGE_MANIFEST_PATH: str = "./data/manifests/"
+    LOCAL_IMAGE_MANIFEST_HASH: bool = False
+    LOCAL_IMAGE_DECODE_WORKERS: int = 4
+    LOCAL_IMAGE_PREFETCH_BATCHES: int = 2
+    # Number of images which `python -m bube ingest` stores with one upsert before the manifest is updated
+    INGEST_CHECKPOINT_SIZE: int = 10000
+    # Corpus-wide duplicate clustering (`python -m bube cluster`), the workers default to the number of CPU cores
+    CLUSTER_BLOCK_SIZE: int = 1024
+    CLUSTER_NEIGHBOUR_LIMIT: int = 50
+    CLUSTER_NUM_WORKERS: Optional[int] = None
+    # Chroma can only be read with offset pages, which makes a full pass quadratic, so larger collections are refused
+    CLUSTER_CHROMA_MAX_EMBEDDINGS: int = 200000
+
+    # Micro-batching of uploaded images from concurrent requests
+    BATCH_SCHEDULER_ENABLED: bool = True
+    BATCH_SCHEDULER_MAX_WAIT_MS: float = 10.0
+    BATCH_SCHEDULER_MAX_BATCH_SIZE: int = 4
+
+    # Thread pools which run blocking work outside the event loop of the API
+    INFERENCE_POOL_WORKERS: int = 4
+    DB_POOL_WORKERS: int = 8
+
+    # Content-addressed cache for embeddings, the disk tier is only used if a path is set
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_SIZE: int = 10000
+    EMBEDDING_CACHE_DISK_PATH: Optional[str] = None
 
     DUPLICATE_THRESHOLD_PERCENTAGE: int = 80
 
@@ -0,0 +1,4 @@
+from .execution_pools import run_in_db_pool, run_in_inference_pool
+from .staged_operation import Stage, StagedOperation, run_staged, run_staged_in_pools
+
+__all__ = ["Stage", "StagedOperation", "run_in_db_pool", "run_in_inference_pool", "run_staged", "run_staged_in_pools"]
@@ -0,0 +1,29 @@
+import asyncio
+import functools
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, TypeVar
+
+from ..config import config
+
+T = TypeVar("T")
+
+# Decoding (PIL) and inference (onnxruntime) release the GIL, so threads are sufficient to keep the event loop free.
+# Both stages share one pool, the database calls get their own pool so slow inference can't starve them.
+_inference_pool = ThreadPoolExecutor(max_workers=config.INFERENCE_POOL_WORKERS, thread_name_prefix="bube-inference")
+_db_pool = ThreadPoolExecutor(max_workers=config.DB_POOL_WORKERS, thread_name_prefix="bube-db")
+
+
+async def _run_in_pool(pool: ThreadPoolExecutor, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:  # noqa: ANN401
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, functools.partial(func, *args, **kwargs))
+
+
+async def run_in_inference_pool(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:  # noqa: ANN401
+    """Run a blocking decode or inference call in the bounded inference pool without blocking the event loop."""
+    return await _run_in_pool(_inference_pool, func, *args, **kwargs)
+
+
+async def run_in_db_pool(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:  # noqa: ANN401
+    """Run a blocking database call in the bounded database pool without blocking the event loop."""
+    return await _run_in_pool(_db_pool, func, *args, **kwargs)
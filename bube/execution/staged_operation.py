@@ -0,0 +1,53 @@
+import asyncio
+from collections.abc import Callable, Generator
+from concurrent.futures import Future
+from typing import Any, Literal, NamedTuple, TypeVar
+
+from .execution_pools import run_in_db_pool, run_in_inference_pool
+
+T = TypeVar("T")
+
+
+class Stage(NamedTuple):
+    """A blocking step of a service operation and the pool it runs in when the operation is run by the API.
+
+    A stage of the "futures" pool doesn't block: its function only submits work (e.g. to the batch scheduler) and
+    returns the futures, its result is the list of their results. The API waits for them on the event loop, so waiting
+    callers don't occupy a thread of the inference pool.
+    """
+
+    pool: Literal["inference", "db", "futures"]
+    func: Callable[[], Any]
+
+
+# An operation yields its stages one by one and receives the result of each stage, its return value is the result.
+# The orchestration is written once in the service, the caller decides where the stages run.
+StagedOperation = Generator[Stage, Any, T]
+
+
+def run_staged(operation: StagedOperation[T]) -> T:
+    """Run all stages of an operation one after another in the calling thread."""
+    try:
+        stage = next(operation)
+        while True:
+            result = stage.func()
+            if stage.pool == "futures":
+                result = [future.result() for future in result]
+            stage = operation.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def run_staged_in_pools(operation: StagedOperation[T]) -> T:
+    """Run each stage of an operation in its pool, so the event loop stays responsive while the stages run."""
+    pools = {"inference": run_in_inference_pool, "db": run_in_db_pool, "futures": _wait_for_futures}
+    try:
+        stage = next(operation)
+        while True:
+            stage = operation.send(await pools[stage.pool](stage.func))
+    except StopIteration as stop:
+        return stop.value
+
+
+async def _wait_for_futures(submit: Callable[[], list[Future]]) -> list[Any]:
+    return list(await asyncio.gather(*[asyncio.wrap_future(future) for future in submit()]))
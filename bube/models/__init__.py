@@ -1,4 +1,24 @@
-from .duplicate_report import DuplicateReport, DuplicateReportPart, SuspiciousFile
+from .cluster_report import ClusterReport, DuplicateCluster
+from .duplicate_report import (
+    SUSPICIOUS_DISTANCE,
+    DuplicateReport,
+    DuplicateReportPart,
+    SuspiciousFile,
+    classify_distance,
+)
+from .embedding_batch import EmbeddingBatch, EmbeddingRecord
 from .image_embedding import ImageEmbedding, ImageEmbeddingNeighbour
 
-__all__ = ["DuplicateReport", "DuplicateReportPart", "ImageEmbedding", "ImageEmbeddingNeighbour", "SuspiciousFile"]
+__all__ = [
+    "SUSPICIOUS_DISTANCE",
+    "ClusterReport",
+    "DuplicateCluster",
+    "DuplicateReport",
+    "DuplicateReportPart",
+    "EmbeddingBatch",
+    "EmbeddingRecord",
+    "ImageEmbedding",
+    "ImageEmbeddingNeighbour",
+    "SuspiciousFile",
+    "classify_distance",
+]
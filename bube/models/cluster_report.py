@@ -0,0 +1,17 @@
+from pydantic import BaseModel
+
+
+class DuplicateCluster(BaseModel):
+    """Group of stored files which are connected by distances below the threshold."""
+
+    num_of_files: int
+    filenames: list[str]
+
+
+class ClusterReport(BaseModel):
+    """Report containing all duplicate clusters of the stored embeddings, the largest clusters first."""
+
+    threshold: float
+    num_of_embeddings: int
+    num_of_clusters: int
+    clusters: list[DuplicateCluster]
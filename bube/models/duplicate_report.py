@@ -1,7 +1,25 @@
+from typing import Literal
+
 from pydantic import BaseModel
 
+from ..config import config
 from .image_embedding import ImageEmbeddingNeighbour
 
+# neighbours up to this distance (in the metric of the vector database) are reported by the duplicate check
+SUSPICIOUS_DISTANCE = 0.6
+
+
+def get_duplicate_chance(distance: float) -> int:
+    """Chance in percent that an image with the given distance is a duplicate."""
+    return int((1 - distance) * 100)
+
+
+def classify_distance(distance: float) -> Literal["duplicate", "suspicious", "different"]:
+    """Decision of the duplicate check for a pair of images with the given distance."""
+    if get_duplicate_chance(distance) >= config.DUPLICATE_THRESHOLD_PERCENTAGE:
+        return "duplicate"
+    return "suspicious" if distance <= SUSPICIOUS_DISTANCE else "different"
+
 
 class SuspiciousFile(BaseModel):
     """A suspicious file that is a potential duplicate of another file."""
@@ -16,7 +34,7 @@ class SuspiciousFile(BaseModel):
         return cls(
             filename=neighbour.filename,
             distance=neighbour.distance,
-            duplicate_chance_in_percent=int((1 - neighbour.distance) * 100),
+            duplicate_chance_in_percent=get_duplicate_chance(neighbour.distance),
         )
 
 
@@ -0,0 +1,109 @@
+from collections.abc import Iterable, Iterator, Sequence
+from typing import Union, overload
+
+import numpy as np
+
+from .image_embedding import ImageEmbedding
+
+
+class EmbeddingRecord:
+    """Embedding of a single image of an `EmbeddingBatch`, the embedding is a view of a row of the batch."""
+
+    __slots__ = ("embedding", "filename")
+
+    embedding: np.ndarray
+    filename: str
+
+    def __init__(self, filename: str, embedding: np.ndarray):
+        self.filename = filename
+        self.embedding = embedding
+
+    def __repr__(self) -> str:
+        """Short representation without the values of the embedding."""
+        return f"EmbeddingRecord(filename={self.filename!r}, dimensions={len(self.embedding)})"
+
+
+class EmbeddingBatch:
+    """Embeddings of multiple images as one contiguous float32 matrix and the filenames of its rows.
+
+    The services and repositories pass embeddings as batch, so the embeddings aren't converted to Python floats and
+    validated one by one. The pydantic `ImageEmbedding` is only created at the API boundary (`to_image_embeddings`).
+    Iterating over a batch yields light `EmbeddingRecord` objects, which have a `filename` and an `embedding` like
+    `ImageEmbedding`.
+    """
+
+    __slots__ = ("embeddings", "filenames")
+
+    embeddings: np.ndarray
+    filenames: list[str]
+
+    def __init__(self, filenames: Sequence[str], embeddings: np.ndarray | Sequence[np.ndarray]):
+        """Create a batch.
+
+        Args:
+            filenames (Sequence[str]): filename of each embedding
+            embeddings (np.ndarray | Sequence[np.ndarray]): matrix of shape (n, dimensions) or n embeddings
+        """
+        self.filenames = list(filenames)
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if not self.filenames and self.embeddings.ndim != 2:
+            # an empty list of embeddings
+            self.embeddings = self.embeddings.reshape(0, 0)
+        if self.embeddings.ndim != 2 or len(self.embeddings) != len(self.filenames):
+            error_msg = f"Expected {len(self.filenames)} embeddings, got an array of shape {self.embeddings.shape}."
+            raise ValueError(error_msg)
+
+    @classmethod
+    def from_pairs(cls, embeddings: Iterable[tuple[str, np.ndarray]]) -> "EmbeddingBatch":
+        """Create a batch from pairs of filename and embedding."""
+        pairs = list(embeddings)
+        return cls([filename for filename, _ in pairs], [embedding for _, embedding in pairs])
+
+    @classmethod
+    def of(cls, image_embeddings: Union["EmbeddingBatch", Iterable[ImageEmbedding]]) -> "EmbeddingBatch":
+        """Return the batch itself or convert image embeddings (or records) to a batch."""
+        if isinstance(image_embeddings, EmbeddingBatch):
+            return image_embeddings
+        return cls.from_pairs((emb.filename, emb.embedding) for emb in image_embeddings)
+
+    @classmethod
+    def concatenate(cls, batches: Sequence["EmbeddingBatch"]) -> "EmbeddingBatch":
+        """Join batches into a single batch, in the given order."""
+        non_empty = [batch for batch in batches if len(batch)]
+        if len(non_empty) == 1:
+            return non_empty[0]
+        return cls(
+            [filename for batch in non_empty for filename in batch.filenames],
+            np.concatenate([batch.embeddings for batch in non_empty]) if non_empty else [],
+        )
+
+    def __len__(self) -> int:
+        """Number of embeddings."""
+        return len(self.filenames)
+
+    def __iter__(self) -> Iterator[EmbeddingRecord]:
+        """Iterate over the records of the embeddings."""
+        return map(EmbeddingRecord, self.filenames, self.embeddings)
+
+    @overload
+    def __getitem__(self, index: int) -> EmbeddingRecord: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "EmbeddingBatch": ...
+
+    def __getitem__(self, index: int | slice) -> Union[EmbeddingRecord, "EmbeddingBatch"]:
+        """Record of a single embedding or a batch of a slice of the embeddings (a view, not a copy)."""
+        if isinstance(index, slice):
+            return EmbeddingBatch(self.filenames[index], self.embeddings[index])
+        return EmbeddingRecord(self.filenames[index], self.embeddings[index])
+
+    def __repr__(self) -> str:
+        """Short representation without the values of the embeddings."""
+        return f"EmbeddingBatch(size={len(self)}, dimensions={self.embeddings.shape[1]})"
+
+    def to_image_embeddings(self) -> list[ImageEmbedding]:
+        """Convert the batch to pydantic models, e.g. for the response of the API."""
+        return [
+            ImageEmbedding(embedding=embedding, filename=filename)
+            for filename, embedding in zip(self.filenames, self.embeddings.tolist())
+        ]
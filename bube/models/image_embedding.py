@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
 
@@ -9,6 +11,10 @@ class ImageEmbedding(BaseModel):
 
 
 class ImageEmbeddingNeighbour(ImageEmbedding):
-    """Extension for ImageEmbedding to include the distance to the original image."""
+    """Extension for ImageEmbedding to include the distance to the original image.
+
+    The embedding is only set if it was explicitly requested from the database.
+    """
 
+    embedding: Optional[list[float]] = None
     distance: float
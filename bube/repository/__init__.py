@@ -1,5 +1,15 @@
 from .embedded_chroma_db import EmbeddedChromaDB
+from .embedding_projection import EmbeddingProjection
+from .ivfpq_vector_db import IvfPqVectorDB
+from .numpy_vector_db import NumpyVectorDB
 from .pgvector import PgVector
 from .vector_db_repository import VectorDBRepository
 
-__all__ = ["EmbeddedChromaDB", "PgVector", "VectorDBRepository"]
+__all__ = [
+    "EmbeddedChromaDB",
+    "EmbeddingProjection",
+    "IvfPqVectorDB",
+    "NumpyVectorDB",
+    "PgVector",
+    "VectorDBRepository",
+]
@@ -1,10 +1,12 @@
 import logging
+from collections.abc import Iterator
 from typing import Optional
 
 import chromadb
+import numpy as np
 
 from ..config import config
-from ..models import ImageEmbedding, ImageEmbeddingNeighbour
+from ..models import EmbeddingBatch, ImageEmbedding, ImageEmbeddingNeighbour
 from .vector_db_repository import VectorDBRepository
 
 
@@ -40,16 +42,35 @@ class EmbeddedChromaDB(VectorDBRepository):
             ssl=config.CHROMA_DB_HTTP_SSL,
         )
 
-    def store_embeddings(self, image_embeddings: list[ImageEmbedding]) -> None:
+    def health_check(self) -> bool:
+        """Check if the ChromaDB can be reached."""
+        try:
+            self._db.heartbeat()
+        except Exception as e:  # noqa: BLE001 - the HTTP client raises different errors depending on the failure
+            self._logger.warning(f"ChromaDB health check failed: {e}")
+            return False
+        return True
+
+    def store_embeddings(self, image_embeddings: EmbeddingBatch | list[ImageEmbedding]) -> None:
         """Store image embeddings in the ChromaDB."""
+        image_embeddings = EmbeddingBatch.of(image_embeddings)
         if not image_embeddings:
             return
-        ids = [emb.filename for emb in image_embeddings]
-        embeddings = [emb.embedding for emb in image_embeddings]
-        self._db_collection.upsert(ids=ids, documents=ids, embeddings=embeddings)
+        ids = image_embeddings.filenames
+        self._db_collection.upsert(ids=ids, documents=ids, embeddings=image_embeddings.embeddings)
+
+    def delete_embeddings(self, filenames: list[str]) -> None:
+        """Delete the embeddings of the given filenames from the ChromaDB."""
+        if not filenames:
+            return
+        self._db_collection.delete(ids=filenames)
 
     def get_neighbours(
-        self, image_embedding: ImageEmbedding, threshold: Optional[float] = None, limit: int = 50
+        self,
+        image_embedding: ImageEmbedding,
+        threshold: Optional[float] = None,
+        limit: int = 50,
+        include_embeddings: bool = False,
     ) -> list[ImageEmbeddingNeighbour]:
         """Get the neighbours of an image embedding.
 
@@ -60,32 +81,102 @@ class EmbeddedChromaDB(VectorDBRepository):
             image_embedding (ImageEmbedding): The image embedding to search for.
             threshold (Optional[float]): The maximum distance to consider a neighbour. If None, no threshold is applied.
             limit (int): The maximum number of neighbours to return. Defaults to 10.
+            include_embeddings (bool): If True, the embeddings of the neighbours are returned as well.
 
         Returns:
             list[ImageEmbeddingNeighbour]: A list of ImageEmbeddingNeighbour objects.
         """
-        neighbours = self.get_neighbours_top_n(image_embedding, limit)
+        neighbours = self.get_neighbours_top_n(image_embedding, limit, include_embeddings=include_embeddings)
         if threshold is None:
             return neighbours
         return [neighbour for neighbour in neighbours if neighbour.distance <= threshold]
 
-    def get_neighbours_top_n(self, image_embedding: ImageEmbedding, limit: int = 20) -> list[ImageEmbeddingNeighbour]:
+    def get_neighbours_batch(
+        self,
+        image_embeddings: EmbeddingBatch | list[ImageEmbedding],
+        threshold: Optional[float] = None,
+        limit: int = 50,
+        include_embeddings: bool = False,
+    ) -> list[list[ImageEmbeddingNeighbour]]:
+        """Get the neighbours of multiple image embeddings with a single query.
+
+        Args:
+            image_embeddings (EmbeddingBatch | list[ImageEmbedding]): The image embeddings to search for.
+            threshold (Optional[float]): The maximum distance to consider a neighbour. If None, no threshold is applied.
+            limit (int): The maximum number of neighbours to return per image embedding. Defaults to 50.
+            include_embeddings (bool): If True, the embeddings of the neighbours are returned as well.
+
+        Returns:
+            list[list[ImageEmbeddingNeighbour]]: The neighbours of each image embedding, in the order of the input.
+        """
+        if not image_embeddings:
+            return []
+        query_res = self._query(EmbeddingBatch.of(image_embeddings).embeddings, limit, include_embeddings)
+        neighbours_batch = [self._convert_chroma_results(query_res, index) for index in range(len(image_embeddings))]
+        if threshold is None:
+            return neighbours_batch
+        return [
+            [neighbour for neighbour in neighbours if neighbour.distance <= threshold]
+            for neighbours in neighbours_batch
+        ]
+
+    def get_neighbours_top_n(
+        self, image_embedding: ImageEmbedding, limit: int = 20, include_embeddings: bool = False
+    ) -> list[ImageEmbeddingNeighbour]:
         """Get the n closest neighbours of an image embedding."""
-        query_res = self._db_collection.query(
-            query_embeddings=[image_embedding.embedding], n_results=limit, include=["distances", "embeddings"]
-        )
+        query_res = self._query([image_embedding.embedding], limit, include_embeddings)
         return self._convert_chroma_results(query_res)
 
     def get_neighbours_threshold(
-        self, image_embedding: ImageEmbedding, threshold: float
+        self, image_embedding: ImageEmbedding, threshold: float, include_embeddings: bool = False
     ) -> list[ImageEmbeddingNeighbour]:
         """Get the neighbours of an image embedding with a distance threshold."""
-        return self.get_neighbours(image_embedding, threshold, limit=100)
+        return self.get_neighbours(image_embedding, threshold, limit=100, include_embeddings=include_embeddings)
+
+    def iter_embedding_blocks(self, block_size: int) -> Iterator[tuple[list[str], np.ndarray]]:
+        """Iterate over the stored embeddings in pages of `block_size` embeddings, together with their filenames.
 
-    def _convert_chroma_results(self, query_res: chromadb.QueryResult) -> list[ImageEmbeddingNeighbour]:
+        Chroma can only page with an offset, which skips all previous embeddings for every page, so a full pass is
+        quadratic in the size of the collection. Thus, collections with more than `CLUSTER_CHROMA_MAX_EMBEDDINGS`
+        embeddings are refused, these should be stored in the NumPy or pgvector database instead.
+
+        Raises:
+            ValueError: if the collection is larger than `CLUSTER_CHROMA_MAX_EMBEDDINGS`
+        """
+        num_embeddings = self._db_collection.count()
+        if num_embeddings > config.CLUSTER_CHROMA_MAX_EMBEDDINGS:
+            error_msg = (
+                f"The Chroma collection contains {num_embeddings} embeddings, reading more than "
+                f"CLUSTER_CHROMA_MAX_EMBEDDINGS ({config.CLUSTER_CHROMA_MAX_EMBEDDINGS}) takes quadratic time. "
+                "Use DB_TYPE=numpy, ivfpq or pgvector for large corpora."
+            )
+            raise ValueError(error_msg)
+        offset = 0
+        while True:
+            page = self._db_collection.get(limit=block_size, offset=offset, include=["embeddings"])
+            if not page["ids"]:
+                return
+            yield page["ids"], np.asarray(page["embeddings"], dtype=np.float32)
+            offset += len(page["ids"])
+
+    def _query(
+        self, query_embeddings: np.ndarray | list[list[float]], limit: int, include_embeddings: bool
+    ) -> chromadb.QueryResult:
+        # the ids are always returned, the embeddings are only loaded from the collection if they are needed
+        include = ["distances", "embeddings"] if include_embeddings else ["distances"]
+        return self._db_collection.query(query_embeddings=query_embeddings, n_results=limit, include=include)
+
+    def _convert_chroma_results(
+        self, query_res: chromadb.QueryResult, query_index: int = 0
+    ) -> list[ImageEmbeddingNeighbour]:
         # a list comprehension to convert the results to ImageEmbeddingNeighbour would be messy, thus it's a for loop
         neighbours = []
-        for filename, emb, distance in zip(query_res["ids"][0], query_res["embeddings"][0], query_res["distances"][0]):
+        filenames = query_res["ids"][query_index]
+        distances = query_res["distances"][query_index]
+        embeddings = (
+            query_res["embeddings"][query_index] if query_res["embeddings"] is not None else [None] * len(filenames)
+        )
+        for filename, emb, distance in zip(filenames, embeddings, distances):
             neighbours.append(ImageEmbeddingNeighbour(filename=filename, embedding=emb, distance=distance))
         return neighbours
 
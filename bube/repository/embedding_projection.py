@@ -0,0 +1,134 @@
+import hashlib
+import importlib.resources as impresources
+from collections.abc import Iterable
+from pathlib import Path
+
+import numpy as np
+
+
+class EmbeddingProjection:
+    """PCA projection of the 2048-dimensional embeddings to short search vectors.
+
+    The projection is fitted offline on stored embeddings (`python -m bube fit-projection`) and saved next to the model,
+    together with the fingerprint of the model it was fitted for. Repositories only use the short vectors to generate
+    candidates, which are re-scored with the full embeddings, so the stored and published embeddings don't change.
+    Without whitening, the projected distance is never larger than the full distance.
+    """
+
+    mean: np.ndarray
+    components: np.ndarray
+    whiten: bool
+    model_fingerprint: str
+    explained_variance_ratio: float
+
+    def __init__(
+        self,
+        mean: np.ndarray,
+        components: np.ndarray,
+        whiten: bool = False,
+        model_fingerprint: str = "",
+        explained_variance_ratio: float = 1.0,
+    ):
+        """Create a projection.
+
+        Args:
+            mean (np.ndarray): mean of the embeddings, shape (2048,)
+            components (np.ndarray): projection matrix, shape (dimensions, 2048). If whitened, the components are scaled
+                to unit variance.
+            whiten (bool, optional): if the components are whitened
+            model_fingerprint (str, optional): fingerprint of the model the projection was fitted for
+            explained_variance_ratio (float, optional): share of the variance of the embeddings kept by the projection
+        """
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+        self.whiten = whiten
+        self.model_fingerprint = model_fingerprint
+        self.explained_variance_ratio = explained_variance_ratio
+
+    @property
+    def dimensions(self) -> int:
+        """Number of dimensions of the projected vectors."""
+        return len(self.components)
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash of the projection, which identifies the projected vectors computed with it."""
+        projection_hash = hashlib.blake2b(digest_size=16)
+        projection_hash.update(self.mean.tobytes())
+        projection_hash.update(self.components.tobytes())
+        return projection_hash.hexdigest()
+
+    def project(self, embeddings: np.ndarray) -> np.ndarray:
+        """Project embeddings of shape (n, 2048) to shape (n, dimensions)."""
+        return ((np.asarray(embeddings, dtype=np.float32) - self.mean) @ self.components.T).astype(np.float32)
+
+    @classmethod
+    def fit(
+        cls, embedding_blocks: Iterable[np.ndarray], dimensions: int, whiten: bool = False, model_fingerprint: str = ""
+    ) -> "EmbeddingProjection":
+        """Fit the projection on embeddings, which are processed block by block.
+
+        Only the sum and the Gram matrix of the embeddings are accumulated, so the embeddings don't have to fit into
+        memory at once.
+
+        Args:
+            embedding_blocks (Iterable[np.ndarray]): blocks of embeddings, each of shape (n, 2048)
+            dimensions (int): number of dimensions of the projected vectors
+            whiten (bool, optional): if the projected dimensions should be scaled to unit variance
+            model_fingerprint (str, optional): fingerprint of the model the embeddings were computed with
+
+        Returns:
+            EmbeddingProjection: the fitted projection
+        """
+        num_embeddings, embedding_sum, gram = 0, None, None
+        for embedding_block in embedding_blocks:
+            block = np.asarray(embedding_block, dtype=np.float64)
+            if embedding_sum is None:
+                embedding_sum, gram = np.zeros(block.shape[1]), np.zeros((block.shape[1], block.shape[1]))
+            num_embeddings += len(block)
+            embedding_sum += block.sum(axis=0)
+            gram += block.T @ block
+        if num_embeddings <= dimensions:
+            error_msg = f"At least {dimensions + 1} embeddings are needed to fit {dimensions} dimensions."
+            raise ValueError(error_msg)
+
+        mean = embedding_sum / num_embeddings
+        covariance = gram / num_embeddings - np.outer(mean, mean)
+        # eigh returns the eigenvalues in ascending order
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        eigenvalues = np.maximum(eigenvalues[::-1], 0)
+        components = eigenvectors[:, ::-1][:, :dimensions].T
+        if whiten:
+            components = components / np.sqrt(eigenvalues[:dimensions] + 1e-12)[:, np.newaxis]
+        explained_variance_ratio = float(eigenvalues[:dimensions].sum() / max(eigenvalues.sum(), 1e-12))
+        return cls(mean, components, whiten, model_fingerprint, explained_variance_ratio)
+
+    def save(self, path: str) -> None:
+        """Save the projection as npz file."""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with Path(path).open("wb") as f:
+            np.savez(
+                f,
+                mean=self.mean,
+                components=self.components,
+                whiten=self.whiten,
+                model_fingerprint=self.model_fingerprint,
+                explained_variance_ratio=self.explained_variance_ratio,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "EmbeddingProjection":
+        """Load a projection, which was saved with `save`."""
+        with np.load(path) as projection:
+            return cls(
+                projection["mean"],
+                projection["components"],
+                bool(projection["whiten"]),
+                str(projection["model_fingerprint"]),
+                float(projection["explained_variance_ratio"]),
+            )
+
+    @staticmethod
+    def default_path() -> str:
+        """Path of the projection next to the default model."""
+        return str(impresources.files("bube.services.image_embedding_model") / "resnet_mac_model.pca.npz")
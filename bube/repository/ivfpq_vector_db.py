@@ -0,0 +1,396 @@
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from ..config import config
+from .embedding_projection import EmbeddingProjection
+from .numpy_vector_db import EMBEDDING_DIMENSIONS, NumpyVectorDB
+
+# number of centroids of each product quantizer, so each sub-vector is encoded with one byte
+PQ_CENTROIDS = 256
+
+
+def _assign(data: np.ndarray, centroids: np.ndarray, block_size: int = 8192) -> np.ndarray:
+    """Get the index of the closest centroid (squared L2) of each row of the data."""
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    assignment = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), block_size):
+        # ||x||^2 is the same for all centroids and can be ignored
+        distances = data[start : start + block_size] @ centroids.T
+        distances *= -2
+        distances += centroid_norms[np.newaxis, :]
+        assignment[start : start + block_size] = np.argmin(distances, axis=1)
+    return assignment
+
+
+def _kmeans(data: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """Train k centroids with Lloyd's algorithm, empty clusters are re-seeded with random rows."""
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _assign(data, centroids)
+        counts = np.bincount(assignment, minlength=k)
+        filled = np.flatnonzero(counts)
+        starts = (np.cumsum(counts) - counts)[filled]
+        sums = np.add.reduceat(data[np.argsort(assignment, kind="stable")], starts, axis=0)
+        centroids[filled] = sums / counts[filled, np.newaxis]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), size=len(empty), replace=False)]
+    return centroids
+
+
+def _encode(embeddings: np.ndarray, centroids: np.ndarray, codebooks: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Get the inverted list and the PQ code of the residual of each embedding."""
+    list_ids = _assign(embeddings, centroids)
+    residuals = (embeddings - centroids[list_ids]).reshape(len(embeddings), len(codebooks), -1)
+    codes = np.empty((len(embeddings), len(codebooks)), dtype=np.uint8)
+    for m in range(len(codebooks)):
+        codes[:, m] = _assign(np.ascontiguousarray(residuals[:, m]), codebooks[m])
+    return list_ids, codes
+
+
+class IvfPqVectorDB(NumpyVectorDB):
+    """Repository class for an in-process vector database with a compressed IVF-PQ index.
+
+    The embeddings are stored like in `NumpyVectorDB` (and in the same files), but they are only read from disk to
+    re-rank a short list. The search runs on a compressed index, which is trained on the stored embeddings:
+    a coarse k-means quantizer splits the embeddings into `IVFPQ_DB_NLIST` inverted lists and the residual to the list
+    centroid is product-quantized into `IVFPQ_DB_NUM_SUBSPACES` bytes. A query scans the `IVFPQ_DB_NPROBE` closest lists
+    with lookup tables of the approximate distances, then the best `limit * IVFPQ_DB_RERANK_FACTOR` candidates are
+    re-ranked with the exact (squared L2) distance.
+
+    The index is trained in a background thread once `IVFPQ_DB_TRAIN_SIZE` embeddings are stored, or explicitly with
+    `train_index` (`python -m bube build-index`). Training doesn't block the other operations of the database: until
+    the new index is complete, the search stays exact (or uses the previous index).
+
+    In memory, the index needs `IVFPQ_DB_NUM_SUBSPACES` bytes for the PQ code, 4 bytes for the list id and 4 bytes for
+    the row in the inverted list of each embedding, plus the valid flag of `NumpyVectorDB` (see `bytes_per_embedding`).
+    """
+
+    _nlist: int
+    _num_subspaces: int
+    _nprobe: int
+    _rerank_factor: int
+    _train_size: int
+    _train_iterations: int
+    _index_path: Path
+    _codes_path: Path
+    _list_ids_path: Path
+    # coarse quantizer (nlist, dimensions) and product quantizers (subspaces, 256, dimensions / subspaces)
+    _centroids: Optional[np.ndarray]
+    _codebooks: Optional[np.ndarray]
+    _codebook_norms: Optional[np.ndarray]
+    # PQ codes and inverted list of each row of the matrix
+    _codes: np.ndarray
+    _list_ids: np.ndarray
+    # rows of each inverted list, rows which moved to another list are skipped while searching
+    _list_rows: list[np.ndarray]
+    # only one training runs at a time, the rows which are stored meanwhile are encoded after the training
+    _training_lock: threading.Lock
+    _training_thread: Optional[threading.Thread]
+    _rows_stored_while_training: Optional[list[np.ndarray]]
+    # incremented when the database is cleared, so a running training discards its index
+    _generation: int
+
+    def __init__(self, projection: Optional[EmbeddingProjection] = None):
+        """Open (or create) the database in `NUMPY_DB_PATH` and load the index.
+
+        Args:
+            projection (EmbeddingProjection, optional): projection to short vectors, which are only used for the exact
+                search until the index is trained
+        """
+        if EMBEDDING_DIMENSIONS % config.IVFPQ_DB_NUM_SUBSPACES:
+            error_msg = f"IVFPQ_DB_NUM_SUBSPACES ({config.IVFPQ_DB_NUM_SUBSPACES}) must divide {EMBEDDING_DIMENSIONS}."
+            raise ValueError(error_msg)
+        self._nlist = config.IVFPQ_DB_NLIST
+        self._num_subspaces = config.IVFPQ_DB_NUM_SUBSPACES
+        self._nprobe = config.IVFPQ_DB_NPROBE
+        self._rerank_factor = config.IVFPQ_DB_RERANK_FACTOR
+        self._train_size = max(config.IVFPQ_DB_TRAIN_SIZE, self._nlist, PQ_CENTROIDS)
+        self._train_iterations = config.IVFPQ_DB_TRAIN_ITERATIONS
+        db_path = Path(config.NUMPY_DB_PATH)
+        self._index_path = db_path / "ivfpq_index.npz"
+        self._codes_path = db_path / "ivfpq_codes.u8"
+        self._list_ids_path = db_path / "ivfpq_lists.i32"
+        self._training_lock = threading.Lock()
+        self._training_thread = None
+        self._rows_stored_while_training = None
+        self._generation = 0
+        super().__init__(projection)
+        self._setup_index()
+
+    def _setup_index(self) -> None:
+        self._reset_index()
+        if self._index_path.exists():
+            with np.load(self._index_path) as index:
+                centroids, codebooks = index["centroids"], index["codebooks"]
+            if centroids.shape[0] == self._nlist and codebooks.shape[0] == self._num_subspaces:
+                self._set_quantizers(centroids, codebooks)
+            else:
+                self._logger.info("IVF-PQ settings changed since the index was trained. Discarding the index.")
+                self._remove_index_files()
+
+        if self._centroids is None:
+            if np.count_nonzero(self._valid_rows) >= self._train_size:
+                self._start_training()
+            return
+
+        self._truncate_partial_row(self._codes_path, self._num_subspaces)
+        self._truncate_partial_row(self._list_ids_path, np.dtype(np.int32).itemsize)
+        self._map_codes()
+        # an interrupted write can leave the files with a different number of rows
+        num_coded = min(len(self._codes), len(self._list_ids), len(self._matrix))
+        if len(self._codes) != num_coded or len(self._list_ids) != num_coded:
+            self._codes, self._list_ids = None, None
+            with self._codes_path.open("r+b") as f:
+                f.truncate(num_coded * self._num_subspaces)
+            with self._list_ids_path.open("r+b") as f:
+                f.truncate(num_coded * np.dtype(np.int32).itemsize)
+            self._map_codes()
+        self._list_rows = self._build_list_rows(self._list_ids)
+        # rows which were stored after the last encoding (e.g. an interrupted write) are encoded now
+        if num_coded < len(self._matrix):
+            self._index_rows(np.arange(num_coded, len(self._matrix)))
+        self._logger.info(f"Loaded IVF-PQ index with {self._nlist} lists and {num_coded} encoded embeddings.")
+
+    def _build_list_rows(self, list_ids: np.ndarray) -> list[np.ndarray]:
+        """Build the inverted lists with one sort instead of appending row by row."""
+        order = np.argsort(list_ids, kind="stable").astype(np.int32)
+        bounds = np.cumsum(np.bincount(list_ids, minlength=self._nlist))
+        return np.split(order, bounds[:-1])
+
+    def _reset_index(self) -> None:
+        self._centroids, self._codebooks, self._codebook_norms = None, None, None
+        self._codes = np.empty((0, self._num_subspaces), dtype=np.uint8)
+        self._list_ids = np.empty(0, dtype=np.int32)
+        self._list_rows = [np.empty(0, dtype=np.int32) for _ in range(self._nlist)]
+
+    def _remove_index_files(self) -> None:
+        for path in (self._index_path, self._codes_path, self._list_ids_path):
+            path.unlink(missing_ok=True)
+
+    def _set_quantizers(self, centroids: np.ndarray, codebooks: np.ndarray) -> None:
+        self._centroids = centroids.astype(np.float32)
+        self._codebooks = codebooks.astype(np.float32)
+        self._codebook_norms = np.einsum("mkd,mkd->mk", self._codebooks, self._codebooks)
+
+    def _map_codes(self) -> None:
+        """Map the files of the PQ codes and list ids, like the embeddings matrix."""
+        self._codes_path.touch(exist_ok=True)
+        self._list_ids_path.touch(exist_ok=True)
+        num_rows = self._codes_path.stat().st_size // self._num_subspaces
+        self._codes = (
+            np.memmap(self._codes_path, dtype=np.uint8, mode="r+", shape=(num_rows, self._num_subspaces))
+            if num_rows
+            else np.empty((0, self._num_subspaces), dtype=np.uint8)
+        )
+        num_rows = self._list_ids_path.stat().st_size // np.dtype(np.int32).itemsize
+        self._list_ids = (
+            np.memmap(self._list_ids_path, dtype=np.int32, mode="r+", shape=(num_rows,))
+            if num_rows
+            else np.empty(0, dtype=np.int32)
+        )
+
+    @property
+    def is_trained(self) -> bool:
+        """True if the IVF-PQ index is trained, otherwise the search is exact."""
+        return self._centroids is not None
+
+    @property
+    def bytes_per_embedding(self) -> int:
+        """Memory per embedding: PQ code, list id, row in the inverted list and the valid flag of the row."""
+        return self._num_subspaces + 2 * np.dtype(np.int32).itemsize + np.dtype(bool).itemsize
+
+    def build_index(self) -> None:
+        """Train the index, or wait for the training which was started in the background."""
+        with self._lock:
+            training_thread = self._training_thread
+        if training_thread is not None:
+            training_thread.join()
+        else:
+            self.train_index()
+
+    def _start_training(self) -> None:
+        """Train the index in a background thread, unless a training is already running."""
+        if self._training_thread is not None and self._training_thread.is_alive():
+            return
+        self._training_thread = threading.Thread(target=self._train_in_background, name="ivfpq-training", daemon=True)
+        self._training_thread.start()
+
+    def _train_in_background(self) -> None:
+        try:
+            self.train_index()
+        except Exception:
+            self._logger.exception("Training of the IVF-PQ index failed.")
+
+    def train_index(self) -> None:
+        """Train the coarse and product quantizers on a sample of the stored embeddings and encode all embeddings.
+
+        The quantizers are trained and the embeddings are encoded into new files without holding the lock of the
+        database, the new index replaces the previous index when it is complete.
+
+        Raises:
+            ValueError: If less embeddings than lists or PQ centroids are stored.
+        """
+        with self._training_lock:
+            with self._lock:
+                matrix, valid_rows, generation = self._matrix, np.flatnonzero(self._valid_rows), self._generation
+                self._rows_stored_while_training = []
+            try:
+                self._train(matrix, valid_rows, generation)
+            finally:
+                with self._lock:
+                    self._rows_stored_while_training = None
+
+    def _train(self, matrix: np.ndarray, valid_rows: np.ndarray, generation: int) -> None:
+        if len(valid_rows) < max(self._nlist, PQ_CENTROIDS):
+            error_msg = f"At least {max(self._nlist, PQ_CENTROIDS)} embeddings are needed for training."
+            raise ValueError(error_msg)
+        start = time.perf_counter()
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(valid_rows, size=min(self._train_size, len(valid_rows)), replace=False))
+        data = np.asarray(matrix[sample], dtype=np.float32)
+
+        centroids = _kmeans(data, self._nlist, self._train_iterations, rng)
+        residuals = data - centroids[_assign(data, centroids)]
+        subspace_dimensions = EMBEDDING_DIMENSIONS // self._num_subspaces
+        codebooks = np.stack(
+            [
+                _kmeans(
+                    np.ascontiguousarray(residuals[:, m * subspace_dimensions : (m + 1) * subspace_dimensions]),
+                    PQ_CENTROIDS,
+                    self._train_iterations,
+                    rng,
+                )
+                for m in range(self._num_subspaces)
+            ]
+        )
+        del data, residuals
+
+        # the embeddings of the snapshot are encoded into temporary files, the previous index stays in use meanwhile
+        paths = {path: path.with_name(f"{path.name}.tmp") for path in (self._codes_path, self._list_ids_path)}
+        with paths[self._codes_path].open("wb") as codes_file, paths[self._list_ids_path].open("wb") as list_ids_file:
+            for block_start in range(0, len(matrix), self._block_size):
+                block = np.asarray(matrix[block_start : block_start + self._block_size], dtype=np.float32)
+                list_ids, codes = _encode(block, centroids, codebooks)
+                codes_file.write(codes.tobytes())
+                list_ids_file.write(list_ids.tobytes())
+        list_rows = self._build_list_rows(np.fromfile(paths[self._list_ids_path], dtype=np.int32))
+        paths[self._index_path] = self._index_path.with_name(f"{self._index_path.stem}.tmp.npz")
+        np.savez(paths[self._index_path], centroids=centroids, codebooks=codebooks)
+
+        with self._lock:
+            if self._generation != generation:
+                self._logger.info("The database was cleared while training. Discarding the index.")
+                for tmp_path in paths.values():
+                    tmp_path.unlink(missing_ok=True)
+                return
+            # the previous index is removed first, so a crash can't mix codes of two indexes
+            self._index_path.unlink(missing_ok=True)
+            for path in (self._codes_path, self._list_ids_path, self._index_path):
+                paths[path].replace(path)
+            self._set_quantizers(centroids, codebooks)
+            self._map_codes()
+            self._list_rows = list_rows
+            # embeddings which were stored while training are encoded with the new quantizers
+            stored_rows = np.concatenate([np.empty(0, dtype=np.int64), *self._rows_stored_while_training])
+            self._index_rows(np.union1d(stored_rows, np.arange(len(matrix), len(self._matrix))).astype(np.int64))
+        self._logger.info(f"Trained IVF-PQ index on {len(sample)} embeddings in {time.perf_counter() - start:.1f}s.")
+
+    def _index_rows(self, rows: np.ndarray) -> None:
+        """Encode the given (sorted) rows of the matrix. Rows after the last encoded row have to be contiguous."""
+        for start in range(0, len(rows), self._block_size):
+            block_rows = rows[start : start + self._block_size]
+            list_ids, codes = _encode(
+                np.asarray(self._matrix[block_rows], dtype=np.float32), self._centroids, self._codebooks
+            )
+
+            num_coded = len(self._list_ids)
+            is_update = block_rows < num_coded
+            moved = np.zeros(len(block_rows), dtype=bool)
+            if is_update.any():
+                updated_rows = block_rows[is_update]
+                moved[is_update] = self._list_ids[updated_rows] != list_ids[is_update]
+                self._codes[updated_rows] = codes[is_update]
+                self._list_ids[updated_rows] = list_ids[is_update]
+                self._codes.flush()
+                self._list_ids.flush()
+            if not is_update.all():
+                with self._codes_path.open("ab") as f:
+                    f.write(codes[~is_update].tobytes())
+                with self._list_ids_path.open("ab") as f:
+                    f.write(list_ids[~is_update].tobytes())
+                self._map_codes()
+
+            # new lists are created instead of appending in place, so running searches keep a consistent state
+            added = ~is_update | moved
+            for list_id in np.unique(list_ids[added]):
+                new_rows = block_rows[added & (list_ids == list_id)].astype(np.int32)
+                self._list_rows[list_id] = np.concatenate([self._list_rows[list_id], new_rows])
+
+    def _rows_stored(self, rows: np.ndarray) -> None:
+        """Add the stored rows to the index, or start the training once enough embeddings are stored."""
+        if self._rows_stored_while_training is not None:
+            self._rows_stored_while_training.append(rows)
+        if self._centroids is not None:
+            num_coded = len(self._list_ids)
+            self._index_rows(np.union1d(rows[rows < num_coded], np.arange(num_coded, len(self._matrix))))
+        elif np.count_nonzero(self._valid_rows) >= self._train_size:
+            self._start_training()
+
+    def _search(
+        self, matrix: np.ndarray, valid_rows: np.ndarray, queries: np.ndarray, threshold: Optional[float], limit: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Find the closest rows for each query with the IVF-PQ index and exact re-ranking of the best candidates."""
+        with self._lock:
+            centroids, codebooks, codebook_norms = self._centroids, self._codebooks, self._codebook_norms
+            codes, list_ids, list_rows = self._codes, self._list_ids, list(self._list_rows)
+        if centroids is None:
+            return super()._search(matrix, valid_rows, queries, threshold, limit)
+
+        result_rows = np.zeros((len(queries), limit), dtype=np.int64)
+        result_distances = np.full((len(queries), limit), np.inf, dtype=np.float32)
+        probed_lists = self._top_k(self._coarse_distances(queries, centroids), min(self._nprobe, self._nlist))
+        subspaces = np.arange(self._num_subspaces)
+        for i, query in enumerate(queries):
+            # lookup table of the squared distances of the residual sub-vectors to all PQ centroids of each list
+            residuals = (query - centroids[probed_lists[i]]).reshape(len(probed_lists[i]), self._num_subspaces, -1)
+            tables = codebook_norms[np.newaxis] - 2 * np.einsum("mkd,pmd->pmk", codebooks, residuals)
+            tables += np.einsum("pmd,pmd->pm", residuals, residuals)[:, :, np.newaxis]
+
+            candidate_rows, candidate_distances = [], []
+            for table, list_id in zip(tables, probed_lists[i]):
+                rows = list_rows[list_id]
+                # skip rows which moved to another list, and rows stored after the search started
+                rows = rows[rows < len(matrix)]
+                rows = rows[(list_ids[rows] == list_id) & valid_rows[rows]]
+                candidate_rows.append(rows)
+                candidate_distances.append(table[subspaces, codes[rows]].sum(axis=1))
+            rows, unique_index = np.unique(np.concatenate(candidate_rows), return_index=True)
+            if not len(rows):
+                continue
+            approximate_distances = np.concatenate(candidate_distances)[unique_index]
+
+            short_list = rows[self._top_k(approximate_distances[np.newaxis], limit * self._rerank_factor)[0]]
+            rows, distances = self._rerank(matrix, query, short_list, threshold, limit)
+            result_rows[i, : len(rows)] = rows
+            result_distances[i, : len(rows)] = distances
+        return result_rows, result_distances
+
+    @staticmethod
+    def _coarse_distances(queries: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        distances = queries @ centroids.T
+        distances *= -2
+        distances += np.einsum("ij,ij->i", centroids, centroids)[np.newaxis, :]
+        return distances
+
+    def _clear_database(self) -> None:
+        """Clear the database and the index."""
+        super()._clear_database()
+        with self._lock:
+            self._remove_index_files()
+            self._reset_index()
+            self._generation += 1
@@ -0,0 +1,411 @@
+import logging
+import sqlite3
+import threading
+from collections.abc import Iterator
+from contextlib import closing
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from ..config import config
+from ..models import EmbeddingBatch, ImageEmbedding, ImageEmbeddingNeighbour
+from .embedding_projection import EmbeddingProjection
+from .vector_db_repository import VectorDBRepository
+
+EMBEDDING_DIMENSIONS = 2048
+ROW_BYTES = EMBEDDING_DIMENSIONS * np.dtype(np.float32).itemsize
+# number of values which are looked up in the id table with one query (the default limit of older SQLite versions)
+SQLITE_MAX_VARIABLES = 999
+
+
+class NumpyVectorDB(VectorDBRepository):
+    """Repository class for an in-process vector database based on a memory-mapped NumPy matrix.
+
+    The embeddings are appended to a raw float32 file, which is memory-mapped instead of loaded, and the filenames are
+    stored with their row in a SQLite id table. The filenames are only looked up in the id table for the found rows,
+    in memory the database only keeps one flag per row. Thus, startup only reads the rows of the id table, the
+    embeddings are paged in by the OS while searching.
+    Neighbours are searched exactly with blocked matrix products (BLAS) and a partial sort.
+    Like the Chroma collection, the distances are squared L2 distances.
+    Updated embeddings are overwritten in place, deleted rows are only removed from the id table.
+
+    With an `EmbeddingProjection`, the projected (short) vectors are stored in a second file. The search then generates
+    `limit * EMBEDDING_PROJECTION_RERANK_FACTOR` candidates on the short vectors and re-scores them on the full vectors.
+    """
+
+    _embeddings_path: Path
+    _ids_path: Path
+    _matrix: np.ndarray
+    # rows of the matrix which are in the id table, deleted rows (and rows of an interrupted write) aren't searched
+    _valid_rows: np.ndarray
+    _block_size: int
+    _projection: Optional[EmbeddingProjection]
+    _projection_rerank_factor: int
+    _projected_path: Optional[Path]
+    # projected vector of each row of the matrix
+    _projected: Optional[np.ndarray]
+    _lock: threading.Lock
+    _logger: logging.Logger
+
+    def __init__(self, projection: Optional[EmbeddingProjection] = None):
+        """Open (or create) the database in `NUMPY_DB_PATH`.
+
+        Args:
+            projection (EmbeddingProjection, optional): projection to short vectors, which are used to generate the
+                candidates of the search
+        """
+        self._logger = logging.getLogger(__name__)
+        db_path = Path(config.NUMPY_DB_PATH)
+        self._logger.info(f"Using memory-mapped NumPy vector database with path: {db_path}")
+        db_path.mkdir(parents=True, exist_ok=True)
+        self._embeddings_path = db_path / "embeddings.f32"
+        self._embeddings_path.touch(exist_ok=True)
+        self._ids_path = db_path / "ids.sqlite3"
+        self._block_size = config.NUMPY_DB_BLOCK_SIZE
+        self._projection = projection
+        self._projection_rerank_factor = config.EMBEDDING_PROJECTION_RERANK_FACTOR
+        self._projected_path, self._projected = None, None
+        self._lock = threading.Lock()
+        self._setup_database()
+        if projection is not None:
+            self._setup_projection(db_path)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._ids_path, timeout=60)
+
+    def _setup_database(self) -> None:
+        with closing(self._connect()) as connection, connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS ids (filename TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+            # the filenames of the found rows are looked up by row
+            connection.execute("CREATE INDEX IF NOT EXISTS ids_row ON ids (row)")
+            rows = np.fromiter((row for (row,) in connection.execute("SELECT row FROM ids")), dtype=np.int64)
+        self._truncate_partial_row(self._embeddings_path, ROW_BYTES)
+        self._map_matrix()
+        self._valid_rows = np.zeros(len(self._matrix), dtype=bool)
+        self._valid_rows[rows[rows < len(self._matrix)]] = True
+        self._logger.info(f"Mapped {np.count_nonzero(self._valid_rows)} embeddings.")
+
+    @staticmethod
+    def _get_rows(connection: sqlite3.Connection, filenames: list[str]) -> dict[str, int]:
+        """Get the rows of the given filenames, filenames which aren't stored are missing in the result."""
+        rows = {}
+        for start in range(0, len(filenames), SQLITE_MAX_VARIABLES):
+            chunk = filenames[start : start + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            rows.update(connection.execute(f"SELECT filename, row FROM ids WHERE filename IN ({placeholders})", chunk))  # noqa: S608
+        return rows
+
+    @staticmethod
+    def _get_filenames(connection: sqlite3.Connection, rows: list[int]) -> dict[int, str]:
+        """Get the filenames of the given rows, deleted rows are missing in the result."""
+        filenames = {}
+        for start in range(0, len(rows), SQLITE_MAX_VARIABLES):
+            chunk = rows[start : start + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            filenames.update(connection.execute(f"SELECT row, filename FROM ids WHERE row IN ({placeholders})", chunk))  # noqa: S608
+        return filenames
+
+    def _setup_projection(self, db_path: Path) -> None:
+        # the file name contains the projection, so a new projection never uses vectors of an old one
+        self._projected_path = db_path / f"embeddings_{self._projection.fingerprint}.f32"
+        for path in db_path.glob("embeddings_*.f32"):
+            if path != self._projected_path:
+                self._logger.info(f"Removing vectors of an old projection: {path}")
+                path.unlink()
+        self._projected_path.touch(exist_ok=True)
+        row_bytes = self._projection.dimensions * np.dtype(np.float32).itemsize
+        self._truncate_partial_row(self._projected_path, row_bytes)
+        num_projected = min(self._projected_path.stat().st_size // row_bytes, len(self._matrix))
+        with self._projected_path.open("r+b") as f:
+            f.truncate(num_projected * row_bytes)
+        # rows which were stored before the projection was enabled (or after an interrupted write) are projected now
+        for start in range(num_projected, len(self._matrix), self._block_size):
+            self._append_projected(np.asarray(self._matrix[start : start + self._block_size]))
+        self._map_projected()
+        self._logger.info(f"Using a projection to {self._projection.dimensions} dimensions for candidate generation.")
+
+    def _map_projected(self) -> None:
+        num_rows = self._projected_path.stat().st_size // (self._projection.dimensions * 4)
+        self._projected = (
+            np.memmap(self._projected_path, dtype=np.float32, mode="r+", shape=(num_rows, self._projection.dimensions))
+            if num_rows
+            else np.empty((0, self._projection.dimensions), dtype=np.float32)
+        )
+
+    def _append_projected(self, embeddings: np.ndarray) -> None:
+        with self._projected_path.open("ab") as f:
+            f.write(self._projection.project(embeddings).tobytes())
+
+    @staticmethod
+    def _truncate_partial_row(path: Path, row_bytes: int) -> None:
+        """Remove the partial row, which an interrupted append can leave at the end of a file."""
+        file_size = path.stat().st_size
+        if file_size % row_bytes:
+            with path.open("r+b") as f:
+                f.truncate(file_size - file_size % row_bytes)
+
+    def _map_matrix(self) -> None:
+        """Map the embeddings file with all complete rows."""
+        num_rows = self._embeddings_path.stat().st_size // ROW_BYTES
+        if num_rows:
+            self._matrix = np.memmap(
+                self._embeddings_path, dtype=np.float32, mode="r+", shape=(num_rows, EMBEDDING_DIMENSIONS)
+            )
+        else:
+            self._matrix = np.empty((0, EMBEDDING_DIMENSIONS), dtype=np.float32)
+
+    def health_check(self) -> bool:
+        """Check if the files of the database can be accessed."""
+        return self._embeddings_path.exists() and self._ids_path.exists()
+
+    def store_embeddings(self, image_embeddings: EmbeddingBatch | list[ImageEmbedding]) -> None:
+        """Store image embeddings, existing embeddings with the same filename are overwritten."""
+        image_embeddings = EmbeddingBatch.of(image_embeddings)
+        if not image_embeddings:
+            return
+        embeddings = image_embeddings.embeddings
+        # if a filename occurs multiple times, the last embedding is stored
+        index_by_filename = {filename: index for index, filename in enumerate(image_embeddings.filenames)}
+        with self._lock:
+            with closing(self._connect()) as connection:
+                stored_rows = self._get_rows(connection, list(index_by_filename))
+            new_filenames = [filename for filename in index_by_filename if filename not in stored_rows]
+            updated_rows = list(stored_rows.values())
+            if updated_rows:
+                self._matrix[updated_rows] = embeddings[[index_by_filename[filename] for filename in stored_rows]]
+                self._matrix.flush()
+                if self._projection is not None:
+                    self._projected[updated_rows] = self._projection.project(self._matrix[updated_rows])
+                    self._projected.flush()
+
+            first_row = len(self._matrix)
+            if new_filenames:
+                new_embeddings = embeddings[[index_by_filename[name] for name in new_filenames]]
+                with self._embeddings_path.open("ab") as f:
+                    f.write(new_embeddings.tobytes())
+                if self._projection is not None:
+                    self._append_projected(new_embeddings)
+                    self._map_projected()
+            new_rows = {filename: first_row + i for i, filename in enumerate(new_filenames)}
+            # the ids are written after the embeddings, so an interrupted write only leaves unused rows
+            with closing(self._connect()) as connection, connection:
+                connection.executemany("INSERT OR REPLACE INTO ids (filename, row) VALUES (?, ?)", new_rows.items())
+            self._map_matrix()
+            valid_rows = np.zeros(len(self._matrix), dtype=bool)
+            valid_rows[: len(self._valid_rows)] = self._valid_rows
+            valid_rows[list(new_rows.values())] = True
+            self._valid_rows = valid_rows
+            self._rows_stored(np.array(sorted([*updated_rows, *new_rows.values()]), dtype=np.int64))
+
+    def _rows_stored(self, rows: np.ndarray) -> None:
+        """Called with the (sorted) rows written by `store_embeddings`, while the lock is held."""
+
+    def delete_embeddings(self, filenames: list[str]) -> None:
+        """Delete the embeddings of the given filenames. The rows stay in the file, but aren't searched anymore."""
+        if not filenames:
+            return
+        with self._lock:
+            with closing(self._connect()) as connection, connection:
+                deleted_rows = self._get_rows(connection, filenames)
+                connection.executemany("DELETE FROM ids WHERE filename = ?", [(filename,) for filename in filenames])
+            valid_rows = self._valid_rows.copy()
+            valid_rows[list(deleted_rows.values())] = False
+            self._valid_rows = valid_rows
+
+    def get_neighbours(
+        self,
+        image_embedding: ImageEmbedding,
+        threshold: Optional[float] = None,
+        limit: int = 50,
+        include_embeddings: bool = False,
+    ) -> list[ImageEmbeddingNeighbour]:
+        """Get the neighbours of an image embedding.
+
+        Args:
+            image_embedding (ImageEmbedding): The image embedding to search for.
+            threshold (Optional[float]): The maximum distance to consider a neighbour. If None, no threshold is applied.
+            limit (int): The maximum number of neighbours to return. Defaults to 50.
+            include_embeddings (bool): If True, the embeddings of the neighbours are returned as well.
+
+        Returns:
+            list[ImageEmbeddingNeighbour]: A list of ImageEmbeddingNeighbour objects.
+        """
+        return self.get_neighbours_batch([image_embedding], threshold, limit, include_embeddings)[0]
+
+    def get_neighbours_batch(
+        self,
+        image_embeddings: EmbeddingBatch | list[ImageEmbedding],
+        threshold: Optional[float] = None,
+        limit: int = 50,
+        include_embeddings: bool = False,
+    ) -> list[list[ImageEmbeddingNeighbour]]:
+        """Get the neighbours of multiple image embeddings with one pass over the stored embeddings.
+
+        The stored embeddings are processed in blocks of `NUMPY_DB_BLOCK_SIZE` rows. For each block, the distances to
+        all search embeddings are computed with a single matrix product and only the closest `limit` rows are kept.
+
+        Args:
+            image_embeddings (EmbeddingBatch | list[ImageEmbedding]): The image embeddings to search for.
+            threshold (Optional[float]): The maximum distance to consider a neighbour. If None, no threshold is applied.
+            limit (int): The maximum number of neighbours to return per image embedding. Defaults to 50.
+            include_embeddings (bool): If True, the embeddings of the neighbours are returned as well.
+
+        Returns:
+            list[list[ImageEmbeddingNeighbour]]: The neighbours of each image embedding, in the order of the input.
+        """
+        if not image_embeddings:
+            return []
+        with self._lock:
+            matrix, valid_rows = self._matrix, self._valid_rows
+        queries = EmbeddingBatch.of(image_embeddings).embeddings
+        if not len(matrix) or limit <= 0:
+            return [[] for _ in image_embeddings]
+
+        rows, distances = self._search(matrix, valid_rows, queries, threshold, limit)
+        with closing(self._connect()) as connection:
+            filename_by_row = self._get_filenames(connection, np.unique(rows[np.isfinite(distances)]).tolist())
+        neighbours_batch = []
+        for query_rows, query_distances in zip(rows, distances):
+            neighbours = []
+            for row, distance in zip(query_rows, query_distances):
+                filename = filename_by_row.get(row)
+                # rows can be deleted while searching
+                if not np.isfinite(distance) or filename is None:
+                    continue
+                embedding = matrix[row].tolist() if include_embeddings else None
+                neighbours.append(ImageEmbeddingNeighbour(filename=filename, embedding=embedding, distance=distance))
+            neighbours_batch.append(neighbours)
+        return neighbours_batch
+
+    def _search(
+        self, matrix: np.ndarray, valid_rows: np.ndarray, queries: np.ndarray, threshold: Optional[float], limit: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Find the closest rows for each query, sorted by distance. Missing neighbours have an infinite distance."""
+        with self._lock:
+            projected = self._projected
+        if self._projection is None:
+            return self._search_exact(matrix, valid_rows, queries, threshold, limit)
+
+        # without whitening, the projected distance is a lower bound, so the threshold already discards candidates
+        num_rows = min(len(projected), len(matrix))
+        candidate_rows, candidate_distances = self._search_exact(
+            projected[:num_rows],
+            valid_rows[:num_rows],
+            self._projection.project(queries),
+            None if self._projection.whiten else threshold,
+            limit * self._projection_rerank_factor,
+        )
+        result_rows = np.zeros((len(queries), limit), dtype=np.int64)
+        result_distances = np.full((len(queries), limit), np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            rows, distances = self._rerank(
+                matrix, query, candidate_rows[i][np.isfinite(candidate_distances[i])], threshold, limit
+            )
+            result_rows[i, : len(rows)] = rows
+            result_distances[i, : len(rows)] = distances
+        return result_rows, result_distances
+
+    def _search_exact(
+        self, matrix: np.ndarray, valid_rows: np.ndarray, queries: np.ndarray, threshold: Optional[float], limit: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Exact search with blocked matrix products, which is used for the full and the projected vectors."""
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        candidate_rows, candidate_distances = [], []
+        for start in range(0, len(matrix), self._block_size):
+            block = np.asarray(matrix[start : start + self._block_size])
+            # ||q - x||^2 = ||q||^2 + ||x||^2 - 2 q.x, the matrix product does most of the work
+            distances = queries @ block.T
+            distances *= -2
+            distances += query_norms[:, np.newaxis]
+            distances += np.einsum("ij,ij->i", block, block)[np.newaxis, :]
+            np.maximum(distances, 0, out=distances)
+            distances[:, ~valid_rows[start : start + len(block)]] = np.inf
+            if threshold is not None:
+                distances[distances > threshold] = np.inf
+
+            block_rows = self._top_k(distances, limit)
+            candidate_rows.append(block_rows + start)
+            candidate_distances.append(np.take_along_axis(distances, block_rows, axis=1))
+
+        candidate_rows = np.concatenate(candidate_rows, axis=1)
+        candidate_distances = np.concatenate(candidate_distances, axis=1)
+        best = self._top_k(candidate_distances, limit)
+        # only the best candidates are sorted
+        best = np.take_along_axis(
+            best, np.argsort(np.take_along_axis(candidate_distances, best, axis=1), axis=1), axis=1
+        )
+        return np.take_along_axis(candidate_rows, best, axis=1), np.take_along_axis(candidate_distances, best, axis=1)
+
+    @classmethod
+    def _rerank(
+        cls, matrix: np.ndarray, query: np.ndarray, rows: np.ndarray, threshold: Optional[float], limit: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Re-score candidate rows with the exact distance and keep the closest `limit` rows, sorted by distance."""
+        # the rows are read in file order
+        rows = np.sort(rows)
+        distances = np.sum((np.asarray(matrix[rows]) - query) ** 2, axis=1)
+        if threshold is not None:
+            rows, distances = rows[distances <= threshold], distances[distances <= threshold]
+        best = cls._top_k(distances[np.newaxis], limit)[0]
+        best = best[np.argsort(distances[best])]
+        return rows[best], distances[best]
+
+    @staticmethod
+    def _top_k(distances: np.ndarray, k: int) -> np.ndarray:
+        """Get the (unsorted) column indices of the k smallest distances of each row with a partial sort."""
+        if distances.shape[1] <= k:
+            return np.broadcast_to(np.arange(distances.shape[1]), distances.shape).copy()
+        return np.argpartition(distances, k - 1, axis=1)[:, :k]
+
+    def get_neighbours_top_n(
+        self, image_embedding: ImageEmbedding, limit: int = 20, include_embeddings: bool = False
+    ) -> list[ImageEmbeddingNeighbour]:
+        """Get the n closest neighbours of an image embedding."""
+        return self.get_neighbours(image_embedding, threshold=None, limit=limit, include_embeddings=include_embeddings)
+
+    def get_neighbours_threshold(
+        self, image_embedding: ImageEmbedding, threshold: float, include_embeddings: bool = False
+    ) -> list[ImageEmbeddingNeighbour]:
+        """Get the neighbours of an image embedding with a distance threshold."""
+        return self.get_neighbours(image_embedding, threshold, limit=100, include_embeddings=include_embeddings)
+
+    def iter_embeddings(self, sample_size: Optional[int] = None) -> Iterator[np.ndarray]:
+        """Iterate over the stored embeddings in blocks of `NUMPY_DB_BLOCK_SIZE` rows.
+
+        Args:
+            sample_size (int, optional): if set, only a random sample of this many embeddings is returned
+        """
+        with self._lock:
+            matrix, rows = self._matrix, np.flatnonzero(self._valid_rows)
+        if sample_size is not None and sample_size < len(rows):
+            rows = np.sort(np.random.default_rng(0).choice(rows, size=sample_size, replace=False))
+        for start in range(0, len(rows), self._block_size):
+            yield np.asarray(matrix[rows[start : start + self._block_size]])
+
+    def iter_embedding_blocks(self, block_size: int) -> Iterator[tuple[list[str], np.ndarray]]:
+        """Iterate over the stored embeddings in blocks of `block_size` rows, together with their filenames."""
+        with self._lock:
+            matrix, rows = self._matrix, np.flatnonzero(self._valid_rows)
+        query = "SELECT row, filename FROM ids WHERE row BETWEEN ? AND ?"
+        for start in range(0, len(rows), block_size):
+            block_rows = rows[start : start + block_size]
+            with closing(self._connect()) as connection:
+                filename_by_row = dict(connection.execute(query, (int(block_rows[0]), int(block_rows[-1]))))
+            # rows which were deleted while iterating are skipped
+            block_rows = block_rows[[row in filename_by_row for row in block_rows.tolist()]]
+            yield [filename_by_row[row] for row in block_rows.tolist()], np.asarray(matrix[block_rows])
+
+    def _clear_database(self) -> None:
+        """Clear the database."""
+        with self._lock:
+            with closing(self._connect()) as connection, connection:
+                connection.execute("DELETE FROM ids")
+            self._matrix = np.empty((0, EMBEDDING_DIMENSIONS), dtype=np.float32)
+            self._embeddings_path.write_bytes(b"")
+            self._map_matrix()
+            self._valid_rows = np.zeros(0, dtype=bool)
+            if self._projection is not None:
+                self._projected = np.empty((0, self._projection.dimensions), dtype=np.float32)
+                self._projected_path.write_bytes(b"")
+                self._map_projected()
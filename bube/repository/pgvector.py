@@ -1,72 +1,321 @@
-import ast
 import atexit
+import functools
+import hashlib
 import logging
+import threading
+from collections.abc import Callable, Iterator
 from importlib import resources as impresources
-from typing import Any, Optional
+from typing import Optional, TypeVar
 
+import numpy as np
 import psycopg2
+import psycopg2.extensions
 from psycopg2 import sql as pgsql
 from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 
 from ..config import config
-from ..models import ImageEmbedding, ImageEmbeddingNeighbour
+from ..models import EmbeddingBatch, ImageEmbedding, ImageEmbeddingNeighbour
 from .vector_db_repository import VectorDBRepository
 
+T = TypeVar("T")
+
+# Postgres truncates longer identifiers (NAMEDATALEN - 1 bytes)
+MAX_IDENTIFIER_LENGTH = 63
+# maximum of the `hnsw.ef_search` setting of pgvector, an HNSW search returns at most this many rows
+MAX_EF_SEARCH = 1000
+
 
 class PgVector(VectorDBRepository):
     """Repository class for the pgVector database.
 
     This DB can be used to connect to a remote pgVector database and store and retrieve image embeddings.
     To configure the connection, the config file can be used or environment variables.
+    Each operation borrows a connection from a thread-safe pool, so concurrent requests use separate connections.
+    Connections which were dropped by the server are discarded and the operation is retried with the next connection.
+    Optionally, an HNSW or IVFFlat index is managed for approximate neighbour search, see `build_index`.
     """
 
-    _connection: Any
+    _pool: ThreadedConnectionPool
+    # the pool raises an error if all connections are in use, the semaphore lets the threads wait instead
+    _pool_slots: threading.BoundedSemaphore
     _table_name: pgsql.Identifier
     _logger: logging.Logger
 
     def __init__(self):
         self._logger = logging.getLogger(__name__)
-        self._logger.info(f"Connecting to pgVector database on {config.PGVECTOR_DB_HOST}:{config.PGVECTOR_DB_PORT}")
+        self._logger.info(
+            f"Connecting to pgVector database on {config.PGVECTOR_DB_HOST}:{config.PGVECTOR_DB_PORT} "
+            f"with a pool of up to {config.PGVECTOR_DB_POOL_MAX_SIZE} connections"
+        )
         self._table_name = pgsql.Identifier(config.PGVECTOR_DB_TABLE_NAME)
-        self._connection = psycopg2.connect(
+        self._pool = ThreadedConnectionPool(
+            # the pool closes returned connections beyond minconn, so by default all connections are kept open
+            minconn=config.PGVECTOR_DB_POOL_MIN_SIZE or config.PGVECTOR_DB_POOL_MAX_SIZE,
+            maxconn=config.PGVECTOR_DB_POOL_MAX_SIZE,
             host=config.PGVECTOR_DB_HOST,
             port=config.PGVECTOR_DB_PORT,
             user=config.PGVECTOR_DB_USER,
             password=config.PGVECTOR_DB_PWD.get_secret_value(),
             dbname=config.PGVECTOR_DB_DATABASE_NAME,
             sslmode="require" if config.PGVECTOR_DB_HTTP_SSL else "disable",
+            connect_timeout=config.PGVECTOR_DB_CONNECT_TIMEOUT,
         )
+        self._pool_slots = threading.BoundedSemaphore(config.PGVECTOR_DB_POOL_MAX_SIZE)
         self._setup_database()
         atexit.register(self.close)
 
     def _setup_database(self) -> None:
         self._logger.info("Setting up pgVector database.")
-        with self._connection.cursor() as cursor:
-            with impresources.open_text("bube.repository", "setup_pgvector.sql") as f:
-                setup_sql = f.read()
-            cursor.execute(setup_sql)
-        self._connection.commit()
+        with impresources.open_text("bube.repository", "setup_pgvector.sql") as f:
+            setup_sql = f.read()
+        self._execute(lambda cursor: cursor.execute(setup_sql))
+        self._setup_storage()
+        self._check_index()
+
+    def _setup_storage(self) -> None:
+        """Migrate the embedding column to the configured storage type.
+
+        With `halfvec`, the embeddings are stored with half precision, which halves the size of the table. The column
+        is converted in place (in both directions), indexes on the column are rebuilt by Postgres.
+        """
+        storage_type = f"{config.PGVECTOR_DB_STORAGE_TYPE}(2048)"
+
+        def migrate_storage(cursor: psycopg2.extensions.cursor) -> None:
+            cursor.execute(
+                "SELECT format_type(atttypid, atttypmod) FROM pg_attribute WHERE attrelid = %s::regclass "
+                "AND attname = 'embedding';",
+                (config.PGVECTOR_DB_TABLE_NAME,),
+            )
+            current_type = cursor.fetchone()[0]
+            if current_type == storage_type:
+                return
+            self._logger.info(f"Migrating the embeddings from {current_type} to {storage_type}. This may take a while.")
+            cursor.execute(
+                pgsql.SQL("ALTER TABLE {} ALTER COLUMN embedding TYPE {} USING embedding::{};").format(
+                    self._table_name, pgsql.SQL(storage_type), pgsql.SQL(storage_type)
+                )
+            )
+
+        self._execute(migrate_storage)
+
+    def _check_index(self) -> None:
+        """Warn if the configured ANN index doesn't exist yet, the queries scan the whole table until it's built."""
+        index_name = self._get_index_name()
+        if index_name is None:
+            return
+        managed_indexes = self._execute(self._get_managed_indexes)
+        if not managed_indexes.get(index_name, False):
+            self._logger.warning(
+                f"The index {index_name} doesn't exist yet, the search scans the whole table until it's built with "
+                "`python -m bube build-index`."
+            )
+
+    def build_index(self) -> None:
+        """Create the configured ANN index and drop managed indexes with another type or other build parameters.
+
+        The name of a managed index contains its type and parameters, so a changed config results in a new index.
+        Indexes support at most 2000 dimensions for the VECTOR type, thus the index is built on the expression
+        `embedding::halfvec(2048)`, which is used for ordering by the `get_neighbours_ann` function.
+        The binary index is built on `binary_quantize(embedding)` (1 bit per dimension), which is a fraction of the
+        size of the other indexes. The candidates of the binary index are re-ranked by `get_neighbours_binary`.
+
+        The index is built with `CREATE INDEX CONCURRENTLY`, so the table can be read and written by the API while the
+        index is built. An index which was left invalid by an interrupted build is dropped and built again.
+        """
+        index_name = self._get_index_name()
+
+        def manage_index(cursor: psycopg2.extensions.cursor) -> None:
+            for existing_index, is_valid in self._get_managed_indexes(cursor).items():
+                if existing_index != index_name or not is_valid:
+                    self._logger.info(f"Dropping index {existing_index}.")
+                    cursor.execute(
+                        pgsql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {};").format(pgsql.Identifier(existing_index))
+                    )
+            if index_name is None:
+                return
+            if config.PGVECTOR_DB_INDEX_TYPE in ("hnsw", "hnsw_binary"):
+                index_expression = (
+                    "(binary_quantize(embedding)::bit(2048)) bit_hamming_ops"
+                    if config.PGVECTOR_DB_INDEX_TYPE == "hnsw_binary"
+                    else "(embedding::halfvec(2048)) halfvec_l2_ops"
+                )
+                index_method = pgsql.SQL("hnsw ({}) WITH (m = {}, ef_construction = {})").format(
+                    pgsql.SQL(index_expression),
+                    pgsql.Literal(config.PGVECTOR_DB_HNSW_M),
+                    pgsql.Literal(config.PGVECTOR_DB_HNSW_EF_CONSTRUCTION),
+                )
+            else:
+                index_method = pgsql.SQL("ivfflat ((embedding::halfvec(2048)) halfvec_l2_ops) WITH (lists = {})")
+                index_method = index_method.format(pgsql.Literal(config.PGVECTOR_DB_IVFFLAT_LISTS))
+            self._logger.info(f"Creating index {index_name} (if it doesn't exist yet). This may take a while.")
+            cursor.execute(
+                pgsql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} USING {};").format(
+                    pgsql.Identifier(index_name), self._table_name, index_method
+                )
+            )
+
+        # concurrent index operations can't run inside a transaction
+        self._execute(manage_index, autocommit=True)
 
-    def store_embeddings(self, image_embeddings: list[ImageEmbedding]) -> None:
+    @staticmethod
+    def _get_managed_indexes(cursor: psycopg2.extensions.cursor) -> dict[str, bool]:
+        """Get the names of the managed ANN indexes of the table and whether they are valid."""
+        cursor.execute(
+            "SELECT index_class.relname, pg_index.indisvalid FROM pg_index "
+            "JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid "
+            "WHERE pg_index.indrelid = %s::regclass AND index_class.relname LIKE %s;",
+            (
+                config.PGVECTOR_DB_TABLE_NAME,
+                PgVector._truncate_identifier(f"{config.PGVECTOR_DB_TABLE_NAME}_ann_") + "%",
+            ),
+        )
+        return dict(cursor.fetchall())
+
+    @staticmethod
+    def _get_index_name() -> Optional[str]:
+        """Get the name of the configured ANN index, or None for an exact search."""
+        table_name = config.PGVECTOR_DB_TABLE_NAME
+        if config.PGVECTOR_DB_INDEX_TYPE in ("hnsw", "hnsw_binary"):
+            hnsw_parameters = f"m{config.PGVECTOR_DB_HNSW_M}_efc{config.PGVECTOR_DB_HNSW_EF_CONSTRUCTION}"
+            return PgVector._shorten_identifier(f"{table_name}_ann_{config.PGVECTOR_DB_INDEX_TYPE}_{hnsw_parameters}")
+        if config.PGVECTOR_DB_INDEX_TYPE == "ivfflat":
+            return PgVector._shorten_identifier(f"{table_name}_ann_ivfflat_lists{config.PGVECTOR_DB_IVFFLAT_LISTS}")
+        return None
+
+    @staticmethod
+    def _shorten_identifier(name: str) -> str:
+        """Shorten a name to the maximum identifier length, the end is replaced by a hash to keep the name unique.
+
+        Postgres would silently truncate the name, which cuts off the build parameters, so an existing index wouldn't
+        be found by its name anymore.
+        """
+        if len(name.encode()) <= MAX_IDENTIFIER_LENGTH:
+            return name
+        name_hash = hashlib.blake2b(name.encode(), digest_size=4).hexdigest()
+        return f"{PgVector._truncate_identifier(name)}_{name_hash}"
+
+    @staticmethod
+    def _truncate_identifier(name: str) -> str:
+        """Truncate a name, so that a hash suffix (`_` and 8 hex digits) fits into the maximum identifier length."""
+        return name.encode()[: MAX_IDENTIFIER_LENGTH - 9].decode(errors="ignore")
+
+    @staticmethod
+    def _get_num_candidates(limit: int) -> int:
+        """Get the number of candidates which the ANN index has to return for a query with the given limit."""
+        if config.PGVECTOR_DB_INDEX_TYPE == "hnsw_binary":
+            # the candidates of the binary index are re-ranked with the exact distance
+            return min(limit * config.PGVECTOR_DB_RERANK_FACTOR, MAX_EF_SEARCH)
+        if config.PGVECTOR_DB_INDEX_TYPE == "hnsw":
+            return min(limit, MAX_EF_SEARCH)
+        return limit
+
+    @staticmethod
+    def _set_search_parameters(cursor: psycopg2.extensions.cursor, num_candidates: int) -> None:
+        """Set the search parameters of the ANN index for the current transaction."""
+        if config.PGVECTOR_DB_INDEX_TYPE in ("hnsw", "hnsw_binary"):
+            # the HNSW search returns at most ef_search candidates, which have to cover all requested candidates
+            ef_search = min(max(config.PGVECTOR_DB_HNSW_EF_SEARCH, num_candidates), MAX_EF_SEARCH)
+            cursor.execute("SET LOCAL hnsw.ef_search = %s;", (ef_search,))
+        elif config.PGVECTOR_DB_INDEX_TYPE == "ivfflat":
+            cursor.execute("SET LOCAL ivfflat.probes = %s;", (config.PGVECTOR_DB_IVFFLAT_PROBES,))
+
+    def _execute(self, operation: Callable[[psycopg2.extensions.cursor], T], autocommit: bool = False) -> T:
+        """Run an operation with a cursor of a pooled connection and commit it.
+
+        If the connection was closed by the server (e.g. after a restart), it's removed from the pool and the
+        operation is retried with the next connection. After a restart, all idle connections of the pool are broken,
+        so the operation is retried until the pool opens a new connection. All operations of this repository are
+        idempotent. Errors while opening a new connection are raised immediately.
+
+        Args:
+            operation (Callable[[cursor], T]): function which receives a cursor and returns the result of the operation
+            autocommit (bool, optional): if True, each statement of the operation is committed immediately instead of
+                running the operation in one transaction
+
+        Returns:
+            T: result of the operation
+        """
+        # each idle connection of the pool may be broken, afterward the pool opens a new connection
+        max_broken_connections = config.PGVECTOR_DB_POOL_MAX_SIZE
+        broken_connections = 0
+        with self._pool_slots:
+            while True:
+                connection = self._pool.getconn()
+                try:
+                    # the mode is set each time a connection is borrowed from the pool
+                    connection.autocommit = autocommit
+                    with connection.cursor() as cursor:
+                        result = operation(cursor)
+                    connection.commit()
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    if not connection.closed:
+                        # an error of the operation (e.g. a cancelled statement) on a working connection
+                        connection.rollback()
+                        self._pool.putconn(connection)
+                        raise
+                    # the connection is broken, so it's closed instead of being returned to the pool
+                    self._pool.putconn(connection, close=True)
+                    broken_connections += 1
+                    if broken_connections > max_broken_connections:
+                        raise
+                    self._logger.warning("Lost connection to the pgVector database. Reconnecting.")
+                    continue
+                except Exception:
+                    connection.rollback()
+                    self._pool.putconn(connection)
+                    raise
+                self._pool.putconn(connection)
+                return result
+
+    def health_check(self) -> bool:
+        """Check if the database can be reached with a connection of the pool."""
+        try:
+            self._execute(lambda cursor: cursor.execute("SELECT 1;"))
+        except psycopg2.Error as e:
+            self._logger.warning(f"pgVector health check failed: {e}")
+            return False
+        return True
+
+    @staticmethod
+    def pairwise_distances(embeddings: np.ndarray) -> np.ndarray:
+        """Distances between all pairs of the given embeddings, pgvector uses the L2 distance (`<->`)."""
+        return np.sqrt(VectorDBRepository.pairwise_distances(embeddings))
+
+    def store_embeddings(self, image_embeddings: EmbeddingBatch | list[ImageEmbedding]) -> None:
         """Store image embeddings in the database.
 
         Args:
-            image_embeddings (list[ImageEmbedding]): A list of ImageEmbedding objects to store.
+            image_embeddings (EmbeddingBatch | list[ImageEmbedding]): The image embeddings to store.
         """
-        with self._connection.cursor() as cursor:
-            embeddings_data = [(img.filename, img.embedding) for img in image_embeddings]
-            insert_query = pgsql.SQL(f"""
-            INSERT INTO {self._table_name} (filename, embedding)
-            VALUES %s
-            ON CONFLICT (filename) DO UPDATE SET
-                filename = EXCLUDED.filename,
-                embedding = EXCLUDED.embedding;
-            """)  # noqa: S608
-            execute_values(cursor, insert_query, embeddings_data)
-        self._connection.commit()
+        image_embeddings = EmbeddingBatch.of(image_embeddings)
+        # the text format can be inserted into VECTOR and HALFVEC columns
+        embeddings_data = [
+            (filename, self._encode_vector(embedding))
+            for filename, embedding in zip(image_embeddings.filenames, image_embeddings.embeddings)
+        ]
+        insert_query = pgsql.SQL(f"""
+        INSERT INTO {self._table_name} (filename, embedding)
+        VALUES %s
+        ON CONFLICT (filename) DO UPDATE SET
+            filename = EXCLUDED.filename,
+            embedding = EXCLUDED.embedding;
+        """)  # noqa: S608
+        self._execute(lambda cursor: execute_values(cursor, insert_query, embeddings_data))
+
+    def delete_embeddings(self, filenames: list[str]) -> None:
+        """Delete the embeddings of the given filenames from the database."""
+        if not filenames:
+            return
+        delete_query = pgsql.SQL("DELETE FROM {} WHERE filename = ANY(%s);").format(self._table_name)
+        self._execute(lambda cursor: cursor.execute(delete_query, (filenames,)))
 
     def get_neighbours(
-        self, image_embedding: ImageEmbedding, threshold: Optional[float] = None, limit: int = 10
+        self,
+        image_embedding: ImageEmbedding,
+        threshold: Optional[float] = None,
+        limit: int = 10,
+        include_embeddings: bool = False,
     ) -> list[ImageEmbeddingNeighbour]:
         """Get the neighbours of an image embedding.
 
@@ -77,34 +326,136 @@ class PgVector(VectorDBRepository):
             image_embedding (ImageEmbedding): The image embedding to search for.
             threshold (Optional[float]): The maximum distance to consider a neighbour. If None, no threshold is applied.
             limit (int): The maximum number of neighbours to return. Defaults to 10.
+            include_embeddings (bool): If True, the embeddings of the neighbours are returned as well.
 
         Returns:
             list[ImageEmbeddingNeighbour]: A list of ImageEmbeddingNeighbour objects.
         """
-        with self._connection.cursor() as cursor:
-            query = """
-            SELECT filename, embedding, distance
-            FROM get_neighbours(%s::VECTOR(2048), %s::FLOAT, %s::INTEGER);
-            """
-            cursor.execute(query, (image_embedding.embedding, threshold, limit))
-            rows = cursor.fetchall()
-            return [
-                ImageEmbeddingNeighbour(filename=row[0], embedding=ast.literal_eval(row[1]), distance=row[2])
-                for row in rows
-            ]
-
-    def get_neighbours_top_n(self, image_embedding: ImageEmbedding, limit: int = 10) -> list[ImageEmbeddingNeighbour]:
+        return self.get_neighbours_batch([image_embedding], threshold, limit, include_embeddings)[0]
+
+    def get_neighbours_batch(
+        self,
+        image_embeddings: EmbeddingBatch | list[ImageEmbedding],
+        threshold: Optional[float] = None,
+        limit: int = 10,
+        include_embeddings: bool = False,
+    ) -> list[list[ImageEmbeddingNeighbour]]:
+        """Get the neighbours of multiple image embeddings with a single query.
+
+        All search embeddings are sent as one array, which is joined laterally with the `get_neighbours` function.
+        Thus, a whole case only needs one round trip to the database.
+        The embeddings of the neighbours are only selected if requested. They are transferred in the binary format of
+        pgvector instead of text, which is decoded directly into a float32 array.
+
+        Args:
+            image_embeddings (EmbeddingBatch | list[ImageEmbedding]): The image embeddings to search for.
+            threshold (Optional[float]): The maximum distance to consider a neighbour. If None, no threshold is applied.
+            limit (int): The maximum number of neighbours to return per image embedding. Defaults to 10.
+            include_embeddings (bool): If True, the embeddings of the neighbours are returned as well.
+
+        Returns:
+            list[list[ImageEmbeddingNeighbour]]: The neighbours of each image embedding, in the order of the input.
+        """
+        if not image_embeddings:
+            return []
+        neighbours_batch = [[] for _ in image_embeddings]
+        embedding_column = "vector_send(neighbour.embedding)" if include_embeddings else "NULL"
+        # with an ANN index, the neighbours are searched with the index instead of a scan of the whole table
+        neighbours_function = {"exact": "get_neighbours", "hnsw_binary": "get_neighbours_binary"}.get(
+            config.PGVECTOR_DB_INDEX_TYPE, "get_neighbours_ann"
+        )
+        num_candidates = self._get_num_candidates(limit)
+        if num_candidates < limit:
+            self._logger.warning(f"An HNSW index returns at most {MAX_EF_SEARCH} neighbours, the limit is reduced.")
+            limit = num_candidates
+        candidates_argument = ", %(num_candidates)s::INTEGER" if config.PGVECTOR_DB_INDEX_TYPE == "hnsw_binary" else ""
+        query = f"""
+        SELECT search.query_index, neighbour.filename, neighbour.distance, {embedding_column}
+        FROM unnest(%(search_embeddings)s::TEXT[]) WITH ORDINALITY AS search(embedding, query_index)
+        CROSS JOIN LATERAL {neighbours_function}(
+            search.embedding::VECTOR(2048), %(threshold)s::FLOAT, %(limit)s::INTEGER{candidates_argument}
+        ) AS neighbour
+        ORDER BY search.query_index, neighbour.distance;
+        """  # noqa: S608 - the column, function and argument are constants
+        parameters = {
+            "search_embeddings": [
+                self._encode_vector(embedding) for embedding in EmbeddingBatch.of(image_embeddings).embeddings
+            ],
+            "threshold": threshold,
+            "limit": limit,
+            "num_candidates": num_candidates,
+        }
+
+        def fetch_neighbours(cursor: psycopg2.extensions.cursor) -> list[tuple]:
+            self._set_search_parameters(cursor, num_candidates)
+            cursor.execute(query, parameters)
+            return cursor.fetchall()
+
+        for query_index, filename, distance, embedding in self._execute(fetch_neighbours):
+            # the ordinality starts at 1
+            neighbours_batch[query_index - 1].append(
+                ImageEmbeddingNeighbour(
+                    filename=filename,
+                    embedding=self._decode_vector(embedding).tolist() if embedding is not None else None,
+                    distance=distance,
+                )
+            )
+        return neighbours_batch
+
+    def iter_embedding_blocks(self, block_size: int) -> Iterator[tuple[list[str], np.ndarray]]:
+        """Iterate over the stored embeddings in pages of `block_size` embeddings, together with their filenames.
+
+        The pages are selected by filename (keyset pagination), so each page is a range scan of the unique index on the
+        filename instead of skipping all previous rows. The embeddings are transferred in the binary format, also for
+        `halfvec` storage.
+        """
+        query = pgsql.SQL(
+            "SELECT filename, vector_send(embedding::VECTOR(2048)) FROM {} "
+            "WHERE filename > %s ORDER BY filename LIMIT %s;"
+        ).format(self._table_name)
+
+        def fetch_page(cursor: psycopg2.extensions.cursor, last_filename: str) -> list[tuple]:
+            cursor.execute(query, (last_filename, block_size))
+            return cursor.fetchall()
+
+        last_filename = ""
+        while True:
+            page = self._execute(functools.partial(fetch_page, last_filename=last_filename))
+            if not page:
+                return
+            yield [filename for filename, _ in page], np.stack([self._decode_vector(data) for _, data in page])
+            last_filename = page[-1][0]
+
+    def get_neighbours_top_n(
+        self, image_embedding: ImageEmbedding, limit: int = 10, include_embeddings: bool = False
+    ) -> list[ImageEmbeddingNeighbour]:
         """Get the top N neighbours of an image embedding."""
-        return self.get_neighbours(image_embedding, threshold=None, limit=limit)
+        return self.get_neighbours(image_embedding, threshold=None, limit=limit, include_embeddings=include_embeddings)
 
     def get_neighbours_threshold(
-        self, image_embedding: ImageEmbedding, threshold: float
+        self, image_embedding: ImageEmbedding, threshold: float, include_embeddings: bool = False
     ) -> list[ImageEmbeddingNeighbour]:
         """Get all neighbours of an image embedding that are closer than the given threshold."""
-        return self.get_neighbours(image_embedding, threshold=threshold, limit=100)
+        return self.get_neighbours(
+            image_embedding, threshold=threshold, limit=100, include_embeddings=include_embeddings
+        )
+
+    @staticmethod
+    def _encode_vector(embedding: list[float] | np.ndarray) -> str:
+        """Encode an embedding in the text format of pgvector, e.g. `[0.1,0.2]`."""
+        return "[" + ",".join(map(str, np.asarray(embedding, dtype=np.float32).tolist())) + "]"
+
+    @staticmethod
+    def _decode_vector(data: memoryview | bytes) -> np.ndarray:
+        """Decode the binary format of pgvector (`vector_send`) to a float32 array.
+
+        The format starts with the number of dimensions and an unused field (2 bytes each), followed by the values as
+        big-endian float32.
+        """
+        return np.frombuffer(data, dtype=">f4", offset=4).astype(np.float32)
 
     def close(self) -> None:
-        """Close the database connection."""
-        self._logger.info("Closing pgVector database connection.")
-        if self._connection:
-            self._connection.close()
+        """Close all connections of the pool."""
+        self._logger.info("Closing pgVector database connections.")
+        if self._pool and not self._pool.closed:
+            self._pool.closeall()
@@ -1,12 +1,14 @@
 CREATE EXTENSION IF NOT EXISTS vector;
 
+-- The embedding column is migrated to HALFVEC(2048) by the application, if half precision storage is configured.
+-- Thus, the functions cast the stored embeddings to VECTOR(2048).
 CREATE TABLE IF NOT EXISTS feex_embeddings
 (
     filename  TEXT NOT NULL UNIQUE,
     embedding VECTOR(2048)
 );
 
-DROP FUNCTION get_neighbours(search_embedding VECTOR(2048), max_distance FLOAT, n_neighbours INTEGER);
+DROP FUNCTION IF EXISTS get_neighbours(search_embedding VECTOR(2048), max_distance FLOAT, n_neighbours INTEGER);
 CREATE OR REPLACE FUNCTION get_neighbours(search_embedding VECTOR(2048),
                                           max_distance FLOAT DEFAULT NULL,
                                           n_neighbours INTEGER DEFAULT NULL)
@@ -24,11 +26,77 @@ $$
 BEGIN
     RETURN QUERY
         SELECT a.filename,
-               a.embedding,
-               a.embedding <-> search_embedding AS distance
+               a.embedding::VECTOR(2048),
+               a.embedding::VECTOR(2048) <-> search_embedding AS distance
         FROM feex_embeddings a
-        WHERE (max_distance IS NULL OR a.embedding <-> search_embedding <= max_distance)
+        WHERE (max_distance IS NULL OR a.embedding::VECTOR(2048) <-> search_embedding <= max_distance)
         ORDER BY distance ASC
         LIMIT COALESCE(n_neighbours, 100);
 END
-$$;
\ No newline at end of file
+$$;
+
+-- Approximate search with the HNSW or IVFFlat index on embedding::halfvec(2048).
+-- Indexes support at most 2000 dimensions for VECTOR, thus the index is built on the half precision representation.
+-- The candidates are ordered by the indexed expression, the returned distance is computed with full precision.
+DROP FUNCTION IF EXISTS get_neighbours_ann(search_embedding VECTOR(2048), max_distance FLOAT, n_neighbours INTEGER);
+CREATE OR REPLACE FUNCTION get_neighbours_ann(search_embedding VECTOR(2048),
+                                              max_distance FLOAT DEFAULT NULL,
+                                              n_neighbours INTEGER DEFAULT NULL)
+    RETURNS TABLE
+            (
+                filename  TEXT,
+                embedding VECTOR(2048),
+                distance  FLOAT
+            )
+    LANGUAGE 'plpgsql'
+    PARALLEL SAFE
+    COST 200
+AS
+$$
+BEGIN
+    RETURN QUERY
+        SELECT candidate.filename,
+               candidate.embedding,
+               candidate.embedding <-> search_embedding AS distance
+        FROM (SELECT a.filename, a.embedding::VECTOR(2048) AS embedding
+              FROM feex_embeddings a
+              ORDER BY a.embedding::HALFVEC(2048) <-> search_embedding::HALFVEC(2048)
+              LIMIT COALESCE(n_neighbours, 100)) candidate
+        WHERE (max_distance IS NULL OR candidate.embedding <-> search_embedding <= max_distance)
+        ORDER BY distance ASC;
+END
+$$;
+
+-- Approximate search with the HNSW index on the binary quantized embeddings (1 bit per dimension).
+-- The candidates are ordered by their hamming distance and re-ranked with the exact distance.
+DROP FUNCTION IF EXISTS get_neighbours_binary(search_embedding VECTOR(2048), max_distance FLOAT,
+                                              n_neighbours INTEGER, n_candidates INTEGER);
+CREATE OR REPLACE FUNCTION get_neighbours_binary(search_embedding VECTOR(2048),
+                                                 max_distance FLOAT DEFAULT NULL,
+                                                 n_neighbours INTEGER DEFAULT NULL,
+                                                 n_candidates INTEGER DEFAULT NULL)
+    RETURNS TABLE
+            (
+                filename  TEXT,
+                embedding VECTOR(2048),
+                distance  FLOAT
+            )
+    LANGUAGE 'plpgsql'
+    PARALLEL SAFE
+    COST 200
+AS
+$$
+BEGIN
+    RETURN QUERY
+        SELECT candidate.filename,
+               candidate.embedding,
+               candidate.embedding <-> search_embedding AS distance
+        FROM (SELECT a.filename, a.embedding::VECTOR(2048) AS embedding
+              FROM feex_embeddings a
+              ORDER BY binary_quantize(a.embedding)::BIT(2048) <~> binary_quantize(search_embedding)
+              LIMIT COALESCE(n_candidates, 4 * COALESCE(n_neighbours, 100))) candidate
+        WHERE (max_distance IS NULL OR candidate.embedding <-> search_embedding <= max_distance)
+        ORDER BY distance ASC
+        LIMIT COALESCE(n_neighbours, 100);
+END
+$$;
@@ -1,6 +1,10 @@
 from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from typing import Optional
 
-from ..models import ImageEmbedding, ImageEmbeddingNeighbour
+import numpy as np
+
+from ..models import EmbeddingBatch, ImageEmbedding, ImageEmbeddingNeighbour
 
 
 class VectorDBRepository(ABC):
@@ -8,25 +12,78 @@ class VectorDBRepository(ABC):
 
     The repository ensures that different vector databases can be used in the application.
     Functionailty should include the storage of image embeddings and the retrieval of neighbours depending on a
-    distance threshold or a limit.
+    distance threshold or a limit. Neighbours only contain filename and distance, unless the embeddings are requested
+    with `include_embeddings`.
+    Multiple embeddings are passed as `EmbeddingBatch`, a list of `ImageEmbedding` is accepted as well and converted
+    with `EmbeddingBatch.of`.
     """
 
     @abstractmethod
-    def store_embeddings(self, image_embeddings: list[ImageEmbedding]) -> None:
+    def store_embeddings(self, image_embeddings: EmbeddingBatch | list[ImageEmbedding]) -> None:
         """Abstract method which should store image embeddings in the database."""
 
+    @abstractmethod
+    def health_check(self) -> bool:
+        """Abstract method which should return True if the database can be reached."""
+
+    @abstractmethod
+    def delete_embeddings(self, filenames: list[str]) -> None:
+        """Abstract method which should delete the embeddings of the given filenames from the database."""
+
     @abstractmethod
     def get_neighbours(
-        self, image_embedding: ImageEmbedding, threshold: float, limit: int = 50
+        self, image_embedding: ImageEmbedding, threshold: float, limit: int = 50, include_embeddings: bool = False
     ) -> list[ImageEmbeddingNeighbour]:
         """Abstract method which should return the neighbours of an image embedding."""
 
     @abstractmethod
-    def get_neighbours_top_n(self, image_embedding: ImageEmbedding, limit: int = 50) -> list[ImageEmbeddingNeighbour]:
+    def get_neighbours_batch(
+        self,
+        image_embeddings: EmbeddingBatch | list[ImageEmbedding],
+        threshold: Optional[float] = None,
+        limit: int = 50,
+        include_embeddings: bool = False,
+    ) -> list[list[ImageEmbeddingNeighbour]]:
+        """Abstract method which should return the neighbours of multiple image embeddings with a single query."""
+
+    @abstractmethod
+    def get_neighbours_top_n(
+        self, image_embedding: ImageEmbedding, limit: int = 50, include_embeddings: bool = False
+    ) -> list[ImageEmbeddingNeighbour]:
         """Abstract method which should return the n closest neighbours of an image embedding."""
 
     @abstractmethod
     def get_neighbours_threshold(
-        self, image_embedding: ImageEmbedding, threshold: float
+        self, image_embedding: ImageEmbedding, threshold: float, include_embeddings: bool = False
     ) -> list[ImageEmbeddingNeighbour]:
         """Abstract method which should return the neighbours of an image embedding with a distance threshold."""
+
+    @abstractmethod
+    def iter_embedding_blocks(self, block_size: int) -> Iterator[tuple[list[str], np.ndarray]]:
+        """Abstract method which should iterate over all stored embeddings as blocks of filenames and embeddings."""
+
+    @staticmethod
+    def pairwise_distances(embeddings: np.ndarray) -> np.ndarray:
+        """Distances between all pairs of the given embeddings, in the metric of the neighbour queries (squared L2).
+
+        Args:
+            embeddings (np.ndarray): embeddings of shape (n, 2048)
+
+        Returns:
+            np.ndarray: distance matrix of shape (n, n)
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.einsum("ij,ij->i", embeddings, embeddings)
+        # ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b, so a single matrix product is needed
+        distances = embeddings @ embeddings.T
+        distances *= -2
+        distances += norms[:, np.newaxis]
+        distances += norms[np.newaxis, :]
+        return np.maximum(distances, 0, out=distances)
+
+    def build_index(self) -> None:  # noqa: B027 - optional for databases without a separately built index
+        """Build the approximate search index of the database.
+
+        Building an index can take long, so it's only done by `python -m bube build-index` and not by the API.
+        Databases without a separately built index have nothing to do.
+        """
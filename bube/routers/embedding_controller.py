@@ -1,7 +1,11 @@
-from fastapi import APIRouter, Query, UploadFile
+from typing import Annotated
 
+from fastapi import APIRouter, Header, Query, Response, UploadFile
+
+from ..execution import run_in_inference_pool, run_staged_in_pools
 from ..models import ImageEmbedding
 from ..services import LocalImageService, RemoteImageService
+from .embedding_formats import EMBEDDING_RESPONSE_CONTENT, EmbeddingFormat
 
 
 class EmbeddingController:
@@ -10,6 +14,8 @@ class EmbeddingController:
     This controller class is responsible for handling requests related to image embeddings.
     Either images from a local directory or images uploaded through the API can be embedded.
     No duplicate checks are performed in this controller.
+    Besides JSON, the embeddings can be requested in compact binary formats with the `Accept` header, see
+    `EmbeddingFormat`.
     """
 
     router: APIRouter
@@ -28,28 +34,46 @@ class EmbeddingController:
             response_model=list[ImageEmbedding],
             summary="Calculate embeddings and compare them against db for images on the local disk",
             status_code=200,
+            responses={200: {"content": EMBEDDING_RESPONSE_CONTENT}},
         )
 
         self.router.add_api_route(
             "",
             self.calculate_embeddings,
             methods=["POST"],
-            response_model=None,
+            response_model=list[ImageEmbedding],
             summary="Calculate embeddings and compare them for images",
             status_code=200,
+            responses={200: {"content": EMBEDDING_RESPONSE_CONTENT}},
         )
 
     async def embed_local_images(
-        self, image_root: str, filenames: list[str] | None = Query(None)
-    ) -> list[ImageEmbedding]:
+        self,
+        image_root: str,
+        filenames: list[str] | None = Query(None),
+        accept: Annotated[str | None, Header()] = None,
+    ) -> Response:
         """Embed images from a local directory and compare them against the database."""
-        return self._local_image_service.embed_local_images(image_root=image_root, filenames=filenames)
+        embedding_format = EmbeddingFormat.from_accept_header(accept)
+        return await run_in_inference_pool(
+            lambda: embedding_format.encode(
+                self._local_image_service.embed_local_images(image_root=image_root, filenames=filenames)
+            )
+        )
 
-    async def calculate_embeddings(self, images: list[UploadFile]) -> list[ImageEmbedding]:
+    async def calculate_embeddings(
+        self, images: list[UploadFile], accept: Annotated[str | None, Header()] = None
+    ) -> Response:
         """Calculate embeddings for images uploaded through the API."""
+        embedding_format = EmbeddingFormat.from_accept_header(accept)
         # filter for valid image types
         images = [image for image in images if image.content_type.startswith("image/")]
 
         image_binariers = [image.file for image in images]
         image_filenames = [image.filename for image in images]
-        return self._remote_image_service.embed_images(images=image_binariers, filenames=image_filenames)
+        # the images are decoded in the inference pool, the request waits for the batch scheduler on the event loop
+        image_embeddings = await run_staged_in_pools(
+            self._remote_image_service.embed_images_stages(images=image_binariers, filenames=image_filenames)
+        )
+        # the response is encoded in the pool as well, so large responses don't block the event loop
+        return await run_in_inference_pool(embedding_format.encode, image_embeddings)
@@ -0,0 +1,113 @@
+import base64
+import io
+from typing import NamedTuple, Optional
+
+import numpy as np
+import orjson
+from fastapi import HTTPException, Response
+
+from ..models import EmbeddingBatch
+
+JSON_MEDIA_TYPE = "application/json"
+# JSON with the embeddings as base64 encoded little-endian floats
+BASE64_MEDIA_TYPE = "application/vnd.bube.base64+json"
+# a single .npy array with one record (filename, embedding) per image
+NPY_MEDIA_TYPE = "application/x-npy"
+NUMPY_DTYPES = {"float32": "<f4", "float16": "<f2"}
+
+# media types for the `responses` of the OpenAPI documentation
+EMBEDDING_RESPONSE_CONTENT = {
+    BASE64_MEDIA_TYPE: {"schema": {"type": "array", "items": {"type": "object"}}},
+    NPY_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}},
+}
+
+
+class EmbeddingFormat(NamedTuple):
+    """Format of an embedding response, which is selected by the `Accept` header."""
+
+    media_type: str = JSON_MEDIA_TYPE
+    # precision of the binary formats, JSON always contains the float32 values
+    dtype: str = "float32"
+
+    @property
+    def content_type(self) -> str:
+        """Content type of the response, the binary formats declare their precision as parameter."""
+        if self.media_type == JSON_MEDIA_TYPE:
+            return JSON_MEDIA_TYPE
+        return f"{self.media_type}; dtype={self.dtype}"
+
+    @classmethod
+    def from_accept_header(cls, accept: Optional[str]) -> "EmbeddingFormat":
+        """Select the supported media type with the highest quality, JSON is used if the client accepts any type.
+
+        The precision of the binary formats is set with the `dtype` parameter, e.g.
+        `Accept: application/x-npy; dtype=float16`.
+
+        Raises:
+            HTTPException: 406 if none of the accepted media types is supported
+        """
+        if not accept:
+            return cls()
+        candidates = []
+        for media_range in accept.split(","):
+            media_type, *parameter_list = (part.strip() for part in media_range.split(";"))
+            parameters = dict(parameter.partition("=")[::2] for parameter in parameter_list)
+            try:
+                quality = float(parameters.get("q", 1))
+            except ValueError:
+                quality = 0.0
+            if quality > 0:
+                candidates.append((quality, media_type.lower(), parameters.get("dtype", "float32").lower()))
+        # the sort is stable, so the order of the header decides between equal qualities
+        for _, media_type, dtype in sorted(candidates, key=lambda candidate: -candidate[0]):
+            if media_type in (JSON_MEDIA_TYPE, "application/*", "*/*"):
+                return cls()
+            if media_type in (BASE64_MEDIA_TYPE, NPY_MEDIA_TYPE) and dtype in NUMPY_DTYPES:
+                return cls(media_type, dtype)
+        error_msg = (
+            f"Supported media types are {JSON_MEDIA_TYPE}, {BASE64_MEDIA_TYPE} and {NPY_MEDIA_TYPE} "
+            f"with dtype {' or '.join(NUMPY_DTYPES)}."
+        )
+        raise HTTPException(status_code=406, detail=error_msg)
+
+    def encode(self, image_embeddings: EmbeddingBatch) -> Response:
+        """Encode image embeddings as response in this format.
+
+        The response is built directly from the batch instead of converting it to the pydantic response model. The
+        JSON format is encoded with orjson, which writes the shortest representation of each float32 value.
+        """
+        if self.media_type == JSON_MEDIA_TYPE:
+            content = orjson.dumps(
+                [
+                    {"embedding": embedding, "filename": filename}
+                    for filename, embedding in zip(image_embeddings.filenames, image_embeddings.embeddings)
+                ],
+                option=orjson.OPT_SERIALIZE_NUMPY,
+            )
+        elif self.media_type == BASE64_MEDIA_TYPE:
+            embeddings = image_embeddings.embeddings.astype(NUMPY_DTYPES[self.dtype])
+            content = orjson.dumps(
+                [
+                    {"embedding": base64.b64encode(embedding.tobytes()).decode("ascii"), "filename": filename}
+                    for filename, embedding in zip(image_embeddings.filenames, embeddings)
+                ]
+            )
+        else:
+            content = self._encode_npy(image_embeddings)
+        return Response(content=content, media_type=self.content_type)
+
+    def _encode_npy(self, image_embeddings: EmbeddingBatch) -> bytes:
+        """Encode the embeddings as structured array, which is read with `np.load` (no pickle needed)."""
+        max_filename_length = max([1, *map(len, image_embeddings.filenames)])
+        records = np.empty(
+            len(image_embeddings),
+            dtype=[
+                ("filename", f"<U{max_filename_length}"),
+                ("embedding", NUMPY_DTYPES[self.dtype], (image_embeddings.embeddings.shape[1],)),
+            ],
+        )
+        records["filename"] = image_embeddings.filenames
+        records["embedding"] = image_embeddings.embeddings
+        buffer = io.BytesIO()
+        np.save(buffer, records, allow_pickle=False)
+        return buffer.getvalue()
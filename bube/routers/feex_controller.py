@@ -1,7 +1,8 @@
 from typing import Optional
 
-from fastapi import APIRouter, File, Form, UploadFile
+from fastapi import APIRouter, File, Form, Response, UploadFile
 
+from ..execution import run_in_db_pool, run_staged_in_pools
 from ..models import DuplicateReport
 from ..services import FEEXService
 
@@ -25,6 +26,15 @@ class FEEXController:
             status_code=201,
         )
 
+        self.router.add_api_route(
+            "/health",
+            self.health,
+            methods=["GET"],
+            response_model=dict[str, str],
+            summary="Check if the vector database can be reached",
+            status_code=200,
+        )
+
         self.router.add_api_route(
             "",
             self.calculate_duplicate_report,
@@ -34,6 +44,13 @@ class FEEXController:
             status_code=200,
         )
 
+    async def health(self, response: Response) -> dict[str, str]:
+        """Readiness check of the vector database, which answers with status code 503 if it can't be reached."""
+        if await run_in_db_pool(self._feex_service.check_database_health):
+            return {"status": "ok"}
+        response.status_code = 503
+        return {"status": "database unavailable"}
+
     async def calculate_duplicate_report(
         self,
         images: list[UploadFile] = File(None),
@@ -58,8 +75,12 @@ class FEEXController:
             images = [image for image in images if image.content_type.startswith("image/")]
             filenames = [image.filename for image in images]
             images = [image.file for image in images]
-        return self._feex_service.check_duplicate(
-            images=images, image_root=image_root, filenames=filenames, save_embeddings=save_embeddings
+
+        # every stage runs in its own pool, so the event loop stays responsive while images are processed
+        return await run_staged_in_pools(
+            self._feex_service.check_duplicate_stages(
+                images=images, image_root=image_root, filenames=filenames, save_embeddings=save_embeddings
+            )
         )
 
     async def store_images(
@@ -67,6 +88,7 @@ class FEEXController:
         images: list[UploadFile] = File(None),
         image_root: Optional[str] = Form(None),
         filenames: list[str] = Form(None),
+        prune_deleted: Optional[bool] = Form(False),
     ) -> None:
         """Embed images and store them in the database.
 
@@ -77,9 +99,15 @@ class FEEXController:
             images(list[UploadFile]): The images to embed and check for duplicates.
             image_root(Optional[str]): The root directory of the images if local images should be used
             filenames(list[str]): The filenames of the images if local images should be used. Optional.
+            prune_deleted(Optional[bool]): Whether to delete the embeddings of local images which were removed from
+                the image root. Only used if the manifest is enabled. Defaults to False.
         """
         if images:
             images = [image for image in images if image.content_type.startswith("image/")]
             filenames = [image.filename for image in images]
             images = [image.file for image in images]
-        return self._feex_service.embed_and_store_images(images=images, image_root=image_root, filenames=filenames)
+        await run_staged_in_pools(
+            self._feex_service.embed_and_store_stages(
+                images=images, image_root=image_root, filenames=filenames, prune_deleted=prune_deleted
+            )
+        )
@@ -1,6 +1,15 @@
+from .cluster_service import ClusterService
 from .feex_service import FEEXService
 from .image_embedding_model import ImageEmbeddingModel
+from .ingest_service import IngestService
 from .local_image_service import LocalImageService
 from .remote_image_service import RemoteImageService
 
-__all__ = ["FEEXService", "ImageEmbeddingModel", "LocalImageService", "RemoteImageService"]
+__all__ = [
+    "ClusterService",
+    "FEEXService",
+    "ImageEmbeddingModel",
+    "IngestService",
+    "LocalImageService",
+    "RemoteImageService",
+]
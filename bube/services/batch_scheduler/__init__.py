@@ -0,0 +1,3 @@
+from .batch_scheduler import EmbeddingBatchScheduler
+
+__all__ = ["EmbeddingBatchScheduler"]
@@ -0,0 +1,137 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional
+
+import numpy as np
+
+from ...config import config
+from ..image_embedding_model import ImageEmbeddingModel
+
+
+class _PendingImage:
+    """An image waiting for inference together with the future which receives its embedding."""
+
+    __slots__ = ("future", "image")
+
+    def __init__(self, image: np.ndarray):
+        self.image = image
+        self.future: Future[np.ndarray] = Future()
+
+
+class EmbeddingBatchScheduler:
+    """Micro-batching scheduler in front of the ImageEmbeddingModel.
+
+    Single images from concurrent requests are collected for a short time window (or until the maximum batch size is
+    reached), grouped by their tensor shape and embedded with one call to `compute_embedding_batch` per shape.
+    Every caller receives the embedding of its own image through a future.
+    """
+
+    _instance = None
+    _is_initialized = False
+
+    _embedding_model: ImageEmbeddingModel
+    _max_wait_s: float
+    _max_batch_size: int
+    _queue: "queue.Queue[_PendingImage]"
+    _worker: threading.Thread
+
+    _logger: logging.Logger
+
+    def __new__(cls, *args, **kwargs):
+        """Singleton pattern to ensure that all services share the same batching window."""
+        if not cls._instance:
+            cls._instance = super(EmbeddingBatchScheduler, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self, max_wait_ms: Optional[float] = None, max_batch_size: Optional[int] = None):
+        """Init the scheduler and start the worker thread.
+
+        Args:
+            max_wait_ms (float, optional): Maximum time in milliseconds the first image of a batch waits for further
+                images. Defaults to config.BATCH_SCHEDULER_MAX_WAIT_MS.
+            max_batch_size (int, optional): Maximum number of images which are collected for one batch.
+                Defaults to config.BATCH_SCHEDULER_MAX_BATCH_SIZE.
+        """
+        if self._is_initialized:
+            return
+
+        self._logger = logging.getLogger(__name__)
+        self._embedding_model = ImageEmbeddingModel()
+        max_wait_ms = config.BATCH_SCHEDULER_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms
+        self._max_wait_s = max_wait_ms / 1000
+        self._max_batch_size = max_batch_size or config.BATCH_SCHEDULER_MAX_BATCH_SIZE
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="embedding-batch-scheduler", daemon=True)
+        self._worker.start()
+        self._is_initialized = True
+
+        self._logger.info(
+            f"Batch scheduler started with max wait of {max_wait_ms} ms and max batch size of {self._max_batch_size}."
+        )
+
+    def submit(self, input_img: np.ndarray) -> Future:
+        """Queue a single image for inference.
+
+        Args:
+            input_img (np.ndarray): Image to compute embeddings for. Shape should be: (Height, Width, Channel=3)
+
+        Returns:
+            Future: Future which resolves to the embedding of the image in shape (Embedding_dim=2048)
+        """
+        pending_image = _PendingImage(input_img)
+        self._queue.put(pending_image)
+        return pending_image.future
+
+    def compute_embedding_single(self, input_img: np.ndarray) -> np.ndarray:
+        """Compute the embedding for a single image and block until it is available."""
+        return self.submit(input_img).result()
+
+    def compute_embeddings(self, input_imgs: list[np.ndarray]) -> list[np.ndarray]:
+        """Compute the embeddings for multiple images of arbitrary shapes.
+
+        All images are queued at once, so they can share batches with each other and with concurrent requests.
+
+        Args:
+            input_imgs (list[np.ndarray]): Images to compute embeddings for. Shape of each image should be:
+                (Height, Width, Channel=3)
+
+        Returns:
+            list[np.ndarray]: Embeddings in the same order as the input images
+        """
+        futures = [self.submit(input_img) for input_img in input_imgs]
+        return [future.result() for future in futures]
+
+    def _run(self) -> None:
+        """Worker loop which collects pending images into batches and runs the inference."""
+        while True:
+            pending_images = [self._queue.get()]
+            deadline = time.monotonic() + self._max_wait_s
+            while len(pending_images) < self._max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    pending_images.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._process(pending_images)
+
+    def _process(self, pending_images: list[_PendingImage]) -> None:
+        """Run one batched inference per tensor shape and resolve the futures of the callers."""
+        images_by_shape: dict[tuple[int, ...], list[_PendingImage]] = {}
+        for pending_image in pending_images:
+            images_by_shape.setdefault(pending_image.image.shape, []).append(pending_image)
+
+        for shape, group in images_by_shape.items():
+            self._logger.debug(f"Running batched inference for {len(group)} images with shape {shape}.")
+            try:
+                embeddings = self._embedding_model.compute_embedding_batch(np.stack([p.image for p in group], axis=0))
+            except Exception as e:  # noqa: BLE001 - the error is passed on to every waiting caller
+                for pending_image in group:
+                    pending_image.future.set_exception(e)
+                continue
+            for pending_image, embedding in zip(group, embeddings):
+                pending_image.future.set_result(embedding)
@@ -0,0 +1,3 @@
+from .cluster_service import ClusterService, UnionFind
+
+__all__ = ["ClusterService", "UnionFind"]
@@ -0,0 +1,157 @@
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from ...config import config
+from ...models import ClusterReport, DuplicateCluster, EmbeddingBatch
+from ...repository import VectorDBRepository
+
+
+class UnionFind:
+    """Disjoint sets of integer ids with path halving and union by size."""
+
+    _parents: list[int]
+    _sizes: list[int]
+
+    def __init__(self):
+        self._parents = []
+        self._sizes = []
+
+    def __len__(self) -> int:
+        """Number of elements in all sets."""
+        return len(self._parents)
+
+    def add(self) -> int:
+        """Add a new set with a single element and return its id."""
+        self._parents.append(len(self._parents))
+        self._sizes.append(1)
+        return len(self._parents) - 1
+
+    def find(self, element: int) -> int:
+        """Return the root of the set of an element."""
+        parents = self._parents
+        while parents[element] != element:
+            parents[element] = parents[parents[element]]
+            element = parents[element]
+        return element
+
+    def union(self, first: int, second: int) -> None:
+        """Join the sets of two elements."""
+        first, second = self.find(first), self.find(second)
+        if first == second:
+            return
+        if self._sizes[first] < self._sizes[second]:
+            first, second = second, first
+        self._parents[second] = first
+        self._sizes[first] += self._sizes[second]
+
+    def groups(self) -> list[list[int]]:
+        """All sets with their elements."""
+        groups: dict[int, list[int]] = {}
+        for element in range(len(self._parents)):
+            groups.setdefault(self.find(element), []).append(element)
+        return list(groups.values())
+
+
+class ClusterService:
+    """Service class for finding all duplicate clusters of the stored embeddings.
+
+    The embeddings are read from the repository in blocks and each block is searched against the whole corpus with one
+    `get_neighbours_batch` call, so the repository uses its own search: blocked matrix products for the NumPy database,
+    the ANN index for IVF-PQ, HNSW or IVFFlat. The blocks are searched in parallel by `num_workers` threads, at most two
+    blocks per worker are read ahead, so the memory doesn't grow with the corpus. Pairs below the threshold are joined
+    into clusters with union-find, only the files of such pairs are kept.
+    Each embedding links to at most `CLUSTER_NEIGHBOUR_LIMIT` neighbours, larger groups are still joined through the
+    neighbours of their members.
+    """
+
+    _vector_db: VectorDBRepository
+    _block_size: int
+    _num_workers: int
+    _neighbour_limit: int
+    _logger: logging.Logger
+
+    def __init__(
+        self,
+        vector_db: VectorDBRepository,
+        block_size: int = config.CLUSTER_BLOCK_SIZE,
+        num_workers: Optional[int] = config.CLUSTER_NUM_WORKERS,
+    ):
+        """Create the service.
+
+        Args:
+            vector_db (VectorDBRepository): database with the embeddings which are clustered
+            block_size (int, optional): number of embeddings which are searched with one query
+            num_workers (int, optional): number of blocks which are searched in parallel, defaults to the number of
+                CPU cores
+        """
+        self._vector_db = vector_db
+        self._block_size = block_size
+        self._num_workers = num_workers or os.cpu_count() or 1
+        self._neighbour_limit = config.CLUSTER_NEIGHBOUR_LIMIT
+        self._logger = logging.getLogger(__name__)
+
+    def find_clusters(self, threshold: float) -> ClusterReport:
+        """Find all groups of stored files which are connected by distances below the threshold.
+
+        Args:
+            threshold (float): maximum distance of two files in the metric of the repository
+
+        Returns:
+            ClusterReport: clusters with at least two files, the largest clusters first
+        """
+        start = time.perf_counter()
+        union_find = UnionFind()
+        element_by_filename: dict[str, int] = {}
+        num_embeddings = 0
+
+        def add_pairs(pairs: list[tuple[str, str]]) -> None:
+            for first, second in pairs:
+                elements = []
+                for filename in (first, second):
+                    if filename not in element_by_filename:
+                        element_by_filename[filename] = union_find.add()
+                    elements.append(element_by_filename[filename])
+                union_find.union(*elements)
+
+        with ThreadPoolExecutor(max_workers=self._num_workers) as executor:
+            pending: deque[Future] = deque()
+            for filenames, embeddings in self._vector_db.iter_embedding_blocks(self._block_size):
+                pending.append(executor.submit(self._find_pairs, filenames, embeddings, threshold))
+                num_embeddings += len(filenames)
+                if len(pending) >= 2 * self._num_workers:
+                    add_pairs(pending.popleft().result())
+                    self._logger.info(f"Searched {num_embeddings} embeddings, {len(union_find)} files have duplicates.")
+            while pending:
+                add_pairs(pending.popleft().result())
+
+        filenames = list(element_by_filename)
+        clusters = [
+            DuplicateCluster(num_of_files=len(group), filenames=sorted(filenames[element] for element in group))
+            for group in union_find.groups()
+        ]
+        clusters.sort(key=lambda cluster: (-cluster.num_of_files, cluster.filenames[0]))
+        self._logger.info(
+            f"Found {len(clusters)} clusters with {len(filenames)} files in {num_embeddings} embeddings "
+            f"in {time.perf_counter() - start:.1f}s."
+        )
+        return ClusterReport(
+            threshold=threshold, num_of_embeddings=num_embeddings, num_of_clusters=len(clusters), clusters=clusters
+        )
+
+    def _find_pairs(self, filenames: list[str], embeddings: np.ndarray, threshold: float) -> list[tuple[str, str]]:
+        """Search the neighbours of a block and return the pairs of different files below the threshold."""
+        neighbours_batch = self._vector_db.get_neighbours_batch(
+            EmbeddingBatch(filenames, embeddings), threshold=threshold, limit=self._neighbour_limit
+        )
+        return [
+            (filename, neighbour.filename)
+            for filename, neighbours in zip(filenames, neighbours_batch)
+            for neighbour in neighbours
+            if neighbour.filename != filename
+        ]
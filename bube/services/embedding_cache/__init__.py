@@ -0,0 +1,3 @@
+from .embedding_cache import CacheLookup, EmbeddingCache, get_embedding_fingerprint, hash_file
+
+__all__ = ["CacheLookup", "EmbeddingCache", "get_embedding_fingerprint", "hash_file"]
@@ -0,0 +1,226 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from ...config import config
+from ..image_embedding_model import ImageEmbeddingModel
+
+
+def get_embedding_fingerprint() -> str:
+    """Get a fingerprint of the model and all settings which change the embedding of an image."""
+    model_fingerprint = ImageEmbeddingModel().model_fingerprint
+    return f"{model_fingerprint}|{config.MAX_INPUT_SIDE}|{config.LOCAL_IMAGE_SHAPE_BUCKET_SIZE}"
+
+
+def hash_file(path: str, key: bytes = b"") -> str:
+    """Hash the content of a file without loading the whole file into memory."""
+    content_hash = hashlib.blake2b(digest_size=16, key=key)
+    with Path(path).open("rb") as f:
+        while chunk := f.read(1 << 20):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+@dataclass
+class CacheLookup:
+    """Embeddings found in the cache for the keys of a request, see `EmbeddingCache.lookup`."""
+
+    keys: list[str]
+    embeddings_by_key: dict[str, np.ndarray]
+    # first position of every key, which isn't cached
+    missing_positions: dict[str, int]
+
+    @property
+    def positions_to_embed(self) -> list[int]:
+        """Positions of the images which have to be embedded, identical images are only embedded once."""
+        return list(self.missing_positions.values())
+
+
+class EmbeddingCache:
+    """Content-addressed cache for image embeddings.
+
+    Embeddings are stored under a hash of the raw image bytes, so re-uploaded images and identical files in different
+    folders are only embedded once. The hash is keyed with the model fingerprint and the decoding settings, so cached
+    embeddings are never reused after the model or the settings changed.
+    The cache consists of a bounded in-memory LRU tier and an optional on-disk tier.
+    """
+
+    _instance = None
+    _is_initialized = False
+
+    _max_entries: int
+    _disk_path: Optional[Path]
+    _namespace: bytes
+    _entries: "OrderedDict[str, np.ndarray]"
+    _lock: threading.Lock
+    _hits: int
+    _requests: int
+
+    _logger: logging.Logger
+
+    def __new__(cls, *args, **kwargs):
+        """Singleton pattern to ensure that all services share the same cache."""
+        if not cls._instance:
+            cls._instance = super(EmbeddingCache, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self, max_entries: Optional[int] = None, disk_path: Optional[str] = None):
+        """Init the cache.
+
+        Args:
+            max_entries (int, optional): Maximum number of embeddings in the in-memory tier.
+                Defaults to config.EMBEDDING_CACHE_SIZE.
+            disk_path (str, optional): Directory of the on-disk tier. Defaults to config.EMBEDDING_CACHE_DISK_PATH,
+                if neither is set, only the in-memory tier is used.
+        """
+        if self._is_initialized:
+            return
+
+        self._logger = logging.getLogger(__name__)
+        self._max_entries = max_entries or config.EMBEDDING_CACHE_SIZE
+        disk_path = disk_path or config.EMBEDDING_CACHE_DISK_PATH
+        self._disk_path = Path(disk_path) if disk_path else None
+        if self._disk_path:
+            self._disk_path.mkdir(parents=True, exist_ok=True)
+        # all settings which change the embedding of an image are part of the namespace
+        self._namespace = hashlib.blake2b(get_embedding_fingerprint().encode(), digest_size=32).digest()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._requests = 0
+        self._is_initialized = True
+
+        self._logger.info(f"Embedding cache with {self._max_entries} entries and disk tier at: {self._disk_path}")
+
+    def hash_bytes(self, content: bytes) -> str:
+        """Get the cache key for the raw bytes of an image."""
+        return hashlib.blake2b(content, digest_size=16, key=self._namespace).hexdigest()
+
+    def hash_file(self, path: str) -> str:
+        """Get the cache key for an image file without loading the whole file into memory."""
+        return hash_file(path, key=self._namespace)
+
+    def get_embeddings(
+        self, keys: list[str], embed_missing: Callable[[list[int]], dict[int, np.ndarray]]
+    ) -> list[Optional[np.ndarray]]:
+        """Get the embeddings for the given keys and compute only the missing ones.
+
+        Identical images within the keys are only computed once.
+
+        Args:
+            keys (list[str]): cache keys of the images (see `hash_bytes` and `hash_file`)
+            embed_missing (Callable[[list[int]], dict[int, np.ndarray]]): function, which receives the positions of
+                the images which have to be embedded and returns their embeddings by position. Images which couldn't
+                be embedded may be missing in the result.
+
+        Returns:
+            list[Optional[np.ndarray]]: embeddings in the order of the keys, None if an image couldn't be embedded
+        """
+        lookup = self.lookup(keys)
+        computed_embeddings = embed_missing(lookup.positions_to_embed) if lookup.missing_positions else {}
+        return self.complete(lookup, computed_embeddings)
+
+    def lookup(self, keys: list[str]) -> CacheLookup:
+        """Get the cached embeddings for the given keys, the first step of `get_embeddings`.
+
+        Callers which embed the missing images asynchronously pass the result to `complete` afterwards.
+        """
+        embeddings_by_key = {}
+        missing_positions = {}
+        for position, key in enumerate(keys):
+            if key in embeddings_by_key or key in missing_positions:
+                continue
+            embedding = self.get(key)
+            if embedding is None:
+                missing_positions[key] = position
+            else:
+                embeddings_by_key[key] = embedding
+        return CacheLookup(keys, embeddings_by_key, missing_positions)
+
+    def complete(self, lookup: CacheLookup, computed_embeddings: dict[int, np.ndarray]) -> list[Optional[np.ndarray]]:
+        """Cache the computed embeddings of a lookup and return all embeddings in the order of its keys.
+
+        Args:
+            lookup (CacheLookup): result of `lookup`
+            computed_embeddings (dict[int, np.ndarray]): embeddings of the images at `lookup.positions_to_embed` by
+                position. Images which couldn't be embedded may be missing.
+
+        Returns:
+            list[Optional[np.ndarray]]: embeddings in the order of the keys, None if an image couldn't be embedded
+        """
+        keys, embeddings_by_key, missing_positions = lookup.keys, lookup.embeddings_by_key, lookup.missing_positions
+        for key, position in missing_positions.items():
+            if position in computed_embeddings:
+                embeddings_by_key[key] = computed_embeddings[position]
+                self.put(key, computed_embeddings[position])
+
+        with self._lock:
+            self._requests += len(keys)
+            self._hits += len(keys) - len(missing_positions)
+        self._logger.info(
+            f"Embedding cache: {len(keys) - len(missing_positions)} of {len(keys)} images didn't need inference "
+            f"({len(keys) - len(set(keys))} duplicates within the request). Total hit rate: {self.hit_rate:.1%}"
+        )
+        return [embeddings_by_key.get(key) for key in keys]
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Get an embedding from the memory tier or (if available) from the disk tier."""
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                return embedding
+
+        disk_file = self._get_disk_file(key)
+        if disk_file is None or not disk_file.exists():
+            return None
+        embedding = np.load(disk_file)
+        self._put_memory(key, embedding)
+        return embedding
+
+    def put(self, key: str, embedding: np.ndarray) -> None:
+        """Store an embedding in the memory tier and (if available) in the disk tier."""
+        self._put_memory(key, embedding)
+        disk_file = self._get_disk_file(key)
+        if disk_file is not None and not disk_file.exists():
+            disk_file.parent.mkdir(exist_ok=True)
+            # write to a temporary file first, so concurrent readers never see a partially written file
+            tmp_file = disk_file.with_suffix(f".{threading.get_ident()}.tmp")
+            with tmp_file.open("wb") as f:
+                np.save(f, embedding)
+            tmp_file.replace(disk_file)
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of the requested images since startup, which didn't need an inference."""
+        return self._hits / self._requests if self._requests else 0.0
+
+    def get_stats(self) -> dict[str, float]:
+        """Get the statistics of the cache."""
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "hits": self._hits,
+                "hit_rate": self.hit_rate,
+                "memory_entries": len(self._entries),
+            }
+
+    def _put_memory(self, key: str, embedding: np.ndarray) -> None:
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_disk_file(self, key: str) -> Optional[Path]:
+        if self._disk_path is None:
+            return None
+        # files are sharded by the first two characters of the key to avoid huge directories
+        return self._disk_path / key[:2] / f"{key}.npy"
@@ -1,10 +1,35 @@
+import functools
 import logging
 from typing import BinaryIO, Optional
 
+import numpy as np
+
 from ...config import config
-from ...models import DuplicateReport, DuplicateReportPart, ImageEmbedding, SuspiciousFile
-from ...repository import EmbeddedChromaDB, PgVector, VectorDBRepository
-from ..local_image_service import LocalImageService
+from ...execution import Stage, StagedOperation, run_staged
+from ...models import (
+    SUSPICIOUS_DISTANCE,
+    ClusterReport,
+    DuplicateReport,
+    DuplicateReportPart,
+    EmbeddingBatch,
+    EmbeddingRecord,
+    ImageEmbedding,
+    ImageEmbeddingNeighbour,
+    SuspiciousFile,
+    classify_distance,
+)
+from ...repository import (
+    EmbeddedChromaDB,
+    EmbeddingProjection,
+    IvfPqVectorDB,
+    NumpyVectorDB,
+    PgVector,
+    VectorDBRepository,
+)
+from ..cluster_service import ClusterService
+from ..image_embedding_model import ImageEmbeddingModel
+from ..ingest_service import IngestService, IngestStats
+from ..local_image_service import LocalImageService, LocalIndexResult
 from ..remote_image_service import RemoteImageService
 
 
@@ -23,8 +48,6 @@ class FEEXService:
 
     _logger: logging.Logger
 
-    duplicate_threshould: int
-
     def __init__(self):
         self._logger = logging.getLogger(__name__)
         self._local_image_service = LocalImageService()
@@ -32,11 +55,30 @@ class FEEXService:
         if config.DB_TYPE == "chroma":
             self._logger.info("Using ChromaDB")
             self.__vector_db = EmbeddedChromaDB()
+        elif config.DB_TYPE == "numpy":
+            self._logger.info("Using memory-mapped NumPy vector database")
+            self.__vector_db = NumpyVectorDB(projection=self._load_projection())
+        elif config.DB_TYPE == "ivfpq":
+            self._logger.info("Using NumPy vector database with IVF-PQ index")
+            self.__vector_db = IvfPqVectorDB(projection=self._load_projection())
         else:
             self._logger.info("Using PgVector")
             self.__vector_db = PgVector()
 
-        self.duplicate_threshould = config.DUPLICATE_THRESHOLD_PERCENTAGE
+    def _load_projection(self) -> Optional[EmbeddingProjection]:
+        """Load the projection for candidate generation, if it is enabled and was fitted for the current model."""
+        if not config.EMBEDDING_PROJECTION_ENABLED:
+            return None
+        projection_path = config.EMBEDDING_PROJECTION_PATH or EmbeddingProjection.default_path()
+        try:
+            projection = EmbeddingProjection.load(projection_path)
+        except OSError:
+            self._logger.warning(f"No projection found at {projection_path}. Run `python -m bube fit-projection`.")
+            return None
+        if projection.model_fingerprint != ImageEmbeddingModel().model_fingerprint:
+            self._logger.warning(f"Projection {projection_path} was fitted for another model. Not using it.")
+            return None
+        return projection
 
     def check_duplicate(
         self,
@@ -66,21 +108,82 @@ class FEEXService:
                 suspicious files with their filenames, distances and duplication_chance.
 
         """
-        # create image embeddings
-        if images:
-            image_embeddings = self.embed_remote_images(images=images, filenames=filenames)
-        else:
-            image_embeddings = self.embed_local_images(image_root=image_root, filenames=filenames)
+        return run_staged(
+            self.check_duplicate_stages(
+                images=images, image_root=image_root, filenames=filenames, save_embeddings=save_embeddings
+            )
+        )
 
+    def check_duplicate_stages(
+        self,
+        images: Optional[list[BinaryIO]] = None,
+        image_root: Optional[str] = None,
+        filenames: Optional[list[str]] = None,
+        save_embeddings: bool = True,
+    ) -> StagedOperation[list[DuplicateReport]]:
+        """Stages of `check_duplicate`, which the API runs in the inference and database pools."""
+        image_embeddings = yield from self.embed_images_stages(
+            images=images, image_root=image_root, filenames=filenames
+        )
         # check for duplicates in db
-        duplicate_reports = [self.create_duplicate_report(image_embedding) for image_embedding in image_embeddings]
-        self._logger.info(f"Duplicate Report was created for {len(duplicate_reports)} images.")
-        # Save the elements after inspection, so that the duplicate check doesn't operate on the images from same case
+        duplicate_reports = yield Stage("db", functools.partial(self.create_duplicate_reports, image_embeddings))
+        # Save the elements after inspection, so that the images aren't reported as their own duplicates. Duplicates
+        # within the same case are found with the distance matrix of the request.
         if save_embeddings:
-            self.store_image_embeddings(image_embeddings)
+            yield Stage("db", functools.partial(self.store_image_embeddings, image_embeddings))
+        return duplicate_reports
+
+    def create_duplicate_reports(self, image_embeddings: EmbeddingBatch) -> list[DuplicateReport]:
+        """Creates a DuplicateReport for each of the given image embeddings.
 
+        The neighbours of all image embeddings are queried with a single call to the database. Since the embeddings are
+        only stored after the reports are built, duplicates within the given images are added from their own distance
+        matrix.
+        """
+        neighbours_batch = self.__vector_db.get_neighbours_batch(
+            image_embeddings=image_embeddings, threshold=SUSPICIOUS_DISTANCE
+        )
+        request_neighbours_batch = self._get_request_neighbours(image_embeddings, threshold=SUSPICIOUS_DISTANCE)
+        duplicate_reports = [
+            self._build_duplicate_report(image_embedding, self._merge_neighbours(neighbours, request_neighbours))
+            for image_embedding, neighbours, request_neighbours in zip(
+                image_embeddings, neighbours_batch, request_neighbours_batch
+            )
+        ]
+        self._logger.info(f"Duplicate Report was created for {len(duplicate_reports)} images.")
         return duplicate_reports
 
+    def _get_request_neighbours(
+        self, image_embeddings: EmbeddingBatch, threshold: float
+    ) -> list[list[ImageEmbeddingNeighbour]]:
+        """Finds the neighbours of each image embedding among the other given image embeddings.
+
+        The distances of all pairs are computed in one vectorized pass, which stays fast for hundreds of images.
+        """
+        request_neighbours = [[] for _ in image_embeddings]
+        if len(image_embeddings) < 2:
+            return request_neighbours
+        distances = self.__vector_db.pairwise_distances(image_embeddings.embeddings)
+        np.fill_diagonal(distances, np.inf)
+        for row, column in zip(*np.nonzero(distances <= threshold)):
+            request_neighbours[row].append(
+                ImageEmbeddingNeighbour(
+                    filename=image_embeddings.filenames[column], distance=float(distances[row, column])
+                )
+            )
+        return request_neighbours
+
+    @staticmethod
+    def _merge_neighbours(
+        neighbours: list[ImageEmbeddingNeighbour], request_neighbours: list[ImageEmbeddingNeighbour]
+    ) -> list[ImageEmbeddingNeighbour]:
+        """Merges the neighbours from the database and the request, each filename is kept with its closest match."""
+        closest = {}
+        for neighbour in [*neighbours, *request_neighbours]:
+            if neighbour.filename not in closest or neighbour.distance < closest[neighbour.filename].distance:
+                closest[neighbour.filename] = neighbour
+        return sorted(closest.values(), key=lambda neighbour: neighbour.distance)
+
     def create_duplicate_report(self, image_embedding: ImageEmbedding) -> DuplicateReport:
         """Creates a DuplicateReport for a given image embedding.
 
@@ -95,14 +198,20 @@ class FEEXService:
         Returns:
             DuplicateReport: Report containing duplicate and suspicious files with their filenames and similarity
         """
-        neighbours = self.__vector_db.get_neighbours(image_embedding=image_embedding, threshold=0.6)
+        neighbours = self.__vector_db.get_neighbours(image_embedding=image_embedding, threshold=SUSPICIOUS_DISTANCE)
+        return self._build_duplicate_report(image_embedding, neighbours)
+
+    def _build_duplicate_report(
+        self, image_embedding: ImageEmbedding | EmbeddingRecord, neighbours: list[ImageEmbeddingNeighbour]
+    ) -> DuplicateReport:
+        """Splits the neighbours of an image embedding into duplicate and suspicious files."""
         neighbours = [SuspiciousFile.from_neighbour_embedding(neighbour) for neighbour in neighbours]
 
         duplicate_files = [
-            neighbour for neighbour in neighbours if neighbour.duplicate_chance_in_percent >= self.duplicate_threshould
+            neighbour for neighbour in neighbours if classify_distance(neighbour.distance) == "duplicate"
         ]
         suspicious_files = [
-            neighbour for neighbour in neighbours if neighbour.duplicate_chance_in_percent < self.duplicate_threshould
+            neighbour for neighbour in neighbours if classify_distance(neighbour.distance) != "duplicate"
         ]
 
         duplicate_files_report = DuplicateReportPart(num_of_files=len(duplicate_files), filenames=duplicate_files)
@@ -114,30 +223,102 @@ class FEEXService:
             suspicious=suspicious_file_report,
         )
 
-    def embed_local_images(self, image_root: str, filenames: Optional[list[str]] = None) -> list[ImageEmbedding]:
+    def embed_images(
+        self,
+        images: Optional[list[BinaryIO]] = None,
+        image_root: Optional[str] = None,
+        filenames: Optional[list[str]] = None,
+    ) -> EmbeddingBatch:
+        """Embeds images from the API if provided, otherwise the images from the local storage."""
+        return run_staged(self.embed_images_stages(images=images, image_root=image_root, filenames=filenames))
+
+    def embed_images_stages(
+        self,
+        images: Optional[list[BinaryIO]] = None,
+        image_root: Optional[str] = None,
+        filenames: Optional[list[str]] = None,
+    ) -> StagedOperation[EmbeddingBatch]:
+        """Stages of `embed_images`, uploaded images wait for the batch scheduler without occupying a pool thread."""
+        if images:
+            return (yield from self._remote_image_service.embed_images_stages(images=images, filenames=filenames))
+        return (
+            yield Stage(
+                "inference", functools.partial(self.embed_local_images, image_root=image_root, filenames=filenames)
+            )
+        )
+
+    def embed_local_images(self, image_root: str, filenames: Optional[list[str]] = None) -> EmbeddingBatch:
         """Embeds images from local storage using the LocalImageService."""
         return self._local_image_service.embed_local_images(image_root=image_root, filenames=filenames)
 
-    def embed_remote_images(
-        self, images: list[BinaryIO], filenames: Optional[list[str]] = None
-    ) -> list[ImageEmbedding]:
+    def embed_remote_images(self, images: list[BinaryIO], filenames: Optional[list[str]] = None) -> EmbeddingBatch:
         """Embeds images uploaded through the API using the RemoteImageService."""
         return self._remote_image_service.embed_images(images=images, filenames=filenames)
 
-    def store_image_embeddings(self, image_embeddings: list[ImageEmbedding]) -> None:
+    def check_database_health(self) -> bool:
+        """Checks if the vector database can be reached."""
+        return self.__vector_db.health_check()
+
+    def store_image_embeddings(self, image_embeddings: EmbeddingBatch) -> None:
         """Stores the image embeddings in the database."""
         self.__vector_db.store_embeddings(image_embeddings)
         self._logger.info(f"Stored {len(image_embeddings)} image embeddings in the database.")
 
+    def index_local_images(
+        self, image_root: str, filenames: Optional[list[str]] = None, prune_deleted: bool = False
+    ) -> LocalIndexResult:
+        """Embeds the local images which are new or changed since the last run, based on the manifest of the root."""
+        return self._local_image_service.index_local_images(
+            image_root=image_root, filenames=filenames, find_deleted=prune_deleted
+        )
+
+    def store_index_result(self, index_result: LocalIndexResult) -> None:
+        """Stores the new/changed embeddings of an index run, deletes removed images and updates the manifest.
+
+        The manifest is only updated after the database, so a failed run is repeated completely on the next call.
+        """
+        self.store_image_embeddings(index_result.changed)
+        if index_result.deleted:
+            self.__vector_db.delete_embeddings(index_result.deleted)
+            self._logger.info(f"Deleted {len(index_result.deleted)} image embeddings from the database.")
+        self._local_image_service.commit_index(index_result)
+
+    def ingest_local_images(
+        self, image_root: str, checkpoint_size: int = config.INGEST_CHECKPOINT_SIZE, prune_deleted: bool = False
+    ) -> IngestStats:
+        """Embeds and stores all new or changed images of a large local image root with checkpoints.
+
+        See `IngestService` for details. In contrast to `embed_and_store_images`, the embeddings are stored every
+        `checkpoint_size` images, so an interrupted run can be resumed.
+        """
+        return IngestService(self.__vector_db, checkpoint_size=checkpoint_size).ingest(
+            image_root, prune_deleted=prune_deleted
+        )
+
+    def find_duplicate_clusters(
+        self,
+        threshold: float,
+        block_size: int = config.CLUSTER_BLOCK_SIZE,
+        num_workers: Optional[int] = config.CLUSTER_NUM_WORKERS,
+    ) -> ClusterReport:
+        """Finds all groups of duplicates among the stored embeddings, see `ClusterService` for details."""
+        return ClusterService(self.__vector_db, block_size=block_size, num_workers=num_workers).find_clusters(threshold)
+
+    def build_index(self) -> None:
+        """Builds the approximate search index of the configured database."""
+        self.__vector_db.build_index()
+
     def embed_and_store_images(
         self,
         images: Optional[list[BinaryIO]] = None,
         image_root: Optional[str] = None,
         filenames: Optional[list[str]] = None,
+        prune_deleted: bool = False,
     ) -> None:
         """Embeds images and stores the embeddings in the database without performing a duplicate check.
 
         Depending on the provided arguments, the images are either from the API or from the local storage.
+        If the manifest is enabled, only local images which are new or changed since the last run are embedded.
 
         Args:
             images (list[BinaryIO], optional): List of images as BinaryIO objects.
@@ -146,10 +327,34 @@ class FEEXService:
                 Will only be used, if no images are provided directly
             filenames (str, optional): List of filenames for the images. These can either be the filenames of the images
                 from the API or the filenames of the images in the image_root directory.
+            prune_deleted (bool, optional): If True and the manifest is enabled, the embeddings of local images which
+                were deleted from the image_root are deleted from the database as well. Defaults to False.
         """
-        if images:
-            image_embeddings = self.embed_remote_images(images=images, filenames=filenames)
-        else:
-            image_embeddings = self.embed_local_images(image_root=image_root, filenames=filenames)
+        run_staged(
+            self.embed_and_store_stages(
+                images=images, image_root=image_root, filenames=filenames, prune_deleted=prune_deleted
+            )
+        )
 
-        self.store_image_embeddings(image_embeddings)
+    def embed_and_store_stages(
+        self,
+        images: Optional[list[BinaryIO]] = None,
+        image_root: Optional[str] = None,
+        filenames: Optional[list[str]] = None,
+        prune_deleted: bool = False,
+    ) -> StagedOperation[None]:
+        """Stages of `embed_and_store_images`, which the API runs in the inference and database pools."""
+        if not images and config.LOCAL_IMAGE_MANIFEST_ENABLED:
+            # only new or changed images of the root are embedded, the manifest is updated after storing them
+            index_result = yield Stage(
+                "inference",
+                functools.partial(
+                    self.index_local_images, image_root=image_root, filenames=filenames, prune_deleted=prune_deleted
+                ),
+            )
+            yield Stage("db", functools.partial(self.store_index_result, index_result))
+            return
+        image_embeddings = yield from self.embed_images_stages(
+            images=images, image_root=image_root, filenames=filenames
+        )
+        yield Stage("db", functools.partial(self.store_image_embeddings, image_embeddings))
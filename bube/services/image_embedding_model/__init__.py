@@ -1,3 +1,5 @@
+from .image_decoding import decode_img, get_target_resolution
 from .image_embedding_model import ImageEmbeddingModel
+from .image_preprocessing import pad_imgs
 
-__all__ = ["ImageEmbeddingModel"]
+__all__ = ["ImageEmbeddingModel", "decode_img", "get_target_resolution", "pad_imgs"]
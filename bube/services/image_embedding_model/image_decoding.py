@@ -0,0 +1,44 @@
+from typing import BinaryIO, Optional
+
+import numpy as np
+from PIL import Image
+
+
+def get_target_resolution(width: int, height: int, max_side: Optional[int] = None) -> tuple[int, int]:
+    """Get the resolution an image is decoded to, if its longest side is limited to `max_side`.
+
+    Args:
+        width (int): width of the original image
+        height (int): height of the original image
+        max_side (int, optional): maximum length of the longest side. If None, the resolution is not changed.
+
+    Returns:
+        tuple[int, int]: resolution (width, height) of the decoded image
+    """
+    if not max_side or max(width, height) <= max_side:
+        return width, height
+    scale = max_side / max(width, height)
+    return max(round(width * scale), 1), max(round(height * scale), 1)
+
+
+def decode_img(image: str | BinaryIO, max_side: Optional[int] = None) -> np.ndarray:
+    """Decode an image to a uint8 RGB numpy array, optionally downscaled to a maximum side length.
+
+    For JPEG images, the decoder is asked to downscale in the DCT domain first (by a power of two, never below the
+    target resolution), so large photos aren't decoded in full resolution. The remaining scaling is done by a resize.
+
+    Args:
+        image (str | BinaryIO): path or file object of the image
+        max_side (int, optional): maximum length of the longest side. If None, the image is decoded in full resolution.
+
+    Returns:
+        np.ndarray: decoded image in shape (Height, Width, Channel=3)
+    """
+    with Image.open(image) as img:
+        target_resolution = get_target_resolution(*img.size, max_side=max_side)
+        if target_resolution != img.size:
+            img.draft("RGB", target_resolution)
+        rgb_img = img.convert("RGB")
+    if rgb_img.size != target_resolution:
+        rgb_img = rgb_img.resize(target_resolution, Image.Resampling.BICUBIC, reducing_gap=2.0)
+    return np.array(rgb_img, dtype=np.uint8)
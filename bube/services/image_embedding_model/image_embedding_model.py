@@ -1,5 +1,8 @@
+import hashlib
 import importlib.resources as impresources
 import logging
+import os
+from pathlib import Path
 from typing import Optional
 
 import numpy as np
@@ -8,6 +11,71 @@ import onnxruntime as ort
 from ...config import config
 from .image_preprocessing import preprocess_imgs
 
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+# the highest level whose optimized graph doesn't depend on the CPU, the layout optimizations of the level `all` (e.g.
+# NCHWc kernels for the instruction set of the CPU) are applied again when a saved optimized model is loaded
+PORTABLE_OPTIMIZATION_LEVEL = "extended"
+EXECUTION_MODES = {"sequential": ort.ExecutionMode.ORT_SEQUENTIAL, "parallel": ort.ExecutionMode.ORT_PARALLEL}
+# key of the metadata entry of the uint8 variant, which links it to the model it was exported from
+SOURCE_FINGERPRINT_KEY = "bube.source_model_fingerprint"
+
+
+def get_model_fingerprint(model_path: str) -> str:
+    """Hash of the model file, which identifies the model version the embeddings were computed with."""
+    model_hash = hashlib.blake2b(digest_size=16)
+    with Path(model_path).open("rb") as f:
+        while chunk := f.read(1 << 20):
+            model_hash.update(chunk)
+    return model_hash.hexdigest()
+
+
+def get_precision_model_path(model_path: str, precision: str) -> str:
+    """Path of the variant with the given precision (see `MODEL_PRECISION`), for float32 it is the model itself."""
+    if precision == "float32":
+        return model_path
+    return str(Path(model_path).with_suffix(f".{precision}.onnx"))
+
+
+def get_uint8_model_path(model_path: str) -> str:
+    """Path of the variant with uint8 input and built-in preprocessing, which is exported next to the model."""
+    return str(Path(model_path).with_suffix(".uint8.onnx"))
+
+
+def create_session_options(**overrides: str | int | bool | None) -> ort.SessionOptions:
+    """Create the options of an ONNX Runtime session from the `ORT_*` settings of the config.
+
+    Args:
+        overrides: settings which replace the config, named like the config without the prefix, e.g.
+            `intra_op_num_threads=4`. A number of threads of None keeps the default of ONNX Runtime, which is one
+            thread per CPU core.
+
+    Returns:
+        ort.SessionOptions: options of the session
+    """
+    settings = {
+        "intra_op_num_threads": config.ORT_INTRA_OP_NUM_THREADS,
+        "inter_op_num_threads": config.ORT_INTER_OP_NUM_THREADS,
+        "execution_mode": config.ORT_EXECUTION_MODE,
+        "graph_optimization_level": config.ORT_GRAPH_OPTIMIZATION_LEVEL,
+        "enable_cpu_mem_arena": config.ORT_ENABLE_CPU_MEM_ARENA,
+        "enable_mem_pattern": config.ORT_ENABLE_MEM_PATTERN,
+    } | overrides
+    session_options = ort.SessionOptions()
+    if settings["intra_op_num_threads"] is not None:
+        session_options.intra_op_num_threads = settings["intra_op_num_threads"]
+    if settings["inter_op_num_threads"] is not None:
+        session_options.inter_op_num_threads = settings["inter_op_num_threads"]
+    session_options.execution_mode = EXECUTION_MODES[settings["execution_mode"]]
+    session_options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[settings["graph_optimization_level"]]
+    session_options.enable_cpu_mem_arena = settings["enable_cpu_mem_arena"]
+    session_options.enable_mem_pattern = settings["enable_mem_pattern"]
+    return session_options
+
 
 class ImageEmbeddingModel:
     """Class to compute image embeddings using the provided image embedding model."""
@@ -15,6 +83,10 @@ class ImageEmbeddingModel:
     _instance = None
     _is_initialized = False
 
+    model_fingerprint: str
+    # True if the variant with uint8 input is used, which does the preprocessing inside the graph
+    uint8_input: bool
+
     _model: any
     _inference_dtype: np.dtype
     _execution_provider_list: list[str]
@@ -34,7 +106,8 @@ class ImageEmbeddingModel:
         """Init the model.
 
         Args:
-            model_path (str, optional): Path to the model (if it should be exchanged)
+            model_path (str, optional): Path to the model (if it should be exchanged). If `MODEL_PRECISION` is set,
+                the variant with this precision next to the model is loaded.
             inference_dtype (np.dtype, optional): Data type for inference. Defaults to np.float32.
             execution_provider_list (list[str], optional): List of execution providers if e.g.GPU should be used.
                 Defaults to ['CPUExecutionProvider'] for CPU usage.
@@ -45,14 +118,30 @@ class ImageEmbeddingModel:
         self._logger = logging.getLogger(__name__)
         self._inference_dtype = inference_dtype
         self._execution_provider_list = self._get_execution_providers()
-        if not model_path:
-            model_path = str(impresources.files("bube.services.image_embedding_model") / "resnet_mac_model.onnx")
-        self._model = ort.InferenceSession(model_path, providers=self._execution_provider_list)
+        model_path = get_precision_model_path(model_path or self.default_model_path(), config.MODEL_PRECISION)
+        if not Path(model_path).is_file():
+            error_msg = (
+                f"Model {model_path} not found. The variants for MODEL_PRECISION={config.MODEL_PRECISION} are created "
+                f"with `python -m bube quantize-model --precision {config.MODEL_PRECISION}`."
+            )
+            raise FileNotFoundError(error_msg)
+        # the uint8 variant computes the same embeddings, so the fingerprint is always the one of the base model
+        # (or of the variant with reduced precision, whose embeddings differ slightly)
+        self.model_fingerprint = get_model_fingerprint(model_path)
+        self._model = self._load_uint8_variant(model_path) if config.MODEL_UINT8_INPUT else None
+        self.uint8_input = self._model is not None
+        if not self.uint8_input:
+            self._model = self._create_session(model_path)
         self.__input_name = self._model.get_inputs()[0].name
         self.__output_name = self._model.get_outputs()[0].name
         self._is_initialized = True
 
-        self._logger.info(f"Model loaded from: {model_path} successfully.")
+        self._logger.info(f"Model loaded from: {model_path} successfully (uint8 input: {self.uint8_input}).")
+
+    @staticmethod
+    def default_model_path() -> str:
+        """Path of the model which is bundled with the package."""
+        return str(impresources.files("bube.services.image_embedding_model") / "resnet_mac_model.onnx")
 
     def compute_embedding_single(self, input_img: np.ndarray) -> np.ndarray:
         """Compute embeddings for a single image.
@@ -73,15 +162,91 @@ class ImageEmbeddingModel:
 
         Args:
             input_img_batch (np.ndarray): Batch of images to compute embeddings for. Shape should be:
-            (Batch, Height, Width, Channel=3)
+            (Batch, Height, Width, Channel=3). uint8 images are passed to the uint8 variant without a copy.
 
         Returns:
             np.ndarray: Embeddings for the input images in shape (Batch, Embedding_dim=2048)
         """
-        input_img_batch = preprocess_imgs(input_img_batch)
-        return self._model.run(
-            [self.__output_name], {self.__input_name: input_img_batch.astype(self._inference_dtype)}
-        )[0]
+        if self.uint8_input:
+            if input_img_batch.dtype != np.uint8:
+                # decoded pixel values are integers, other float images are rounded like by the decoder
+                input_img_batch = np.clip(np.rint(input_img_batch), 0, 255).astype(np.uint8)
+        else:
+            input_img_batch = preprocess_imgs(input_img_batch).astype(self._inference_dtype, copy=False)
+        return self._model.run([self.__output_name], {self.__input_name: input_img_batch})[0]
+
+    def _load_uint8_variant(self, model_path: str) -> Optional[ort.InferenceSession]:
+        """Load the uint8 variant of the model, if it was exported from this model with `python -m bube export-model`.
+
+        Returns:
+            ort.InferenceSession: session of the variant, None if there is no variant or it is outdated
+        """
+        uint8_model_path = get_uint8_model_path(model_path)
+        if not Path(uint8_model_path).is_file():
+            return None
+        session = self._create_session(uint8_model_path)
+        source_fingerprint = session.get_modelmeta().custom_metadata_map.get(SOURCE_FINGERPRINT_KEY)
+        if source_fingerprint != self.model_fingerprint:
+            self._logger.warning(
+                f"Ignoring {uint8_model_path}, it was not exported from the current model. "
+                "Run `python -m bube export-model` to export it again."
+            )
+            return None
+        return session
+
+    def _create_session(self, model_path: str) -> ort.InferenceSession:
+        """Create the inference session of a model with the session options of the config.
+
+        If `ORT_OPTIMIZED_MODEL_DIR` is set, the graph optimized by ONNX Runtime is saved there on the first start.
+        Later starts load the optimized graph, which saves the optimization time. The graph is saved with at most the
+        level `extended`, whose optimizations don't depend on the CPU, so the directory can be shared between hosts.
+        With the level `all`, only the CPU-specific layout optimizations are applied when the graph is loaded.
+        """
+        session_options = create_session_options()
+        if not config.ORT_OPTIMIZED_MODEL_DIR or config.ORT_GRAPH_OPTIMIZATION_LEVEL == "disable":
+            return ort.InferenceSession(model_path, session_options, providers=self._execution_provider_list)
+
+        levels = list(GRAPH_OPTIMIZATION_LEVELS)
+        saved_level = min(config.ORT_GRAPH_OPTIMIZATION_LEVEL, PORTABLE_OPTIMIZATION_LEVEL, key=levels.index)
+        optimized_model_path = self._get_optimized_model_path(model_path, saved_level)
+        if not Path(optimized_model_path).is_file():
+            self._save_optimized_model(model_path, optimized_model_path, saved_level)
+
+        self._logger.info(f"Loading the optimized model from {optimized_model_path}.")
+        if saved_level == config.ORT_GRAPH_OPTIMIZATION_LEVEL:
+            session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        return ort.InferenceSession(optimized_model_path, session_options, providers=self._execution_provider_list)
+
+    def _save_optimized_model(self, model_path: str, optimized_model_path: str, level: str) -> None:
+        """Optimize the graph of a model with the given level and save it."""
+        Path(config.ORT_OPTIMIZED_MODEL_DIR).mkdir(parents=True, exist_ok=True)
+        # the model is saved to a temporary file first, so an interrupted start never leaves a broken model behind
+        temporary_path = f"{optimized_model_path}.{os.getpid()}.tmp"
+        session_options = create_session_options(graph_optimization_level=level)
+        session_options.optimized_model_filepath = temporary_path
+        ort.InferenceSession(model_path, session_options, providers=self._execution_provider_list)
+        Path(temporary_path).replace(optimized_model_path)
+        self._logger.info(f"Saved the optimized model to {optimized_model_path}.")
+
+    def _get_optimized_model_path(self, model_path: str, level: str) -> str:
+        """Path of the optimized model in `ORT_OPTIMIZED_MODEL_DIR`.
+
+        The name contains a hash of everything the optimized graph depends on. The fingerprint of the model is reused,
+        the uint8 variant (which is exported from the fingerprinted model) is identified by its size and modification
+        time in addition, so the model file isn't hashed again.
+        """
+        stat = Path(model_path).stat()
+        key = "|".join(
+            [
+                self.model_fingerprint,
+                f"{Path(model_path).name}:{stat.st_size}:{stat.st_mtime_ns}",
+                ort.__version__,
+                level,
+                ",".join(self._execution_provider_list),
+            ]
+        )
+        key_hash = hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+        return str(Path(config.ORT_OPTIMIZED_MODEL_DIR) / f"{Path(model_path).stem}.{key_hash}.onnx")
 
     def _get_execution_providers(self) -> list[str]:
         """Get the list of execution providers based on availability and user preference."""
@@ -1,5 +1,8 @@
 import numpy as np
 
+# mean pixel according to imagenet data (which was used to train the base model) in BGR order
+IMAGENET_MEAN_BGR = (103.939, 116.779, 123.68)
+
 
 def preprocess_imgs(input_imgs: np.ndarray) -> np.ndarray:
     """Preprocess images for the model.
@@ -9,17 +12,17 @@ def preprocess_imgs(input_imgs: np.ndarray) -> np.ndarray:
     This means that the images need to be normalized to have zero mean and unit variance.
 
     Args:
-        input_imgs (np.ndarray): Batch of images to preprocess
+        input_imgs (np.ndarray): Batch of RGB images to preprocess, e.g. uint8 images of the decoder
 
     Returns:
-        np.ndarray: Preprocessed images
+        np.ndarray: Preprocessed float32 images, the input is not changed
     """
-    # 'RGB'->'BGR'
+    # 'RGB'->'BGR', the float32 copy is zero-centered in place
     # Shape (Batch, Height, Width, Channel) remeins the same
-    input_imgs = input_imgs[..., ::-1]
+    input_imgs = input_imgs[..., ::-1].astype(np.float32)
 
     # mean and std according to imagenet data (which was used to train the base model)
-    mean = [103.939, 116.779, 123.68]
+    mean = IMAGENET_MEAN_BGR
     std = None
 
     # Zero-center by mean pixel
@@ -32,3 +35,27 @@ def preprocess_imgs(input_imgs: np.ndarray) -> np.ndarray:
         input_imgs[..., 2] /= std[2]
 
     return input_imgs
+
+
+def pad_imgs(input_imgs: np.ndarray, height: int, width: int) -> np.ndarray:
+    """Pad images at the bottom and right to the given resolution.
+
+    The images are padded with the ImageNet mean pixel, which is zero after preprocessing. This is the same value the
+    convolutions of the model use to pad the image borders, so the padding changes the embedding only marginally.
+    Integer images are padded with the rounded mean pixel.
+    The deviation is verified for the test assets in `tests/test_shape_buckets.py`.
+
+    Args:
+        input_imgs (np.ndarray): Batch of RGB images in shape (Batch, Height, Width, Channel=3)
+        height (int): Height of the padded images, has to be at least the height of the input images
+        width (int): Width of the padded images, has to be at least the width of the input images
+
+    Returns:
+        np.ndarray: Padded images in shape (Batch, height, width, Channel=3)
+    """
+    batch_size, img_height, img_width, channels = input_imgs.shape
+    padded_imgs = np.empty((batch_size, height, width, channels), dtype=input_imgs.dtype)
+    mean_rgb = np.asarray(IMAGENET_MEAN_BGR[::-1])
+    padded_imgs[...] = np.rint(mean_rgb) if np.issubdtype(input_imgs.dtype, np.integer) else mean_rgb
+    padded_imgs[:, :img_height, :img_width] = input_imgs
+    return padded_imgs
@@ -0,0 +1,79 @@
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+
+from .image_embedding_model import SOURCE_FINGERPRINT_KEY, get_model_fingerprint, get_uint8_model_path
+from .image_preprocessing import IMAGENET_MEAN_BGR
+
+UINT8_INPUT_NAME = "image_uint8"
+
+
+def export_uint8_model(model_path: str, output_path: Optional[str] = None) -> str:
+    """Export a variant of the model, which takes uint8 RGB images and does the preprocessing inside the graph.
+
+    Nodes for the cast to float, the reorder from RGB to BGR and the subtraction of the ImageNet mean are prepended to
+    the graph and replace `preprocess_imgs`. The decoded images are passed to the model as they are, so no float copy
+    of the batch is made in Python. The fingerprint of the source model is stored in the metadata of the variant, so
+    a stale variant is never used after the model was exchanged.
+    onnx is only needed for the export, it is not a dependency of the service.
+
+    Args:
+        model_path (str): path to the model with float NHWC input
+        output_path (str, optional): path of the variant. Defaults to the path `ImageEmbeddingModel` looks for.
+
+    Returns:
+        str: path of the exported variant
+    """
+    output_path = output_path or get_uint8_model_path(model_path)
+    model = onnx.load(model_path)
+    graph = model.graph
+    initializer_names = {initializer.name for initializer in graph.initializer}
+    float_input = next(graph_input for graph_input in graph.input if graph_input.name not in initializer_names)
+    input_shape = [dim.dim_param or dim.dim_value or None for dim in float_input.type.tensor_type.shape.dim]
+    if len(input_shape) != 4 or input_shape[3] != 3:
+        error_msg = f"Expected an NHWC input with 3 channels, got shape {input_shape} for input {float_input.name}."
+        raise ValueError(error_msg)
+
+    float_type = float_input.type.tensor_type.elem_type
+    mean_bgr = np.asarray(IMAGENET_MEAN_BGR, dtype=helper.tensor_dtype_to_np_dtype(float_type)).reshape(3, 1, 1)
+    graph.initializer.extend(
+        [
+            numpy_helper.from_array(np.asarray([2, 1, 0], dtype=np.int64), "preprocess/bgr_indices"),
+            numpy_helper.from_array(mean_bgr, "preprocess/mean_bgr"),
+        ]
+    )
+    # the channels are reordered and zero-centered in NCHW layout, where each channel is a contiguous plane. This is
+    # several times faster than on the interleaved NHWC pixels. ORT merges the transpose back to NHWC with the
+    # transpose of the model to NCHW.
+    preprocess_nodes = [
+        helper.make_node("Transpose", [UINT8_INPUT_NAME], ["preprocess/nchw"], perm=[0, 3, 1, 2]),
+        helper.make_node("Cast", ["preprocess/nchw"], ["preprocess/float"], to=float_type),
+        # 'RGB'->'BGR'
+        helper.make_node("Gather", ["preprocess/float", "preprocess/bgr_indices"], ["preprocess/bgr"], axis=1),
+        # zero-center by mean pixel
+        helper.make_node("Sub", ["preprocess/bgr", "preprocess/mean_bgr"], ["preprocess/centered"]),
+        # the result is the NHWC input of the original graph
+        helper.make_node("Transpose", ["preprocess/centered"], [float_input.name], perm=[0, 2, 3, 1]),
+    ]
+    for node in reversed(preprocess_nodes):
+        graph.node.insert(0, node)
+
+    uint8_input = helper.make_tensor_value_info(UINT8_INPUT_NAME, TensorProto.UINT8, input_shape)
+    input_index = list(graph.input).index(float_input)
+    graph.input.remove(float_input)
+    graph.input.insert(input_index, uint8_input)
+
+    helper.set_model_props(
+        model,
+        {
+            **{prop.key: prop.value for prop in model.metadata_props},
+            SOURCE_FINGERPRINT_KEY: get_model_fingerprint(model_path),
+        },
+    )
+    onnx.checker.check_model(model)
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    onnx.save(model, output_path)
+    return output_path
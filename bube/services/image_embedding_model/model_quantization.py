@@ -0,0 +1,187 @@
+import itertools
+import time
+from collections.abc import Callable, Sequence
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+import onnx
+import onnxruntime as ort
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+from onnxruntime.transformers.float16 import convert_float_to_float16
+
+from ...config import config
+from ...models import classify_distance
+from ...repository import VectorDBRepository
+from .image_decoding import decode_img
+from .image_embedding_model import get_precision_model_path
+from .image_preprocessing import preprocess_imgs
+
+# precisions of the variants, which can be selected with `MODEL_PRECISION`
+PRECISIONS = ("fp16", "int8", "int8-dynamic")
+DEFAULT_MAX_DISTANCE_DEVIATION = 0.05
+# pairs close to a threshold change their decision with any deviation, so a small share of changes is accepted
+DEFAULT_MIN_DECISION_AGREEMENT = 0.99
+
+
+class _CalibrationImages(CalibrationDataReader):
+    """Preprocessed calibration images, one image per batch as they are decoded in different resolutions."""
+
+    def __init__(self, input_name: str, image_paths: Sequence[str], max_side: Optional[int]):
+        self._inputs = (
+            {input_name: preprocess_imgs(decode_img(path, max_side=max_side)[np.newaxis])} for path in image_paths
+        )
+
+    def get_next(self) -> Optional[dict[str, np.ndarray]]:
+        """Next input of the model, None if all images were passed."""
+        return next(self._inputs, None)
+
+
+def quantize_model(
+    model_path: str,
+    precision: str,
+    calibration_images: Sequence[str] = (),
+    output_path: Optional[str] = None,
+    max_side: Optional[int] = config.MAX_INPUT_SIDE,
+) -> str:
+    """Create a variant of the float32 model with reduced precision.
+
+    - `fp16`: weights and activations in float16, the input and output stay float32
+    - `int8`: static quantization (QDQ format), the ranges of the activations are calibrated on the given images
+    - `int8-dynamic`: int8 weights, the ranges of the activations are computed for each input at runtime
+
+    onnx is only needed for the quantization, it is not a dependency of the service.
+
+    Args:
+        model_path (str): path to the float32 model
+        precision (str): one of `PRECISIONS`
+        calibration_images (Sequence[str], optional): paths of representative images, required for `int8`
+        output_path (str, optional): path of the variant. Defaults to the path `ImageEmbeddingModel` looks for.
+        max_side (int, optional): maximum side the calibration images are decoded with, like `MAX_INPUT_SIDE`
+
+    Returns:
+        str: path of the variant
+    """
+    output_path = output_path or get_precision_model_path(model_path, precision)
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    if precision == "fp16":
+        model = convert_float_to_float16(onnx.load(model_path), keep_io_types=True)
+        onnx.save(model, output_path)
+    elif precision == "int8":
+        if not calibration_images:
+            error_msg = "Static int8 quantization requires calibration images."
+            raise ValueError(error_msg)
+        input_name = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+        quantize_static(
+            model_path,
+            output_path,
+            _CalibrationImages(input_name, calibration_images, max_side),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+        )
+    elif precision == "int8-dynamic":
+        quantize_dynamic(model_path, output_path, weight_type=QuantType.QUInt8)
+    else:
+        error_msg = f"Unknown precision {precision}, expected one of {', '.join(PRECISIONS)}."
+        raise ValueError(error_msg)
+    return output_path
+
+
+class AccuracyReport(NamedTuple):
+    """Deviation of the distances and decisions of a variant from the float32 model on a set of images."""
+
+    num_images: int
+    num_pairs: int
+    mean_distance_deviation: float
+    max_distance_deviation: float
+    # pairs (filename, filename, reference decision, decision of the variant) with a changed decision
+    changed_decisions: list[tuple[str, str, str, str]]
+    reference_seconds_per_image: float
+    seconds_per_image: float
+
+    @property
+    def decision_agreement(self) -> float:
+        """Share of the pairs whose decision of the duplicate check is the same as with the reference."""
+        return 1 - len(self.changed_decisions) / max(self.num_pairs, 1)
+
+    def passed(
+        self,
+        max_distance_deviation: float = DEFAULT_MAX_DISTANCE_DEVIATION,
+        min_decision_agreement: float = DEFAULT_MIN_DECISION_AGREEMENT,
+    ) -> bool:
+        """Accuracy gate: the distances deviate at most by the limit and almost all decisions are unchanged."""
+        return (
+            self.max_distance_deviation <= max_distance_deviation and self.decision_agreement >= min_decision_agreement
+        )
+
+    def summary(self) -> str:
+        """Deviation and CPU throughput as a human-readable text."""
+        return (
+            f"{self.num_images} images, {self.num_pairs} pairs, {100 * self.decision_agreement:.1f}% unchanged "
+            "decisions\n"
+            f"distance deviation: mean {self.mean_distance_deviation:.4f}, max {self.max_distance_deviation:.4f}\n"
+            f"float32: {1 / self.reference_seconds_per_image:.2f} images/s, "
+            f"variant: {1 / self.seconds_per_image:.2f} images/s "
+            f"(speedup {self.reference_seconds_per_image / self.seconds_per_image:.2f})"
+            + "".join(
+                f"\n    {a} - {b}: {reference} -> {decision}" for a, b, reference, decision in self.changed_decisions
+            )
+        )
+
+
+def _embed_images(model_path: str, images: Sequence[np.ndarray]) -> tuple[np.ndarray, float]:
+    """Embed the images one by one on the CPU, returns the embeddings and the mean seconds per image."""
+    session = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+    # the first run allocates the memory of the session, which is not counted
+    session.run(None, {input_name: preprocess_imgs(images[0][np.newaxis])})
+    start = time.perf_counter()
+    embeddings = [session.run(None, {input_name: preprocess_imgs(img[np.newaxis])})[0][0] for img in images]
+    return np.stack(embeddings), (time.perf_counter() - start) / len(images)
+
+
+def evaluate_accuracy(
+    reference_model_path: str,
+    model_path: str,
+    image_paths: Sequence[str],
+    max_side: Optional[int] = config.MAX_INPUT_SIDE,
+    pairwise_distances: Callable[[np.ndarray], np.ndarray] = VectorDBRepository.pairwise_distances,
+) -> AccuracyReport:
+    """Compare the distances and duplicate check decisions of all pairs of images between a variant and the reference.
+
+    Args:
+        reference_model_path (str): path to the float32 model
+        model_path (str): path to the variant
+        image_paths (Sequence[str]): paths of the evaluation images
+        max_side (int, optional): maximum side the images are decoded with, like `MAX_INPUT_SIDE`
+        pairwise_distances (Callable, optional): distance metric of the vector database, in which the duplicate check
+            compares the distances with its thresholds. Defaults to squared L2 (Chroma, NumPy and IVF-PQ).
+
+    Returns:
+        AccuracyReport: deviation and CPU throughput of the variant
+    """
+    images = [decode_img(path, max_side=max_side) for path in image_paths]
+    reference_embeddings, reference_seconds = _embed_images(reference_model_path, images)
+    embeddings, seconds = _embed_images(model_path, images)
+
+    pairs = list(itertools.combinations(range(len(images)), 2))
+    first, second = (np.asarray(indices, dtype=np.intp) for indices in zip(*pairs)) if pairs else ([], [])
+    reference_distances = pairwise_distances(reference_embeddings)[first, second]
+    distances = pairwise_distances(embeddings)[first, second]
+    deviations = np.abs(distances - reference_distances)
+    changed_decisions = [
+        (Path(image_paths[a]).name, Path(image_paths[b]).name, classify_distance(ref), classify_distance(dist))
+        for a, b, ref, dist in zip(first, second, reference_distances, distances)
+        if classify_distance(ref) != classify_distance(dist)
+    ]
+    return AccuracyReport(
+        num_images=len(images),
+        num_pairs=len(pairs),
+        mean_distance_deviation=float(deviations.mean()) if pairs else 0.0,
+        max_distance_deviation=float(deviations.max()) if pairs else 0.0,
+        changed_decisions=changed_decisions,
+        reference_seconds_per_image=reference_seconds,
+        seconds_per_image=seconds,
+    )
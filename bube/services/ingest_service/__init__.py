@@ -0,0 +1,3 @@
+from .ingest_service import IngestService, IngestStats
+
+__all__ = ["IngestService", "IngestStats"]
@@ -0,0 +1,177 @@
+import itertools
+import logging
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from ...config import config
+from ...models import EmbeddingBatch
+from ...repository import VectorDBRepository
+from ..image_embedding_model import ImageEmbeddingModel
+from ..local_image_service import ImageManifest, LocalImgReader, StreamingImgReader
+from ..local_image_service.image_manifest import ManifestEntry
+
+# number of discovered files which are compared with the manifest at once
+DIFF_CHUNK_SIZE = 1000
+
+
+@dataclass
+class IngestStats:
+    """Number of images and busy time of each stage of an ingest run."""
+
+    discovered: int = 0
+    skipped: int = 0
+    embedded: int = 0
+    stored: int = 0
+    deleted: int = 0
+    # scanning the image root and comparing the files with the manifest
+    discover_seconds: float = 0.0
+    # waiting for decoded batches, which is only > 0 if decoding is slower than inference
+    decode_wait_seconds: float = 0.0
+    inference_seconds: float = 0.0
+    store_seconds: float = 0.0
+    total_seconds: float = 0.0
+
+    def summary(self) -> str:
+        """Throughput of each stage as a human-readable text."""
+
+        def rate(count: int, seconds: float) -> float:
+            return count / seconds if seconds > 0 else 0.0
+
+        discover_rate = rate(self.discovered, self.discover_seconds)
+        inference_rate = rate(self.embedded, self.inference_seconds)
+        store_rate = rate(self.stored, self.store_seconds)
+        total_rate = rate(self.stored, self.total_seconds)
+        return (
+            f"discover:  {self.discovered} files ({self.skipped} unchanged) in {self.discover_seconds:.1f}s, "
+            f"{discover_rate:.0f} files/s\n"
+            f"decode:    waited {self.decode_wait_seconds:.1f}s for decoded batches\n"
+            f"inference: {self.embedded} images in {self.inference_seconds:.1f}s, {inference_rate:.1f} images/s\n"
+            f"store:     {self.stored} images in {self.store_seconds:.1f}s, {store_rate:.0f} images/s "
+            f"({self.deleted} deleted)\n"
+            f"total:     {self.stored} images in {self.total_seconds:.1f}s, {total_rate:.1f} images/s"
+        )
+
+
+class IngestService:
+    """Service class for the bulk ingestion of a local image root into the vector database.
+
+    The files of the root are streamed through the `StreamingImgReader` and the model while the root is still scanned.
+    The embeddings are stored with one upsert every `checkpoint_size` images, afterwards the manifest of the root is
+    updated. The manifest is the checkpoint: after a crash, a new run skips all images which were stored before, so at
+    most one checkpoint is embedded again. Only the state of the files is written to the manifest, the embeddings are
+    only kept in the database.
+    """
+
+    _vector_db: VectorDBRepository
+    _embedding_model: ImageEmbeddingModel
+    _checkpoint_size: int
+    _logger: logging.Logger
+
+    def __init__(self, vector_db: VectorDBRepository, checkpoint_size: int = config.INGEST_CHECKPOINT_SIZE):
+        """Create the service.
+
+        Args:
+            vector_db (VectorDBRepository): database in which the embeddings are stored
+            checkpoint_size (int, optional): number of images which are stored with one upsert
+        """
+        self._vector_db = vector_db
+        self._embedding_model = ImageEmbeddingModel()
+        self._checkpoint_size = checkpoint_size
+        self._logger = logging.getLogger(__name__)
+
+    def ingest(self, image_root: str, prune_deleted: bool = False) -> IngestStats:
+        """Embed and store all images of a root which are new or changed since the last run.
+
+        Args:
+            image_root (str): root directory of the images
+            prune_deleted (bool, optional): if True, the embeddings of images which were ingested before but don't
+                exist anymore are deleted from the database
+
+        Returns:
+            IngestStats: number of images and busy time of each stage
+        """
+        start = time.perf_counter()
+        stats = IngestStats()
+        manifest = ImageManifest(
+            image_root, manifest_dir=config.LOCAL_IMAGE_MANIFEST_PATH, use_hash=config.LOCAL_IMAGE_MANIFEST_HASH
+        )
+        pending_entries: dict[str, ManifestEntry] = {}
+        seen_paths = set() if prune_deleted else None
+        changed_paths = self._iter_changed_paths(image_root, manifest, pending_entries, seen_paths, stats)
+
+        embeddings: list[tuple[str, np.ndarray]] = []
+        batches = iter(StreamingImgReader(changed_paths))
+        while True:
+            # the reader discovers the files while it is waited for, which is counted as discovery time
+            wait_start = time.perf_counter()
+            batch = next(batches, None)
+            stats.decode_wait_seconds += time.perf_counter() - wait_start
+            if batch is None:
+                break
+            images, paths = batch
+            inference_start = time.perf_counter()
+            embeddings.extend(zip(paths, self._embedding_model.compute_embedding_batch(images)))
+            stats.inference_seconds += time.perf_counter() - inference_start
+            stats.embedded += len(paths)
+            if len(embeddings) >= self._checkpoint_size:
+                self._store_checkpoint(manifest, embeddings, pending_entries, stats)
+                embeddings = []
+        stats.decode_wait_seconds -= stats.discover_seconds
+        if embeddings:
+            self._store_checkpoint(manifest, embeddings, pending_entries, stats)
+
+        if seen_paths is not None:
+            deleted = sorted(set(manifest.get_paths()) - seen_paths)
+            if deleted:
+                self._vector_db.delete_embeddings(deleted)
+                manifest.remove(deleted)
+            stats.deleted = len(deleted)
+        stats.total_seconds = time.perf_counter() - start
+        return stats
+
+    def _iter_changed_paths(
+        self,
+        image_root: str,
+        manifest: ImageManifest,
+        pending_entries: dict[str, ManifestEntry],
+        seen_paths: Optional[set[str]],
+        stats: IngestStats,
+    ) -> Iterator[str]:
+        """Yield the paths of the new or changed images and remember their manifest entries."""
+        image_paths = LocalImgReader.iter_image_files(image_root)
+        while True:
+            discover_start = time.perf_counter()
+            chunk = list(itertools.islice(image_paths, DIFF_CHUNK_SIZE))
+            if not chunk:
+                stats.discover_seconds += time.perf_counter() - discover_start
+                return
+            diff = manifest.diff(chunk, load_embeddings=False)
+            pending_entries.update((entry.path, entry) for entry in diff.changed)
+            if seen_paths is not None:
+                seen_paths.update(chunk)
+            stats.discovered += len(chunk)
+            stats.skipped += len(diff.unchanged)
+            stats.discover_seconds += time.perf_counter() - discover_start
+            yield from (entry.path for entry in diff.changed)
+
+    def _store_checkpoint(
+        self,
+        manifest: ImageManifest,
+        embeddings: list[tuple[str, np.ndarray]],
+        pending_entries: dict[str, ManifestEntry],
+        stats: IngestStats,
+    ) -> None:
+        """Store the embeddings with one upsert, then mark the images as finished in the manifest."""
+        store_start = time.perf_counter()
+        self._vector_db.store_embeddings(EmbeddingBatch.from_pairs(embeddings))
+        manifest.update([pending_entries.pop(path) for path, _ in embeddings])
+        stats.stored += len(embeddings)
+        stats.store_seconds += time.perf_counter() - store_start
+        self._logger.info(
+            f"Checkpoint: {stats.stored} images stored, {stats.skipped} unchanged images skipped, "
+            f"{stats.stored / (stats.inference_seconds + stats.store_seconds):.1f} images/s."
+        )
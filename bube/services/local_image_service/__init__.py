@@ -1,3 +1,5 @@
-from .local_image_service import LocalImageService, LocalImgReader
+from .image_manifest import ImageManifest
+from .local_image_service import LocalImageService, LocalImgReader, LocalIndexResult
+from .streaming_img_reader import StreamingImgReader
 
-__all__ = ["LocalImageService", "LocalImgReader"]
+__all__ = ["ImageManifest", "LocalImageService", "LocalImgReader", "LocalIndexResult", "StreamingImgReader"]
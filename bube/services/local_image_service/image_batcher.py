@@ -0,0 +1,108 @@
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+import PIL
+from PIL import Image
+from pillow_heif import register_heif_opener
+
+from ...config import config
+from ..image_embedding_model import decode_img, get_target_resolution, pad_imgs
+
+
+class ImageBatcher:
+    """Probing and decoding of local images into batches of the same (bucketed) resolution.
+
+    The batching settings are shared by the LocalImgReader, which groups a known list of images, and the
+    StreamingImgReader, which groups the images while they are discovered.
+    """
+
+    _max_batch_size: int
+    _max_batch_pixels: Optional[int]
+    _shape_bucket_size: Optional[int]
+    _max_side: Optional[int]
+
+    _logger: logging.Logger
+
+    def __init__(
+        self,
+        max_batch_size: int = config.LOCAL_IMAGE_BATCH_SIZE,
+        max_batch_pixels: Optional[int] = config.LOCAL_IMAGE_BATCH_PIXEL_BUDGET,
+        shape_bucket_size: Optional[int] = config.LOCAL_IMAGE_SHAPE_BUCKET_SIZE,
+        max_side: Optional[int] = config.MAX_INPUT_SIDE,
+    ):
+        """Create a batcher with the given settings.
+
+        Args:
+            max_batch_size (int, optional): maximum number of images in a batch
+            max_batch_pixels (int, optional): pixel budget of a batch. If set, the number of images per batch is
+                derived from the resolution, so a batch of large photos uses about as much memory as a batch of
+                thumbnails.
+            shape_bucket_size (int, optional): if set, resolutions are rounded up to multiples of this size and the
+                images are padded, so that images with slightly different resolutions share a batch
+            max_side (int, optional): maximum side of the decoded images
+        """
+        register_heif_opener()  # support for HEIF images
+        self._logger = logging.getLogger(__name__)
+        self._max_batch_size = max_batch_size
+        self._max_batch_pixels = max_batch_pixels
+        self._shape_bucket_size = shape_bucket_size
+        self._max_side = max_side
+
+    def probe_resolution(self, filename: str) -> Optional[tuple[int, int]]:
+        """Get the (bucketed) resolution of an image after decoding, or None if the image can't be read."""
+        # Read resolution without loading the whole image into memory
+        try:
+            with Image.open(filename) as img:
+                width, height = img.size
+        except (PIL.UnidentifiedImageError, OSError):
+            self._logger.info(f"Could not read image resolution for file: {filename}. Skipping File.")
+            return None
+
+        # Group images files by the resolution after decoding
+        width, height = get_target_resolution(width, height, max_side=self._max_side)
+        return self._get_bucket_resolution(width, height)
+
+    def _get_bucket_resolution(self, width: int, height: int) -> tuple[int, int]:
+        """Round a resolution up to the next multiple of the shape bucket size (if shape buckets are enabled)."""
+        if not self._shape_bucket_size:
+            return width, height
+        bucket = self._shape_bucket_size
+        return -(-width // bucket) * bucket, -(-height // bucket) * bucket
+
+    def get_batch_size(self, resolution: tuple[int, int]) -> int:
+        """Get the number of images per batch for a resolution.
+
+        With a pixel budget, a batch is filled with as many images as fit into the budget (at least one image), so
+        the memory of a batch stays roughly the same for large photos and small thumbnails.
+
+        Args:
+            resolution (tuple[int, int]): resolution of the images in the batch
+
+        Returns:
+            int: number of images per batch
+        """
+        if not self._max_batch_pixels:
+            return self._max_batch_size
+        return max(self._max_batch_pixels // (resolution[0] * resolution[1]), 1)
+
+    def submit_images(
+        self, pool: ThreadPoolExecutor, filenames: list[str], resolution: tuple[int, int]
+    ) -> tuple[np.ndarray, list[str], list[Future]]:
+        """Allocate the array for a batch and submit the decoding of each image to the pool."""
+        width, height = resolution
+        batch_images = np.empty((len(filenames), height, width, 3), dtype=np.uint8)
+        futures = [
+            pool.submit(self.read_image_into, filename, batch_images, position)
+            for position, filename in enumerate(filenames)
+        ]
+        return batch_images, filenames, futures
+
+    def read_image_into(self, filename: str, batch_images: np.ndarray, position: int) -> None:
+        """Decode an image into its position of a preallocated batch array."""
+        img = decode_img(filename, max_side=self._max_side)
+        if img.shape != batch_images.shape[1:]:
+            # image was assigned to a larger shape bucket and is padded to the shape of the batch
+            img = pad_imgs(img[np.newaxis], height=batch_images.shape[1], width=batch_images.shape[2])[0]
+        batch_images[position] = img
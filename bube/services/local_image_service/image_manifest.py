@@ -0,0 +1,185 @@
+import hashlib
+import logging
+import os
+import sqlite3
+from collections.abc import Iterator
+from contextlib import closing
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from ..embedding_cache import get_embedding_fingerprint, hash_file
+
+
+class ManifestEntry(NamedTuple):
+    """State of an image file at the time it was embedded."""
+
+    path: str
+    size: int
+    mtime_ns: int
+    content_hash: Optional[str]
+    embedding: Optional[np.ndarray]
+
+
+class ManifestDiff(NamedTuple):
+    """Result of comparing image files with the manifest."""
+
+    unchanged: list[ManifestEntry]
+    changed: list[ManifestEntry]
+    deleted: list[str]
+
+
+class ImageManifest:
+    """Manifest of the embedded images in a local image root.
+
+    For each image, the manifest stores path, size, modification time, an optional content hash and the embedding in a
+    SQLite file. The path is also the id of the embedding in the vector database. Re-runs on the same root can thus skip
+    all images which didn't change since they were embedded. If the model or the decoding settings change, the manifest
+    is reset. The bulk ingest only stores the state of the files without the embedding, which is only kept in the
+    vector database.
+    """
+
+    _db_path: Path
+    _use_hash: bool
+
+    _logger: logging.Logger
+
+    def __init__(self, image_root: str, manifest_dir: str, use_hash: bool = False):
+        """Open (or create) the manifest of an image root.
+
+        Args:
+            image_root (str): root directory of the images
+            manifest_dir (str): directory in which the manifests of all roots are stored
+            use_hash (bool, optional): if True, files with changed size or modification time are only treated as
+                changed, if their content hash changed as well
+        """
+        self._logger = logging.getLogger(__name__)
+        self._use_hash = use_hash
+        root_id = hashlib.blake2b(str(Path(image_root).resolve()).encode(), digest_size=16).hexdigest()
+        Path(manifest_dir).mkdir(parents=True, exist_ok=True)
+        self._db_path = Path(manifest_dir) / f"{root_id}.sqlite3"
+        self._setup_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._db_path, timeout=60)
+
+    def _setup_database(self) -> None:
+        fingerprint = get_embedding_fingerprint()
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                "mtime_ns INTEGER NOT NULL, content_hash TEXT, embedding BLOB)"
+            )
+            connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            row = connection.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+            if row and row[0] != fingerprint:
+                self._logger.info(f"Model or settings changed since the last run. Resetting manifest {self._db_path}")
+                connection.execute("DELETE FROM files")
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fingerprint', ?)", (fingerprint,))
+
+    def diff(self, paths: list[str], find_deleted: bool = False, load_embeddings: bool = True) -> ManifestDiff:
+        """Compare image files with the manifest.
+
+        Args:
+            paths (list[str]): paths of the current image files
+            find_deleted (bool, optional): if True, all manifest entries which are not part of `paths` are reported as
+                deleted. Should only be used if `paths` contains all images of the root.
+            load_embeddings (bool, optional): if False, the embeddings of unchanged entries aren't loaded, e.g. if
+                unchanged images are only skipped
+
+        Returns:
+            ManifestDiff: unchanged entries (with the embedding from the manifest), new or changed files (with their
+                current state) and the paths of deleted files. If embeddings are loaded, unchanged entries which were
+                stored without embedding are reported as changed.
+        """
+        with closing(self._connect()) as connection:
+            if find_deleted:
+                known_entries = {
+                    row[0]: row[1:]
+                    for row in connection.execute("SELECT path, size, mtime_ns, content_hash FROM files")
+                }
+            else:
+                # only the entries of the given paths are read, so diffs of small parts of a large root stay fast
+                known_entries = {
+                    path: row[1:] for path, row in self._select(connection, "path, size, mtime_ns, content_hash", paths)
+                }
+
+        unchanged, changed, moved = [], [], []
+        for path in paths:
+            try:
+                stat = os.stat(path)  # noqa: PTH116 - faster than pathlib for hundreds of thousands of files
+            except OSError:
+                self._logger.info(f"Could not read file: {path}. Skipping File.")
+                continue
+            known = known_entries.get(path)
+            is_unchanged = known is not None and known[:2] == (stat.st_size, stat.st_mtime_ns)
+            entry = ManifestEntry(path, stat.st_size, stat.st_mtime_ns, known[2] if is_unchanged else None, None)
+            if not is_unchanged and self._use_hash:
+                entry = entry._replace(content_hash=hash_file(path))
+                # if only the metadata changed (e.g. the file was copied), the content is the same
+                is_unchanged = known is not None and known[2] == entry.content_hash
+                if is_unchanged:
+                    moved.append(entry)
+
+            if is_unchanged:
+                unchanged.append(entry)
+            else:
+                changed.append(entry)
+
+        if moved:
+            with closing(self._connect()) as connection, connection:
+                connection.executemany(
+                    "UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?",
+                    [(entry.size, entry.mtime_ns, entry.path) for entry in moved],
+                )
+        if load_embeddings and unchanged:
+            with closing(self._connect()) as connection:
+                embeddings = dict(self._select(connection, "path, embedding", [entry.path for entry in unchanged]))
+            unchanged = [entry._replace(embedding=self._decode(embeddings[entry.path][1])) for entry in unchanged]
+            # entries of the bulk ingest have no embedding, so the images have to be embedded again
+            changed += [entry for entry in unchanged if entry.embedding is None]
+            unchanged = [entry for entry in unchanged if entry.embedding is not None]
+        deleted = sorted(set(known_entries) - set(paths)) if find_deleted else []
+        self._logger.info(f"Manifest: {len(unchanged)} unchanged, {len(changed)} new/changed, {len(deleted)} deleted.")
+        return ManifestDiff(unchanged=unchanged, changed=changed, deleted=deleted)
+
+    @staticmethod
+    def _select(connection: sqlite3.Connection, columns: str, paths: list[str]) -> Iterator[tuple[str, tuple]]:
+        """Select the given columns (starting with the path) of the entries of the given paths."""
+        # SQLite limits the number of parameters of a query
+        for start in range(0, len(paths), 500):
+            chunk = paths[start : start + 500]
+            query = f"SELECT {columns} FROM files WHERE path IN ({','.join('?' * len(chunk))})"  # noqa: S608
+            for row in connection.execute(query, chunk):
+                yield row[0], row
+
+    def get_paths(self) -> list[str]:
+        """Get the paths of all entries."""
+        with closing(self._connect()) as connection:
+            return [row[0] for row in connection.execute("SELECT path FROM files")]
+
+    def update(self, entries: list[ManifestEntry]) -> None:
+        """Insert or update the given entries."""
+        rows = [
+            (entry.path, entry.size, entry.mtime_ns, entry.content_hash, self._encode(entry.embedding))
+            for entry in entries
+        ]
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, content_hash, embedding) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def remove(self, paths: list[str]) -> None:
+        """Remove the entries of the given paths."""
+        with closing(self._connect()) as connection, connection:
+            connection.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in paths])
+
+    @staticmethod
+    def _encode(embedding: Optional[np.ndarray]) -> Optional[bytes]:
+        return None if embedding is None else np.asarray(embedding, dtype=np.float32).tobytes()
+
+    @staticmethod
+    def _decode(embedding: Optional[bytes]) -> Optional[np.ndarray]:
+        return None if embedding is None else np.frombuffer(embedding, dtype=np.float32)
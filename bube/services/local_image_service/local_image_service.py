@@ -1,20 +1,59 @@
-from typing import Optional
+import itertools
+import logging
+from collections.abc import Iterable
+from typing import NamedTuple, Optional
 
-from ...models import ImageEmbedding
+import numpy as np
+
+from ...config import config
+from ...models import EmbeddingBatch
+from ..embedding_cache import EmbeddingCache
 from ..image_embedding_model import ImageEmbeddingModel
+from .image_manifest import ImageManifest, ManifestEntry
 from .local_img_reader import LocalImgReader
+from .streaming_img_reader import StreamingImgReader
+
+# number of discovered files which are hashed and looked up in the embedding cache at once
+CACHE_CHUNK_SIZE = 1000
+
+
+class LocalIndexResult(NamedTuple):
+    """Result of an incremental embedding run over a local image root."""
+
+    changed: EmbeddingBatch
+    unchanged: EmbeddingBatch
+    deleted: list[str]
+    manifest: ImageManifest
+    manifest_entries: list[ManifestEntry]
+    image_paths: list[str]
+
+    def embeddings(self) -> EmbeddingBatch:
+        """Embeddings of the changed and unchanged images in the order of the requested images."""
+        batch = EmbeddingBatch.concatenate([self.unchanged, self.changed])
+        row_by_path = {filename: row for row, filename in enumerate(batch.filenames)}
+        # unreadable images have no embedding
+        rows = [row_by_path[path] for path in self.image_paths if path in row_by_path]
+        return EmbeddingBatch([batch.filenames[row] for row in rows], batch.embeddings[rows])
 
 
 class LocalImageService:
     """Service class for embedding images from local storage."""
 
     _embedding_model: ImageEmbeddingModel
+    _embedding_cache: Optional[EmbeddingCache]
+    _logger: logging.Logger
 
     def __init__(self):
         self._embedding_model = ImageEmbeddingModel()
+        self._embedding_cache = EmbeddingCache() if config.EMBEDDING_CACHE_ENABLED else None
+        self._logger = logging.getLogger(__name__)
 
-    def embed_local_images(self, image_root: str, filenames: Optional[list[str]] = None) -> list[ImageEmbedding]:
-        """Embeds images from local storage and returns a list of ImageEmbedding objects.
+    def embed_local_images(self, image_root: str, filenames: Optional[list[str]] = None) -> EmbeddingBatch:
+        """Embeds images from local storage and returns their embeddings as batch.
+
+        If the manifest is enabled, only new or changed images are embedded, the embeddings of all other images are
+        taken from the manifest of the image root. The manifest itself is not updated, because the embeddings are not
+        stored in the database, see `FEEXService.store_index_result`.
 
         Args:
             image_root (str): Path to the root directory containing images
@@ -22,22 +61,103 @@ class LocalImageService:
                 all images in the root directory will be embedded. Defaults to None.
 
         Returns:
-            list[ImageEmbedding]: List of ImageEmbedding objects
+            EmbeddingBatch: embeddings and filenames of the readable images
         """
-        if not filenames:
-            file_reader = LocalImgReader(image_root=image_root, all_img_files=True)
+        if config.LOCAL_IMAGE_MANIFEST_ENABLED:
+            return self.index_local_images(image_root=image_root, filenames=filenames).embeddings()
+
+        if filenames:
+            image_paths = LocalImgReader.get_image_paths(image_root=image_root, filenames=filenames, all_img_files=True)
         else:
-            file_reader = LocalImgReader(image_root=image_root, filenames=filenames)
+            # the first images are embedded while the image root is still being scanned
+            image_paths = LocalImgReader.iter_image_files(image_root)
+        return EmbeddingBatch.from_pairs(self._embed_paths(image_paths))
+
+    def index_local_images(
+        self, image_root: str, filenames: Optional[list[str]] = None, find_deleted: bool = False
+    ) -> LocalIndexResult:
+        """Embeds only the images of a root, which are new or changed since the last run.
+
+        The manifest of the root is not updated by this method, so the embeddings can be stored first.
+        Afterward, `commit_index` has to be called with the result.
+
+        Args:
+            image_root (str): Path to the root directory containing images
+            filenames (list[str], optional): filenames of images to embed in the root directory. If not provided,
+                all images in the root directory will be embedded. Defaults to None.
+            find_deleted (bool, optional): If True, images which were embedded before but don't exist anymore are
+                reported as deleted. Only used if no filenames are provided.
+
+        Returns:
+            LocalIndexResult: embeddings of the new/changed images, embeddings of the unchanged images and the
+                filenames of deleted images
+        """
+        image_paths = LocalImgReader.get_image_paths(image_root=image_root, filenames=filenames, all_img_files=True)
+        manifest = ImageManifest(
+            image_root, manifest_dir=config.LOCAL_IMAGE_MANIFEST_PATH, use_hash=config.LOCAL_IMAGE_MANIFEST_HASH
+        )
+        diff = manifest.diff(image_paths, find_deleted=find_deleted and not filenames)
+
+        changed_entries = {entry.path: entry for entry in diff.changed}
+        embeddings = self._embed_paths(list(changed_entries))
+        manifest_entries = [changed_entries[path]._replace(embedding=embedding) for path, embedding in embeddings]
+
+        return LocalIndexResult(
+            changed=EmbeddingBatch.from_pairs(embeddings),
+            unchanged=EmbeddingBatch.from_pairs((entry.path, entry.embedding) for entry in diff.unchanged),
+            deleted=diff.deleted,
+            manifest=manifest,
+            manifest_entries=manifest_entries,
+            image_paths=image_paths,
+        )
+
+    def commit_index(self, index_result: LocalIndexResult) -> None:
+        """Writes the new/changed images of an index run to the manifest and removes the deleted images."""
+        index_result.manifest.update(index_result.manifest_entries)
+        index_result.manifest.remove(index_result.deleted)
+
+    def _embed_paths(self, image_paths: Iterable[str]) -> list[tuple[str, np.ndarray]]:
+        return self._embed_cached(image_paths) if self._embedding_cache else self._embed_files(image_paths)
+
+    def _embed_cached(self, image_paths: Iterable[str]) -> list[tuple[str, np.ndarray]]:
+        """Embeds the images which aren't in the embedding cache yet and returns the embeddings of all images.
+
+        The paths are hashed and embedded chunk by chunk, so the first images are embedded while the image root is
+        still being scanned.
+        """
+        image_paths = iter(image_paths)
+        embeddings = []
+        while chunk := list(itertools.islice(image_paths, CACHE_CHUNK_SIZE)):
+            embeddings.extend(self._embed_cached_chunk(chunk))
+        return embeddings
+
+    def _embed_cached_chunk(self, image_paths: list[str]) -> list[tuple[str, np.ndarray]]:
+        hashed_paths = []
+        keys = []
+        for path in image_paths:
+            try:
+                keys.append(self._embedding_cache.hash_file(path))
+            except OSError:
+                self._logger.info(f"Could not read file: {path}. Skipping File.")
+                continue
+            hashed_paths.append(path)
+
+        def embed_missing(positions: list[int]) -> dict[int, np.ndarray]:
+            position_by_path = {hashed_paths[position]: position for position in positions}
+            embeddings = self._embed_files(list(position_by_path))
+            return {position_by_path[path]: embedding for path, embedding in embeddings}
+
+        embeddings = self._embedding_cache.get_embeddings(keys, embed_missing)
+        return [(path, embedding) for path, embedding in zip(hashed_paths, embeddings) if embedding is not None]
+
+    def _embed_files(self, image_paths: Iterable[str]) -> list[tuple[str, np.ndarray]]:
+        """Embeds image files in batches and returns the path and embedding of each readable image."""
+        file_reader = StreamingImgReader(image_paths)
 
         embeddings = []
+        # batches are emitted as soon as they are full and the next batches are decoded while the current is embedded
         for batch, batch_filenames in file_reader:
             # compute embedding for each image
             embeddings_batch = self._embedding_model.compute_embedding_batch(batch)
-
-            # Embedding is currently a Numpy array, which should be converted to list[float]
-            embeddings_list = [
-                ImageEmbedding(embedding=embedding.tolist(), filename=filename)
-                for embedding, filename in zip(embeddings_batch, batch_filenames)
-            ]
-            embeddings.extend(embeddings_list)
+            embeddings.extend(zip(batch_filenames, embeddings_batch))
         return embeddings
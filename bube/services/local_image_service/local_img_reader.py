@@ -1,14 +1,16 @@
 import logging
 import os
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
 
 import numpy as np
-import PIL
-from PIL import Image
-from pillow_heif import register_heif_opener
 
 from ...config import config
+from .image_batcher import ImageBatcher
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".heif")
 
 
 class LocalImgReader:
@@ -16,39 +18,101 @@ class LocalImgReader:
 
     Images are grouped by resolution for efficient batch creation (and thus inference).
     Through the __len__ and __getitem__ methods, the class can be used as an iterable of batches.
+    To decode the next batches in a thread pool while the current batch is processed, pass the paths of the images
+    (see `get_image_paths`) to the StreamingImgReader instead.
+    Optionally, resolutions are rounded up to shape buckets and the images are padded, so that images with slightly
+    different resolutions can share a batch.
     """
 
     _image_root: str
-    _max_batch_size: int
+    _batcher: ImageBatcher
+    _probe_workers: int
     _filenames: list[str]
     _batches: list[list[str]]
+    _batch_resolutions: list[tuple[int, int]]
 
     _logger: logging.Logger
 
-    def __init__(
+    def __init__(  # noqa: PLR0913
         self,
         filenames: Optional[list[str]] = None,
         image_root: str = "",
         max_batch_size: int = config.LOCAL_IMAGE_BATCH_SIZE,
         all_img_files: bool = False,
+        *,
+        max_batch_pixels: Optional[int] = config.LOCAL_IMAGE_BATCH_PIXEL_BUDGET,
+        shape_bucket_size: Optional[int] = config.LOCAL_IMAGE_SHAPE_BUCKET_SIZE,
+        max_side: Optional[int] = config.MAX_INPUT_SIDE,
+        probe_workers: int = config.LOCAL_IMAGE_PROBE_WORKERS,
     ):
-        register_heif_opener()  # support for HEIF images
         self._logger = logging.getLogger(__name__)
+        self._logger.info(f"Reading images from folder: {image_root} with filenames: {filenames}")
+        self._image_root = image_root
+        self._batcher = ImageBatcher(
+            max_batch_size, max_batch_pixels=max_batch_pixels, shape_bucket_size=shape_bucket_size, max_side=max_side
+        )
+        self._probe_workers = probe_workers
+        self._filenames = self.get_image_paths(image_root=image_root, filenames=filenames, all_img_files=all_img_files)
+        self._batches = self._create_batches(self._filenames)
+        self._logger.info(f"Found {len(self._filenames)} images in total. These are grouped into {len(self)} batches.")
+
+    @staticmethod
+    def get_image_paths(
+        image_root: str,
+        filenames: Optional[list[str]] = None,
+        all_img_files: bool = False,
+        recursive: bool = config.LOCAL_IMAGE_RECURSIVE,
+    ) -> list[str]:
+        """Get the paths of the images which should be read.
+
+        Args:
+            image_root (str): root directory of the images
+            filenames (list[str], optional): filenames of the images in the root directory
+            all_img_files (bool, optional): if no filenames are provided, all image files in the root directory are used
+            recursive (bool, optional): if all image files are used, the subdirectories are searched as well
+
+        Returns:
+            list[str]: paths (including the root directory) of the images
+        """
         filenames = filenames if filenames else []
         # if multiples filenames are passed as a single string (to the API) we split them up
         if len(filenames) == 1:
             filenames = filenames[0].split(",")
 
-        self._logger.info(f"Reading images from folder: {image_root} with filenames: {filenames}")
-        self._image_root = image_root
-        self._max_batch_size = max_batch_size
         if not filenames and all_img_files:
-            self._logger.info(f"No filenames provided. Reading all image files from folder: {image_root}")
-            filenames = os.listdir(image_root)
-            filenames = [name for name in filenames if name.lower().endswith((".jpg", ".jpeg", ".png", ".heif"))]
-        self._filenames = [str(Path(image_root) / filename) for filename in filenames]
-        self._batches = self._create_batches(self._filenames)
-        self._logger.info(f"Found {len(self._filenames)} images in total. These are grouped into {len(self)} batches.")
+            return list(LocalImgReader.iter_image_files(image_root, recursive=recursive))
+        return [str(Path(image_root) / filename) for filename in filenames]
+
+    @staticmethod
+    def iter_image_files(image_root: str, recursive: bool = config.LOCAL_IMAGE_RECURSIVE) -> Iterator[str]:
+        """Lazily yield the paths of all image files in the root directory.
+
+        `os.scandir` returns the file type with the directory entries, so no additional stat call per file is needed.
+        Paths are yielded while the directories are scanned, so the first images can be processed immediately.
+
+        Args:
+            image_root (str): root directory of the images
+            recursive (bool, optional): if True, the subdirectories are searched as well
+
+        Yields:
+            str: path (including the root directory) of an image file
+        """
+        logging.getLogger(__name__).info(f"No filenames provided. Reading all image files from: {image_root}")
+        directories = [str(Path(image_root))]
+        while directories:
+            try:
+                with os.scandir(directories.pop()) as entries:
+                    subdirectories = []
+                    for entry in entries:
+                        if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                            yield entry.path
+                        elif recursive and entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.path)
+            except OSError as e:
+                logging.getLogger(__name__).info(f"Could not scan directory: {e}. Skipping directory.")
+                continue
+            # pop() takes the last directory, reversing keeps the directories in the order of the scan
+            directories.extend(reversed(subdirectories))
 
     def __len__(self) -> int:
         """Get the number of available batches.
@@ -60,7 +124,11 @@ class LocalImgReader:
 
     def _create_batches(self, filenames: list[str]) -> list[list[str]]:
         img_dict = self._sort_img_by_res(filenames)
-        return self._convert_dict_to_batches(img_dict)
+        batches = self._convert_dict_to_batches(img_dict)
+        # remember the (bucketed) resolution of each batch, which is the shape of the batch array
+        resolution_by_file = {filename: res for res, res_filenames in img_dict.items() for filename in res_filenames}
+        self._batch_resolutions = [resolution_by_file[batch[0]] for batch in batches]
+        return batches
 
     def _sort_img_by_res(self, filenames: list[str]) -> dict[tuple[int, int], list[str]]:
         """Group image files by resolution.
@@ -69,24 +137,18 @@ class LocalImgReader:
             filenames (list[str]): filenames (including path) of images which should be grouped
 
         Returns:
-            dict[tuple[int, int], list[str]]: dict, where key is the resolution of the images
-                and value is a list of filenames with said res
+            dict[tuple[int, int], list[str]]: dict, where key is the resolution (width, height) of the decoded images
+                and value is a list of filenames with said res. With shape buckets, the key is the bucket resolution.
         """
         img_files_by_res = {}
-        for filename in filenames:
-            # Read resolution without loading the whole image into memory
-            try:
-                with Image.open(filename) as img:
-                    height, width = img.size
-            except (PIL.UnidentifiedImageError, FileNotFoundError):
-                self._logger.info(f"Could not read image resolution for file: {filename}. Skipping File.")
-                continue
-
-            # Group images files by image resolution
-            key = (height, width)
-            if key not in img_files_by_res:
-                img_files_by_res[key] = []
-            img_files_by_res[key].append(filename)
+        # reading the headers is mostly waiting for I/O, so they are read in parallel
+        with ThreadPoolExecutor(max_workers=max(self._probe_workers, 1), thread_name_prefix="bube-probe") as pool:
+            for filename, key in zip(filenames, pool.map(self._batcher.probe_resolution, filenames)):
+                if key is None:
+                    continue
+                if key not in img_files_by_res:
+                    img_files_by_res[key] = []
+                img_files_by_res[key].append(filename)
 
         return img_files_by_res
 
@@ -98,15 +160,18 @@ class LocalImgReader:
         Args:
             img_dict (dict[tuple[int, int], list[str]]): dict, where key is the resolution of the images
                 and value is a list of filenames with said res
-            batch_size (int, optional): maximum number of images in a batch
+            batch_size (int, optional): maximum number of images in a batch. If not provided, the batch size is derived
+                from the pixel budget (if configured) or the maximum batch size of the reader.
 
         Returns:
             list[list[str]]: list with batches of image filenames
         """
         batches = []
-        batch_size = self._max_batch_size if batch_size == 0 else batch_size
-        for filenames in img_dict.values():
-            batches_per_resolution = [filenames[i : i + batch_size] for i in range(0, len(filenames), batch_size)]
+        for resolution, filenames in img_dict.items():
+            res_batch_size = batch_size if batch_size else self._batcher.get_batch_size(resolution)
+            batches_per_resolution = [
+                filenames[i : i + res_batch_size] for i in range(0, len(filenames), res_batch_size)
+            ]
             batches.extend(batches_per_resolution)
         return batches
 
@@ -126,6 +191,11 @@ class LocalImgReader:
         filenames = self._batches[index]
 
         # read images with PIL and convert them to a single numpy array
-        batch_images = [np.array(Image.open(filename).convert("RGB"), dtype=np.float32) for filename in filenames]
-        batch_images = np.stack(batch_images, axis=0)
+        batch_images = np.empty(self._get_batch_shape(index), dtype=np.uint8)
+        for position, filename in enumerate(filenames):
+            self._batcher.read_image_into(filename, batch_images, position)
         return batch_images, filenames
+
+    def _get_batch_shape(self, index: int) -> tuple[int, int, int, int]:
+        width, height = self._batch_resolutions[index]
+        return len(self._batches[index]), height, width, 3
@@ -0,0 +1,121 @@
+import logging
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from ...config import config
+from .image_batcher import ImageBatcher
+
+
+class StreamingImgReader:
+    """Class to read images in batches while the image paths are still being discovered.
+
+    In contrast to the LocalImgReader, the resolutions of all images aren't read before the first batch is created.
+    The image headers are read in parallel while the paths are consumed, and a batch is emitted as soon as enough images
+    with the same (bucketed) resolution were found. The remaining, partially filled batches are emitted at the end.
+    Thus, the first embeddings of a large directory are available after a few seconds instead of after a full pass.
+    The reader can only be iterated, the number of batches is unknown in advance.
+    """
+
+    _image_paths: Iterable[str]
+    _batcher: ImageBatcher
+    _probe_workers: int
+    _num_workers: int
+    _prefetch_batches: int
+
+    _logger: logging.Logger
+
+    def __init__(  # noqa: PLR0913
+        self,
+        image_paths: Iterable[str],
+        max_batch_size: int = config.LOCAL_IMAGE_BATCH_SIZE,
+        *,
+        max_batch_pixels: Optional[int] = config.LOCAL_IMAGE_BATCH_PIXEL_BUDGET,
+        shape_bucket_size: Optional[int] = config.LOCAL_IMAGE_SHAPE_BUCKET_SIZE,
+        max_side: Optional[int] = config.MAX_INPUT_SIDE,
+        probe_workers: int = config.LOCAL_IMAGE_PROBE_WORKERS,
+        num_workers: int = config.LOCAL_IMAGE_DECODE_WORKERS,
+        prefetch_batches: int = config.LOCAL_IMAGE_PREFETCH_BATCHES,
+    ):
+        """Create a reader for the given image paths.
+
+        Args:
+            image_paths (Iterable[str]): paths of the images, e.g. a generator from `LocalImgReader.iter_image_files`
+            max_batch_size (int, optional): maximum number of images in a batch
+            max_batch_pixels (int, optional): pixel budget of a batch, see ImageBatcher
+            shape_bucket_size (int, optional): size of the shape buckets, see ImageBatcher
+            max_side (int, optional): maximum side of the decoded images, see ImageBatcher
+            probe_workers (int, optional): number of threads reading image headers
+            num_workers (int, optional): number of threads decoding images
+            prefetch_batches (int, optional): number of batches which are decoded ahead of the current batch
+        """
+        self._logger = logging.getLogger(__name__)
+        self._image_paths = image_paths
+        self._batcher = ImageBatcher(
+            max_batch_size, max_batch_pixels=max_batch_pixels, shape_bucket_size=shape_bucket_size, max_side=max_side
+        )
+        self._probe_workers = probe_workers
+        self._num_workers = num_workers
+        self._prefetch_batches = prefetch_batches
+
+    def __iter__(self) -> Iterator[tuple[np.ndarray, list[str]]]:
+        """Iterate over all batches while the following batches are discovered and decoded in parallel.
+
+        Yields:
+            tuple[np.ndarray, list[str]]: tuple with the batch as a numpy array and the corresponding list of filenames
+        """
+        probe_pool = ThreadPoolExecutor(max_workers=max(self._probe_workers, 1), thread_name_prefix="bube-probe")
+        decode_pool = ThreadPoolExecutor(max_workers=max(self._num_workers, 1), thread_name_prefix="bube-decode")
+        try:
+            pending_batches = deque()
+            num_images = 0
+            for filenames, resolution in self._iter_filled_batches(probe_pool):
+                pending_batches.append(self._batcher.submit_images(decode_pool, filenames, resolution))
+                num_images += len(filenames)
+                if len(pending_batches) > self._prefetch_batches:
+                    yield self._wait_for_batch(*pending_batches.popleft())
+            while pending_batches:
+                yield self._wait_for_batch(*pending_batches.popleft())
+            self._logger.info(f"Read {num_images} images.")
+        finally:
+            probe_pool.shutdown(wait=True, cancel_futures=True)
+            decode_pool.shutdown(wait=True, cancel_futures=True)
+
+    def _iter_filled_batches(self, probe_pool: ThreadPoolExecutor) -> Iterator[tuple[list[str], tuple[int, int]]]:
+        """Group the images by resolution and yield each group as soon as it fills a batch."""
+        img_files_by_res: dict[tuple[int, int], list[str]] = {}
+        # only a limited number of headers is read ahead, so the paths are consumed lazily
+        pending_probes: deque[tuple[str, Future]] = deque()
+        max_pending_probes = max(self._probe_workers, 1) * 4
+
+        def add_probed_image() -> Optional[tuple[list[str], tuple[int, int]]]:
+            filename, future = pending_probes.popleft()
+            resolution = future.result()
+            if resolution is None:
+                return None
+            img_files_by_res.setdefault(resolution, []).append(filename)
+            if len(img_files_by_res[resolution]) < self._batcher.get_batch_size(resolution):
+                return None
+            return img_files_by_res.pop(resolution), resolution
+
+        for filename in self._image_paths:
+            pending_probes.append((filename, probe_pool.submit(self._batcher.probe_resolution, filename)))
+            if len(pending_probes) >= max_pending_probes and (batch := add_probed_image()):
+                yield batch
+        while pending_probes:
+            if batch := add_probed_image():
+                yield batch
+
+        for resolution, filenames in img_files_by_res.items():
+            yield filenames, resolution
+
+    @staticmethod
+    def _wait_for_batch(
+        batch_images: np.ndarray, filenames: list[str], futures: list[Future]
+    ) -> tuple[np.ndarray, list[str]]:
+        for future in futures:
+            future.result()
+        return batch_images, filenames
@@ -1,26 +1,35 @@
 import datetime
+import functools
+import io
 import logging
 from typing import BinaryIO, Optional
 
 import numpy as np
-from PIL import Image
 
-from ...models import ImageEmbedding
-from ..image_embedding_model import ImageEmbeddingModel
+from ...config import config
+from ...execution import Stage, StagedOperation, run_staged
+from ...models import EmbeddingBatch
+from ..batch_scheduler import EmbeddingBatchScheduler
+from ..embedding_cache import CacheLookup, EmbeddingCache
+from ..image_embedding_model import ImageEmbeddingModel, decode_img
 
 
 class RemoteImageService:
     """Service class for embedding images which were uploaded by the user through API."""
 
     _embedding_model: ImageEmbeddingModel
+    _batch_scheduler: Optional[EmbeddingBatchScheduler]
+    _embedding_cache: Optional[EmbeddingCache]
     _logger: logging.Logger
 
     def __init__(self):
         self._embedding_model = ImageEmbeddingModel()
+        self._batch_scheduler = EmbeddingBatchScheduler() if config.BATCH_SCHEDULER_ENABLED else None
+        self._embedding_cache = EmbeddingCache() if config.EMBEDDING_CACHE_ENABLED else None
         self._logger = logging.getLogger(__name__)
 
-    def embed_images(self, images: list[BinaryIO], filenames: Optional[list[str]] = None) -> list[ImageEmbedding]:
-        """Embeds images (uploaded to the API) and returns a list of ImageEmbedding objects.
+    def embed_images(self, images: list[BinaryIO], filenames: Optional[list[str]] = None) -> EmbeddingBatch:
+        """Embeds images (uploaded to the API) and returns their embeddings as batch.
 
         Args:
             images (list[BinaryIO]): List of images as BinaryIO objects
@@ -28,20 +37,64 @@ class RemoteImageService:
                 generated with a timestamp.
 
         Returns:
-            list[ImageEmbedding]: List of ImageEmbedding objects
+            EmbeddingBatch: embeddings and filenames of the images
+        """
+        return run_staged(self.embed_images_stages(images=images, filenames=filenames))
+
+    def embed_images_stages(
+        self, images: list[BinaryIO], filenames: Optional[list[str]] = None
+    ) -> StagedOperation[EmbeddingBatch]:
+        """Stages of `embed_images`, which the API runs in the inference pool and on the event loop.
+
+        The images are read and decoded in the inference pool, but a request only waits for the batch scheduler on the
+        event loop. Otherwise, at most `INFERENCE_POOL_WORKERS` requests could share a batch.
         """
         self._logger.info(f"Embedding {len(images)} images.")
-        # convert images to numpy array
-        images = [np.array(Image.open(image).convert("RGB"), dtype=np.float32) for image in images]
+        contents = yield Stage("inference", functools.partial(self._read_images, images))
 
         # if no filenames are provided, generate with timestamp
-        if filenames is None or len(images) != len(filenames):
+        if filenames is None or len(contents) != len(filenames):
             self._logger.info("No filenames provided. Generating filenames with timestamp.")
-            filenames = [f"{datetime.datetime.now(datetime.UTC)}_image_{i}" for i in range(len(images))]
-
-        embedding_list = []
-        for img, filename in zip(images, filenames):
-            self._logger.info(f"Computing embedding for image: {filename}")
-            emb = self._embedding_model.compute_embedding_single(img)
-            embedding_list.extend([ImageEmbedding(embedding=emb.tolist(), filename=filename)])
-        return embedding_list
+            filenames = [f"{datetime.datetime.now(datetime.UTC)}_image_{i}" for i in range(len(contents))]
+
+        if not self._embedding_cache:
+            embeddings_by_position = yield from self._embed_contents_stages(contents, list(range(len(contents))))
+            return EmbeddingBatch(filenames, list(embeddings_by_position.values()))
+
+        # identical images and images which were embedded before are only embedded once
+        lookup = yield Stage("inference", functools.partial(self._lookup_cached_embeddings, contents))
+        computed_embeddings = {}
+        if lookup.missing_positions:
+            computed_embeddings = yield from self._embed_contents_stages(contents, lookup.positions_to_embed)
+        embeddings = yield Stage(
+            "inference", functools.partial(self._embedding_cache.complete, lookup, computed_embeddings)
+        )
+        return EmbeddingBatch(filenames, embeddings)
+
+    @staticmethod
+    def _read_images(images: list[BinaryIO]) -> list[bytes]:
+        return [image.read() for image in images]
+
+    def _lookup_cached_embeddings(self, contents: list[bytes]) -> CacheLookup:
+        return self._embedding_cache.lookup([self._embedding_cache.hash_bytes(content) for content in contents])
+
+    def _embed_contents_stages(
+        self, contents: list[bytes], positions: list[int]
+    ) -> StagedOperation[dict[int, np.ndarray]]:
+        """Decodes and embeds the images at the given positions and returns their embeddings by position."""
+        if not self._batch_scheduler:
+            embeddings = yield Stage("inference", functools.partial(self._embed_contents, contents, positions))
+            return dict(zip(positions, embeddings, strict=True))
+
+        images = yield Stage("inference", functools.partial(self._decode_contents, contents, positions))
+        # images are handed to the batch scheduler, so they can share a batch with images from concurrent requests
+        embeddings = yield Stage("futures", lambda: [self._batch_scheduler.submit(img) for img in images])
+        return dict(zip(positions, embeddings, strict=True))
+
+    @staticmethod
+    def _decode_contents(contents: list[bytes], positions: list[int]) -> list[np.ndarray]:
+        return [decode_img(io.BytesIO(contents[position]), max_side=config.MAX_INPUT_SIDE) for position in positions]
+
+    def _embed_contents(self, contents: list[bytes], positions: list[int]) -> list[np.ndarray]:
+        images = self._decode_contents(contents, positions)
+        return [self._embedding_model.compute_embedding_single(img) for img in images]
@@ -0,0 +1,80 @@
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from bube.config import config
+from bube.execution import run_staged_in_pools
+from bube.services import RemoteImageService
+from bube.services.batch_scheduler import EmbeddingBatchScheduler
+from bube.services.image_embedding_model import ImageEmbeddingModel
+
+
+def create_images(shapes):
+    rng = np.random.default_rng(42)
+    return [rng.uniform(0, 255, size=(*shape, 3)).astype(np.float32) for shape in shapes]
+
+
+def test_batch_scheduler_matches_single_inference():
+    model = ImageEmbeddingModel()
+    scheduler = EmbeddingBatchScheduler()
+    # images with different shapes have to be split into separate batches by the scheduler
+    images = create_images([(224, 224), (256, 320), (224, 224), (256, 320), (300, 200)])
+
+    embeddings = scheduler.compute_embeddings([img.copy() for img in images])
+
+    assert len(embeddings) == len(images)
+    for img, embedding in zip(images, embeddings):
+        assert embedding.shape == (2048,)
+        assert np.allclose(embedding, model.compute_embedding_single(img.copy()), atol=1e-4)
+
+
+def test_batch_scheduler_concurrent_callers():
+    scheduler = EmbeddingBatchScheduler()
+    images = create_images([(224, 224)] * 8)
+
+    # every caller has to receive the embedding of its own image
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        embeddings = list(pool.map(lambda img: scheduler.compute_embedding_single(img.copy()), images))
+
+    expected = scheduler.compute_embeddings([img.copy() for img in images])
+    for embedding, expected_embedding in zip(embeddings, expected):
+        assert np.allclose(embedding, expected_embedding, atol=1e-4)
+
+
+def test_uploads_wait_for_the_scheduler_outside_the_inference_pool(monkeypatch):
+    service = RemoteImageService()
+    scheduler = EmbeddingBatchScheduler()
+    model = ImageEmbeddingModel()
+    batch_sizes = []
+    compute_embedding_batch = model.compute_embedding_batch
+
+    def record_batch(batch):
+        batch_sizes.append(len(batch))
+        return compute_embedding_batch(batch)
+
+    monkeypatch.setattr(model, "compute_embedding_batch", record_batch)
+    monkeypatch.setattr(scheduler, "_max_wait_s", 0.5)
+    monkeypatch.setattr(scheduler, "_max_batch_size", 64)
+
+    num_requests = 2 * config.INFERENCE_POOL_WORKERS
+    contents = []
+    for image in create_images([(224, 224)] * num_requests):
+        buffer = io.BytesIO()
+        Image.fromarray(image.astype(np.uint8)).save(buffer, format="PNG")
+        contents.append(buffer.getvalue())
+
+    async def upload_concurrently():
+        return await asyncio.gather(
+            *[
+                run_staged_in_pools(service.embed_images_stages(images=[io.BytesIO(content)], filenames=[f"{i}.png"]))
+                for i, content in enumerate(contents)
+            ]
+        )
+
+    batches = asyncio.run(upload_concurrently())
+    assert [batch.filenames for batch in batches] == [[f"{i}.png"] for i in range(num_requests)]
+    # waiting requests don't occupy a thread of the inference pool, so more requests than workers share a batch
+    assert max(batch_sizes) > config.INFERENCE_POOL_WORKERS
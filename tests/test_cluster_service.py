@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from bube.config import config
+from bube.models import ImageEmbedding
+from bube.repository import EmbeddedChromaDB, NumpyVectorDB
+from bube.services.cluster_service import ClusterService, UnionFind
+
+
+def test_union_find():
+    union_find = UnionFind()
+    elements = [union_find.add() for _ in range(6)]
+    union_find.union(elements[0], elements[1])
+    union_find.union(elements[2], elements[1])
+    union_find.union(elements[4], elements[5])
+    assert union_find.find(elements[0]) == union_find.find(elements[2])
+    assert union_find.find(elements[0]) != union_find.find(elements[4])
+    assert sorted(sorted(group) for group in union_find.groups()) == [[0, 1, 2], [3], [4, 5]]
+
+
+def test_find_clusters(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "NUMPY_DB_PATH", str(tmp_path))
+    monkeypatch.setattr(config, "CLUSTER_NEIGHBOUR_LIMIT", 3)
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(30, 2048))
+    # group i has i % 4 + 1 members, the members of a group are chained by small distances
+    image_embeddings = []
+    for group, center in enumerate(centers):
+        for member in range(group % 4 + 1):
+            embedding = center + rng.normal(scale=0.1, size=2048)
+            image_embeddings.append(
+                ImageEmbedding(embedding=(embedding / np.linalg.norm(embedding)).tolist(), filename=f"{group}_{member}")
+            )
+    vector_db = NumpyVectorDB()
+    vector_db.store_embeddings(image_embeddings)
+
+    report = ClusterService(vector_db, block_size=7, num_workers=2).find_clusters(threshold=0.1)
+    assert report.num_of_embeddings == len(image_embeddings)
+    # groups with a single member aren't clusters, groups of 4 are joined although each file has 3 neighbours
+    assert report.num_of_clusters == len(report.clusters) == 22
+    assert [cluster.num_of_files for cluster in report.clusters] == [4] * 7 + [3] * 7 + [2] * 8
+    for cluster in report.clusters:
+        assert len({filename.split("_")[0] for filename in cluster.filenames}) == 1
+
+
+def test_chroma_refuses_large_collections(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CHROMA_DB_MODE", "embedded")
+    monkeypatch.setattr(config, "CHROMA_DB_EMBEDDED_PATH", str(tmp_path))
+    monkeypatch.setattr(config, "CLUSTER_CHROMA_MAX_EMBEDDINGS", 4)
+    rng = np.random.default_rng(0)
+    vector_db = EmbeddedChromaDB()
+    vector_db.store_embeddings(
+        [ImageEmbedding(embedding=rng.normal(size=2048).tolist(), filename=f"{i}.jpg") for i in range(4)]
+    )
+    filenames = [filename for block, _ in vector_db.iter_embedding_blocks(3) for filename in block]
+    assert sorted(filenames) == [f"{i}.jpg" for i in range(4)]
+
+    # reading the collection with offset pages takes quadratic time, so larger collections aren't clustered
+    vector_db.store_embeddings([ImageEmbedding(embedding=rng.normal(size=2048).tolist(), filename="4.jpg")])
+    with pytest.raises(ValueError, match="CLUSTER_CHROMA_MAX_EMBEDDINGS"):
+        ClusterService(vector_db, block_size=3, num_workers=1).find_clusters(threshold=0.1)
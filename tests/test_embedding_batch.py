@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from bube.models import EmbeddingBatch, ImageEmbedding
+
+
+def test_embedding_batch():
+    embeddings = np.arange(12, dtype=np.float64).reshape(3, 4)
+    batch = EmbeddingBatch(["a.jpg", "b.jpg", "c.jpg"], embeddings)
+    assert batch.embeddings.dtype == np.float32
+    assert batch.embeddings.flags.c_contiguous
+
+    # records and slices are views of the matrix
+    assert [record.filename for record in batch] == batch.filenames
+    assert np.shares_memory(batch[1].embedding, batch.embeddings)
+    assert batch[1:].filenames == ["b.jpg", "c.jpg"]
+    assert np.shares_memory(batch[1:].embeddings, batch.embeddings)
+
+    image_embeddings = batch.to_image_embeddings()
+    assert image_embeddings[2] == ImageEmbedding(embedding=[8.0, 9.0, 10.0, 11.0], filename="c.jpg")
+    converted = EmbeddingBatch.of(image_embeddings)
+    assert EmbeddingBatch.of(converted) is converted
+    assert np.array_equal(converted.embeddings, batch.embeddings)
+
+    joined = EmbeddingBatch.concatenate([batch[:1], EmbeddingBatch.from_pairs([]), batch[2:]])
+    assert joined.filenames == ["a.jpg", "c.jpg"]
+    assert len(EmbeddingBatch.concatenate([])) == 0
+    with pytest.raises(ValueError):
+        EmbeddingBatch(["a.jpg"], embeddings)
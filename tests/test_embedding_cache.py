@@ -0,0 +1,40 @@
+import numpy as np
+
+from bube.services.embedding_cache import EmbeddingCache
+
+
+def test_embedding_cache_deduplicates_and_reuses_embeddings():
+    cache = EmbeddingCache()
+    contents = [b"image-a", b"image-b", b"image-a", b"image-c"]
+    keys = [cache.hash_bytes(content) for content in contents]
+    requested_positions = []
+
+    def embed_missing(positions):
+        requested_positions.append(positions)
+        return {position: np.full(2048, position, dtype=np.float32) for position in positions}
+
+    embeddings = cache.get_embeddings(keys, embed_missing)
+
+    # identical contents are only embedded once and share the embedding
+    assert requested_positions == [[0, 1, 3]]
+    assert np.array_equal(embeddings[0], embeddings[2])
+    assert not np.array_equal(embeddings[0], embeddings[1])
+
+    # a second request with a known and a new image only embeds the new image
+    stats_before = cache.get_stats()
+    embeddings = cache.get_embeddings([keys[1], cache.hash_bytes(b"image-d")], embed_missing)
+    assert requested_positions[-1] == [1]
+    assert np.array_equal(embeddings[0], np.full(2048, 1, dtype=np.float32))
+    assert cache.get_stats()["hits"] == stats_before["hits"] + 1
+
+
+def test_embedding_cache_skips_failed_images():
+    cache = EmbeddingCache()
+    keys = [cache.hash_bytes(b"readable"), cache.hash_bytes(b"broken")]
+
+    embeddings = cache.get_embeddings(keys, lambda positions: {0: np.zeros(2048, dtype=np.float32)})
+
+    assert embeddings[0] is not None
+    assert embeddings[1] is None
+    # failed images are not cached and are tried again with the next request
+    assert cache.get(keys[1]) is None
@@ -0,0 +1,64 @@
+import base64
+import importlib.resources as impresources
+import io
+
+import numpy as np
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from bube.routers import EmbeddingController
+from bube.routers.embedding_formats import BASE64_MEDIA_TYPE, NPY_MEDIA_TYPE, EmbeddingFormat
+
+app = FastAPI()
+app.include_router(EmbeddingController().router)
+test_client = TestClient(app)
+
+image_root = str(impresources.files("tests") / "test_assets")
+filenames_assets = ["feex_check001.jpg", "feex_check002.jpg"]
+
+
+def test_accept_header_negotiation():
+    assert EmbeddingFormat.from_accept_header(None) == EmbeddingFormat()
+    assert EmbeddingFormat.from_accept_header("text/html, */*;q=0.8") == EmbeddingFormat()
+    assert EmbeddingFormat.from_accept_header(f"application/json;q=0.5, {NPY_MEDIA_TYPE}; dtype=float16") == (
+        EmbeddingFormat(NPY_MEDIA_TYPE, "float16")
+    )
+    assert EmbeddingFormat.from_accept_header(BASE64_MEDIA_TYPE) == EmbeddingFormat(BASE64_MEDIA_TYPE, "float32")
+    with pytest.raises(HTTPException):
+        EmbeddingFormat.from_accept_header("application/x-msgpack")
+    with pytest.raises(HTTPException):
+        EmbeddingFormat.from_accept_header(f"{NPY_MEDIA_TYPE}; dtype=int8")
+
+
+def get_embeddings(accept: str, status_code: int = 200):
+    params = {"image_root": image_root, "filenames": filenames_assets}
+    response = test_client.get("/embeddings/local", params=params, headers={"Accept": accept})
+    assert response.status_code == status_code
+    return response
+
+
+def test_embedding_formats():
+    json_response = get_embeddings("application/json")
+    assert json_response.headers["content-type"] == "application/json"
+    filenames = [data["filename"] for data in json_response.json()]
+    embeddings = np.asarray([data["embedding"] for data in json_response.json()], dtype=np.float32)
+    assert embeddings.shape == (2, 2048)
+
+    for dtype in ("float32", "float16"):
+        base64_response = get_embeddings(f"{BASE64_MEDIA_TYPE}; dtype={dtype}")
+        assert base64_response.headers["content-type"] == f"{BASE64_MEDIA_TYPE}; dtype={dtype}"
+        assert [data["filename"] for data in base64_response.json()] == filenames
+        base64_embeddings = np.asarray(
+            [np.frombuffer(base64.b64decode(data["embedding"]), dtype=dtype) for data in base64_response.json()]
+        )
+        assert np.array_equal(base64_embeddings, embeddings.astype(dtype))
+
+        npy_response = get_embeddings(f"{NPY_MEDIA_TYPE}; dtype={dtype}")
+        records = np.load(io.BytesIO(npy_response.content), allow_pickle=False)
+        assert records["filename"].tolist() == filenames
+        assert np.array_equal(records["embedding"], embeddings.astype(dtype))
+        # only the header and the filenames are added to the raw values
+        assert len(npy_response.content) < embeddings.size * np.dtype(dtype).itemsize + 1024
+
+    get_embeddings("application/x-msgpack", status_code=406)
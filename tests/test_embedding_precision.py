@@ -0,0 +1,35 @@
+import importlib.resources as impresources
+from pathlib import Path
+
+import numpy as np
+
+from bube.models import classify_distance
+from bube.services.image_embedding_model import ImageEmbeddingModel
+from bube.services.local_image_service import LocalImgReader
+
+asset_path = str(impresources.files("tests") / "test_assets")
+# originals and variants, which are classified as duplicates, suspicious or different files
+variants = ["", "_blur", "_crop", "_duplicate", "_grayscale", "_resize_small"]
+filenames_assets = [
+    f"feex_check00{i}{variant}.jpg"
+    for i in range(1, 3)
+    for variant in variants
+    if (Path(asset_path) / f"feex_check00{i}{variant}.jpg").exists()
+]
+
+
+def test_half_precision_storage_keeps_classification():
+    model = ImageEmbeddingModel()
+    embeddings = []
+    for batch, _ in LocalImgReader(image_root=asset_path, filenames=filenames_assets, max_batch_size=1):
+        embeddings.append(model.compute_embedding_batch(batch)[0])
+    embeddings = np.stack(embeddings).astype(np.float32)
+    # halfvec columns store float16, the distance to the float32 search embedding is computed after casting back
+    stored_embeddings = embeddings.astype(np.float16).astype(np.float32)
+
+    # halfvec is only used by pgvector, which compares the L2 distance with the thresholds
+    for search_embedding in embeddings:
+        distances = np.linalg.norm(embeddings - search_embedding, axis=1)
+        half_precision_distances = np.linalg.norm(stored_embeddings - search_embedding, axis=1)
+        assert np.abs(distances - half_precision_distances).max() < 1e-3
+        assert [classify_distance(d) for d in distances] == [classify_distance(d) for d in half_precision_distances]
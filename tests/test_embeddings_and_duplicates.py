@@ -110,3 +110,9 @@ def check_if_embeddings_match(emb1: list[float], emb2: list[float]):
     if len(emb1) != len(emb2):
         return False
     return all(value1 == value2 for value1, value2 in zip(emb1, emb2))
+
+
+def test_feex_health():
+    response = test_client.get("/feex/health")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
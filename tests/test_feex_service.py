@@ -0,0 +1,70 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from bube.config import config
+from bube.execution import run_staged_in_pools
+from bube.models import EmbeddingBatch
+from bube.services import FEEXService
+
+
+def create_unit_embedding(rng, base=None, noise=1.0):
+    embedding = rng.normal(size=2048) * noise
+    if base is not None:
+        embedding += base
+    return embedding / np.linalg.norm(embedding)
+
+
+def test_duplicates_within_request(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DB_TYPE", "numpy")
+    monkeypatch.setattr(config, "NUMPY_DB_PATH", str(tmp_path))
+    feex_service = FEEXService()
+    rng = np.random.default_rng(0)
+    original = create_unit_embedding(rng)
+    other = create_unit_embedding(rng)
+    feex_service.store_image_embeddings(EmbeddingBatch(["stored.jpg"], [create_unit_embedding(rng, other, 0.002)]))
+
+    image_embeddings = EmbeddingBatch(
+        ["original.jpg", "copy.jpg", "other.jpg"], [original, create_unit_embedding(rng, original, 0.002), other]
+    )
+    reports = feex_service.create_duplicate_reports(image_embeddings)
+    assert [file.filename for file in reports[0].duplicates.filenames] == ["copy.jpg"]
+    assert [file.filename for file in reports[1].duplicates.filenames] == ["original.jpg"]
+    # duplicates from the database and the request are reported together
+    assert [file.filename for file in reports[2].duplicates.filenames] == ["stored.jpg"]
+
+    embeddings = image_embeddings.embeddings
+    distances = ((embeddings[:, np.newaxis] - embeddings[np.newaxis]) ** 2).sum(axis=-1)
+    assert np.allclose(feex_service._FEEXService__vector_db.pairwise_distances(embeddings), distances, atol=1e-5)
+
+
+def test_check_duplicate_stages_run_in_their_pools(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DB_TYPE", "numpy")
+    monkeypatch.setattr(config, "NUMPY_DB_PATH", str(tmp_path))
+    feex_service = FEEXService()
+    rng = np.random.default_rng(0)
+    image_embeddings = EmbeddingBatch(["a.jpg", "b.jpg"], [create_unit_embedding(rng), create_unit_embedding(rng)])
+    threads = {}
+
+    def record_thread(name, result=None):
+        def stage(*_args, **_kwargs):
+            threads[name] = threading.current_thread().name
+            return result
+
+        return stage
+
+    monkeypatch.setattr(feex_service, "embed_local_images", record_thread("embed", image_embeddings))
+    monkeypatch.setattr(feex_service, "create_duplicate_reports", record_thread("report", ["report"]))
+    monkeypatch.setattr(feex_service, "store_image_embeddings", record_thread("store"))
+
+    reports = asyncio.run(run_staged_in_pools(feex_service.check_duplicate_stages(image_root="root")))
+    assert reports == ["report"]
+    assert threads["embed"].startswith("bube-inference")
+    assert threads["report"].startswith("bube-db")
+    assert threads["store"].startswith("bube-db")
+
+    # the synchronous call runs the same stages in the calling thread, without storing if requested
+    threads.clear()
+    assert feex_service.check_duplicate(image_root="root", save_embeddings=False) == ["report"]
+    assert threads == {"embed": threading.current_thread().name, "report": threading.current_thread().name}
@@ -0,0 +1,64 @@
+import importlib.resources as impresources
+import os
+import shutil
+
+import pytest
+
+from bube.config import config
+from bube.repository import NumpyVectorDB
+from bube.services.ingest_service import IngestService
+from bube.services.local_image_service import ImageManifest
+
+asset_path = str(impresources.files("tests") / "test_assets")
+filenames_assets = ["feex_check001_resize_small.jpg", "feex_check001_resize.jpg", "feex_check002_resize.jpg"]
+
+
+class CrashingVectorDB(NumpyVectorDB):
+    """Database which fails after the first upsert, like a crash in the middle of an ingest run."""
+
+    num_stores = 0
+
+    def store_embeddings(self, image_embeddings):
+        self.num_stores += 1
+        if self.num_stores > 1:
+            raise RuntimeError("crash")
+        super().store_embeddings(image_embeddings)
+
+
+def get_stored_filenames(vector_db: NumpyVectorDB) -> set[str]:
+    return {filename for filenames, _ in vector_db.iter_embedding_blocks(block_size=100) for filename in filenames}
+
+
+def test_ingest_resumes_after_crash(tmp_path, monkeypatch):
+    image_root = tmp_path / "images"
+    (image_root / "case_1").mkdir(parents=True)
+    for filename in filenames_assets:
+        shutil.copy(os.path.join(asset_path, filename), image_root / "case_1" / filename)
+    monkeypatch.setattr(config, "LOCAL_IMAGE_MANIFEST_PATH", str(tmp_path / "manifests"))
+    monkeypatch.setattr(config, "NUMPY_DB_PATH", str(tmp_path / "db"))
+
+    with pytest.raises(RuntimeError):
+        IngestService(CrashingVectorDB(), checkpoint_size=1).ingest(str(image_root))
+    num_stored = len(get_stored_filenames(NumpyVectorDB()))
+    assert 0 < num_stored < 3
+
+    # the resumed run only embeds the images which weren't stored before the crash
+    vector_db = NumpyVectorDB()
+    stats = IngestService(vector_db, checkpoint_size=1).ingest(str(image_root))
+    assert (stats.discovered, stats.skipped) == (3, num_stored)
+    assert stats.embedded == stats.stored == 3 - num_stored
+    assert "images/s" in stats.summary()
+
+    # the manifest only keeps the state of the files, so the indexing of the local image service embeds them again
+    manifest = ImageManifest(str(image_root), manifest_dir=config.LOCAL_IMAGE_MANIFEST_PATH)
+    image_paths = sorted(get_stored_filenames(vector_db))
+    assert len(manifest.diff(image_paths, load_embeddings=False).unchanged) == 3
+    assert len(manifest.diff(image_paths).changed) == 3
+
+    # deleted images are removed from the database as well
+    os.remove(image_root / "case_1" / "feex_check001_resize.jpg")
+    stats = IngestService(vector_db).ingest(str(image_root), prune_deleted=True)
+    assert (stats.skipped, stats.embedded, stats.deleted) == (2, 0, 1)
+    assert get_stored_filenames(vector_db) == {
+        str(image_root / "case_1" / filename) for filename in filenames_assets if filename != "feex_check001_resize.jpg"
+    }
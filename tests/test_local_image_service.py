@@ -1,8 +1,12 @@
 import importlib.resources as impresources
+import os
+import shutil
 
 import numpy as np
+from PIL import Image
 
-from bube.services.local_image_service import LocalImageService, LocalImgReader
+from bube.config import config
+from bube.services.local_image_service import LocalImageService, LocalImgReader, StreamingImgReader, local_image_service
 
 asset_path = str(impresources.files("tests") / "test_assets")
 filenames_assets = [f"feex_check00{i}.jpg" for i in range(1, 6)]
@@ -44,7 +48,149 @@ def test_local_image_service():
     assert len(embeddings) == len(filenames_assets)
 
     for embedding in embeddings:
-        # embedding should be list[float] with length 2048
-        assert isinstance(embedding.embedding, list)
-        assert len(embedding.embedding) == 2048
+        # embedding should be a float32 array with length 2048
+        assert isinstance(embedding.embedding, np.ndarray)
+        assert embedding.embedding.shape == (2048,)
         assert isinstance(embedding.filename, str)
+
+
+
+def test_local_image_reader_pixel_budget():
+    # a budget of one 12 MP photo (4032x3024) results in one photo per batch
+    photos = ["feex_check001.jpg", "feex_check001_blur.jpg", "feex_check001_duplicate.jpg", "feex_check002.jpg"]
+    reader = LocalImgReader(image_root=asset_path, filenames=photos, max_batch_pixels=4032 * 3024)
+    assert len(reader) == len(photos)
+
+    # thumbnails are packed into a single batch with the same budget
+    reader = LocalImgReader(image_root=asset_path, filenames=["feex_check001_resize_small.jpg"] * 8,
+                            max_batch_pixels=4032 * 3024)
+    assert len(reader) == 1
+
+
+def test_local_image_reader_max_side():
+    # the photos have 4032x3024 pixels, rotated photos 3024x4032
+    reader = LocalImgReader(image_root=asset_path, filenames=["feex_check001.jpg", "feex_check001_rotate.jpg"],
+                            max_side=1024)
+    shapes = sorted(img.shape for img, _ in reader)
+    assert shapes == [(1, 768, 1024, 3), (1, 1024, 768, 3)]
+
+
+def test_local_image_service_manifest(tmp_path, monkeypatch):
+    image_root = tmp_path / "images"
+    image_root.mkdir()
+    for filename in ["feex_check001_resize_small.jpg", "feex_check001_resize.jpg", "feex_check002_resize.jpg"]:
+        shutil.copy(os.path.join(asset_path, filename), image_root / filename)
+    monkeypatch.setattr(config, "LOCAL_IMAGE_MANIFEST_PATH", str(tmp_path / "manifests"))
+    service = LocalImageService()
+
+    # first run embeds all images
+    index_result = service.index_local_images(image_root=str(image_root))
+    assert (len(index_result.changed), len(index_result.unchanged)) == (3, 0)
+    service.commit_index(index_result)
+
+    # a re-run after changing one image and deleting another only embeds the changed image
+    shutil.copy(os.path.join(asset_path, "feex_check002_crop.jpg"), image_root / "feex_check002_resize.jpg")
+    os.remove(image_root / "feex_check001_resize.jpg")
+    index_result = service.index_local_images(image_root=str(image_root), find_deleted=True)
+    assert [embedding.filename for embedding in index_result.changed] == [str(image_root / "feex_check002_resize.jpg")]
+    assert [embedding.filename for embedding in index_result.unchanged] == [
+        str(image_root / "feex_check001_resize_small.jpg")
+    ]
+    assert index_result.deleted == [str(image_root / "feex_check001_resize.jpg")]
+    assert len(index_result.unchanged[0].embedding) == 2048
+    service.commit_index(index_result)
+
+    index_result = service.index_local_images(image_root=str(image_root), find_deleted=True)
+    assert (len(index_result.changed), len(index_result.unchanged), len(index_result.deleted)) == (0, 2, 0)
+
+
+def test_local_image_service_embed_does_not_commit_manifest(tmp_path, monkeypatch):
+    filenames = ["feex_check002_resize.jpg", "feex_check001_resize_small.jpg", "feex_check001_resize.jpg"]
+    monkeypatch.setattr(config, "LOCAL_IMAGE_MANIFEST_ENABLED", True)
+    monkeypatch.setattr(config, "LOCAL_IMAGE_MANIFEST_PATH", str(tmp_path / "manifests"))
+    service = LocalImageService()
+    service.commit_index(service.index_local_images(image_root=asset_path, filenames=filenames[1:2]))
+
+    # the embeddings keep the requested order, although one image is taken from the manifest
+    embeddings = service.embed_local_images(image_root=asset_path, filenames=filenames)
+    assert embeddings.filenames == [os.path.join(asset_path, filename) for filename in filenames]
+
+    # nothing was stored in the database, so the other images are still new for the next insert
+    index_result = service.index_local_images(image_root=asset_path, filenames=filenames)
+    assert (len(index_result.changed), len(index_result.unchanged)) == (2, 1)
+
+
+def test_local_image_service_cache_lookup_is_streamed(tmp_path, monkeypatch):
+    rng = np.random.default_rng()
+    for i in range(5):
+        Image.fromarray(rng.integers(0, 256, size=(32, 48, 3), dtype=np.uint8)).save(tmp_path / f"{i}.png")
+    monkeypatch.setattr(config, "EMBEDDING_CACHE_ENABLED", True)
+    monkeypatch.setattr(local_image_service, "CACHE_CHUNK_SIZE", 2)
+    events = []
+
+    def iter_image_files(image_root):
+        for filename in sorted(os.listdir(image_root)):
+            events.append("discovered")
+            yield os.path.join(image_root, filename)
+
+    monkeypatch.setattr(LocalImgReader, "iter_image_files", iter_image_files)
+    service = LocalImageService()
+    embed_files = service._embed_files
+    monkeypatch.setattr(service, "_embed_files", lambda paths: events.append(len(paths)) or embed_files(paths))
+
+    # the first chunk is hashed and embedded before the image root is scanned completely
+    embeddings = service.embed_local_images(image_root=str(tmp_path))
+    assert len(embeddings) == 5
+    assert events == ["discovered", "discovered", 2, "discovered", "discovered", 2, "discovered", 1]
+
+
+def test_local_image_reader_recursive_discovery(tmp_path):
+    (tmp_path / "case_1" / "photos").mkdir(parents=True)
+    for path in ["a.jpg", "case_1/b.JPEG", "case_1/photos/c.png", "case_1/notes.txt"]:
+        (tmp_path / path).touch()
+
+    image_paths = LocalImgReader.get_image_paths(image_root=str(tmp_path), all_img_files=True)
+    assert sorted(image_paths) == sorted(
+        str(tmp_path / path) for path in ["a.jpg", "case_1/b.JPEG", "case_1/photos/c.png"]
+    )
+    assert LocalImgReader.get_image_paths(image_root=str(tmp_path), all_img_files=True, recursive=False) == [
+        str(tmp_path / "a.jpg")
+    ]
+
+
+def test_streaming_image_reader():
+    small_images = ["feex_check001_resize_small.jpg", "feex_check001_resize.jpg", "feex_check002_resize.jpg"] * 3
+    image_paths = LocalImgReader.get_image_paths(image_root=asset_path, filenames=small_images)
+    reader = LocalImgReader(filenames=image_paths, max_batch_size=2)
+    expected_images = {}
+    for batch, filenames in reader:
+        expected_images.update(zip(filenames, batch))
+
+    # batches are emitted while the paths are consumed, but contain the same images as the batches of the reader
+    num_images = 0
+    for batch, filenames in StreamingImgReader(iter(image_paths), max_batch_size=2, probe_workers=2):
+        assert len(filenames) <= 2
+        for filename, img in zip(filenames, batch):
+            assert np.array_equal(img, expected_images[filename])
+        num_images += len(filenames)
+    assert num_images == len(image_paths)
+
+
+def test_streaming_image_reader_prefetch_bound(monkeypatch):
+    image_paths = LocalImgReader.get_image_paths(image_root=asset_path, filenames=filenames_assets)
+    reader = StreamingImgReader(image_paths, max_batch_size=1, num_workers=2, prefetch_batches=2)
+    submitted = []
+    submit_images = reader._batcher.submit_images
+
+    def record_submit(pool, filenames, resolution):
+        submitted.append(filenames)
+        return submit_images(pool, filenames, resolution)
+
+    monkeypatch.setattr(reader._batcher, "submit_images", record_submit)
+
+    # while the caller holds a batch, at most `prefetch_batches` further batches are allocated
+    num_yielded = 0
+    for num_yielded, _ in enumerate(reader, start=1):
+        assert len(submitted) - num_yielded <= 2
+    assert num_yielded > 2
+    assert len(submitted) == num_yielded
@@ -0,0 +1,56 @@
+import importlib.resources as impresources
+import shutil
+
+import numpy as np
+import pytest
+
+from bube.config import config
+from bube.services.image_embedding_model import ImageEmbeddingModel, decode_img
+from bube.services.image_embedding_model.image_embedding_model import get_uint8_model_path
+
+onnx = pytest.importorskip("onnx")
+from bube.services.image_embedding_model.model_export import export_uint8_model  # noqa: E402
+
+asset_path = impresources.files("tests") / "test_assets"
+filenames_assets = ["feex_check001_resize_small.jpg", "feex_check001_resize.jpg", "feex_check002_resize.jpg"]
+
+
+def load_model(monkeypatch, model_path: str, uint8_input: bool) -> ImageEmbeddingModel:
+    # a new instance of the singleton, the shared instance is restored after the test
+    monkeypatch.setattr(ImageEmbeddingModel, "_instance", None)
+    monkeypatch.setattr(config, "MODEL_UINT8_INPUT", uint8_input)
+    return ImageEmbeddingModel(model_path=model_path)
+
+
+def test_uint8_model_matches_float_model(tmp_path, monkeypatch):
+    model_path = str(tmp_path / "model.onnx")
+    shutil.copy(ImageEmbeddingModel.default_model_path(), model_path)
+    assert export_uint8_model(model_path) == get_uint8_model_path(model_path)
+
+    float_model = load_model(monkeypatch, model_path, uint8_input=False)
+    uint8_model = load_model(monkeypatch, model_path, uint8_input=True)
+    assert not float_model.uint8_input
+    assert uint8_model.uint8_input
+    assert uint8_model.model_fingerprint == float_model.model_fingerprint
+
+    for filename in filenames_assets:
+        img = decode_img(str(asset_path / filename), max_side=512)
+        assert img.dtype == np.uint8
+        float_embedding = float_model.compute_embedding_single(img)
+        assert np.allclose(uint8_model.compute_embedding_single(img), float_embedding, atol=1e-5)
+        # the input of the float path is not changed by the preprocessing
+        assert np.array_equal(img, decode_img(str(asset_path / filename), max_side=512))
+        # float images are rounded to uint8 for the variant
+        assert np.allclose(uint8_model.compute_embedding_single(img.astype(np.float32)), float_embedding, atol=1e-5)
+
+
+def test_outdated_uint8_model_is_ignored(tmp_path, monkeypatch):
+    model_path = str(tmp_path / "model.onnx")
+    shutil.copy(ImageEmbeddingModel.default_model_path(), model_path)
+    export_uint8_model(model_path)
+    # the model is exchanged by a new version after the export
+    model = onnx.load(model_path)
+    model.doc_string = "new version"
+    onnx.save(model, model_path)
+
+    assert not load_model(monkeypatch, model_path, uint8_input=True).uint8_input
@@ -0,0 +1,48 @@
+import importlib.resources as impresources
+import shutil
+
+import pytest
+
+from bube.config import config
+from bube.services.image_embedding_model import ImageEmbeddingModel
+from bube.services.image_embedding_model.image_embedding_model import get_model_fingerprint
+
+pytest.importorskip("onnx")
+from bube.services.image_embedding_model.model_quantization import evaluate_accuracy, quantize_model  # noqa: E402
+
+asset_path = impresources.files("tests") / "test_assets"
+image_paths = sorted(
+    str(path) for path in asset_path.iterdir() if path.name.startswith(("feex_check001", "feex_check002"))
+)
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    model_path = str(tmp_path / "model.onnx")
+    shutil.copy(ImageEmbeddingModel.default_model_path(), model_path)
+    return model_path
+
+
+@pytest.mark.parametrize("precision", ["fp16", "int8"])
+def test_quantized_model_passes_accuracy_gate(model_path, precision):
+    variant_path = quantize_model(model_path, precision, calibration_images=image_paths[::4], max_side=256)
+    report = evaluate_accuracy(model_path, variant_path, image_paths, max_side=256)
+    assert report.num_pairs == len(image_paths) * (len(image_paths) - 1) // 2
+    assert report.passed(), report.summary()
+
+
+def test_model_loads_variant_of_precision(model_path, monkeypatch):
+    monkeypatch.setattr(ImageEmbeddingModel, "_instance", None)
+    monkeypatch.setattr(config, "MODEL_PRECISION", "fp16")
+    with pytest.raises(FileNotFoundError):
+        ImageEmbeddingModel(model_path=model_path)
+
+    variant_path = quantize_model(model_path, "fp16")
+    model = ImageEmbeddingModel(model_path=model_path)
+    # cached embeddings of the float32 model are not reused
+    assert model.model_fingerprint == get_model_fingerprint(variant_path) != get_model_fingerprint(model_path)
+
+
+def test_static_quantization_requires_calibration_images(model_path):
+    with pytest.raises(ValueError, match="calibration"):
+        quantize_model(model_path, "int8")
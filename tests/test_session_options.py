@@ -0,0 +1,59 @@
+import numpy as np
+import onnxruntime as ort
+import pytest
+
+from bube.config import config
+from bube.services.image_embedding_model import ImageEmbeddingModel
+from bube.services.image_embedding_model.image_embedding_model import create_session_options
+
+
+def load_model(monkeypatch) -> ImageEmbeddingModel:
+    # a new instance of the singleton, the shared instance is restored after the test
+    monkeypatch.setattr(ImageEmbeddingModel, "_instance", None)
+    return ImageEmbeddingModel()
+
+
+def test_session_options_from_config(monkeypatch):
+    monkeypatch.setattr(config, "ORT_INTRA_OP_NUM_THREADS", 2)
+    monkeypatch.setattr(config, "ORT_EXECUTION_MODE", "parallel")
+    monkeypatch.setattr(config, "ORT_ENABLE_CPU_MEM_ARENA", False)
+    session_options = create_session_options(graph_optimization_level="basic")
+    assert session_options.intra_op_num_threads == 2
+    assert session_options.execution_mode == ort.ExecutionMode.ORT_PARALLEL
+    assert session_options.graph_optimization_level == ort.GraphOptimizationLevel.ORT_ENABLE_BASIC
+    assert not session_options.enable_cpu_mem_arena
+
+
+def test_optimized_model_is_reused(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "ORT_OPTIMIZED_MODEL_DIR", str(tmp_path))
+    img = np.random.default_rng(0).integers(0, 256, size=(64, 96, 3), dtype=np.uint8)
+
+    embedding = load_model(monkeypatch).compute_embedding_single(img)
+    optimized_models = list(tmp_path.iterdir())
+    assert len(optimized_models) == 1
+    modified = optimized_models[0].stat().st_mtime_ns
+
+    # the second start loads the saved model instead of optimizing the graph again
+    assert np.allclose(load_model(monkeypatch).compute_embedding_single(img), embedding, atol=1e-6)
+    assert list(tmp_path.iterdir()) == optimized_models
+    assert optimized_models[0].stat().st_mtime_ns == modified
+
+    # a different optimization level is saved as separate model
+    monkeypatch.setattr(config, "ORT_GRAPH_OPTIMIZATION_LEVEL", "basic")
+    load_model(monkeypatch)
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_optimized_model_is_portable(tmp_path, monkeypatch):
+    onnx = pytest.importorskip("onnx")
+    monkeypatch.setattr(config, "ORT_OPTIMIZED_MODEL_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "ORT_GRAPH_OPTIMIZATION_LEVEL", "all")
+    load_model(monkeypatch)
+
+    # the saved graph contains no kernels for the instruction set of this CPU (NCHWc layout), the level `all` is only
+    # applied when the graph is loaded, so the same file is used with the level `extended`
+    (optimized_model,) = tmp_path.iterdir()
+    assert "com.microsoft.nchwc" not in {node.domain for node in onnx.load(str(optimized_model)).graph.node}
+    monkeypatch.setattr(config, "ORT_GRAPH_OPTIMIZATION_LEVEL", "extended")
+    load_model(monkeypatch)
+    assert list(tmp_path.iterdir()) == [optimized_model]
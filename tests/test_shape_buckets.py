@@ -0,0 +1,67 @@
+import importlib.resources as impresources
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from bube.models import classify_distance
+from bube.services.image_embedding_model import ImageEmbeddingModel
+from bube.services.local_image_service import LocalImgReader
+
+asset_path = str(impresources.files("tests") / "test_assets")
+# the variants cover all resolutions of the test assets: photos, crops, rotations and resized images
+variants = ["", "_crop", "_random_rotate", "_resize", "_resize_small", "_rotate"]
+filenames_assets = [
+    f"feex_check00{i}{variant}.jpg"
+    for i in range(1, 6)
+    for variant in variants
+    if (Path(asset_path) / f"feex_check00{i}{variant}.jpg").exists()
+]
+
+SHAPE_BUCKET_SIZE = 64
+# maximum distance between the padded and the unpadded embedding of an image
+MAX_PADDING_DISTANCE = 0.05
+
+
+def embed(filename: str, shape_bucket_size: int | None) -> np.ndarray:
+    reader = LocalImgReader(image_root=asset_path, filenames=[filename], shape_bucket_size=shape_bucket_size)
+    batch, _ = reader[0]
+    return ImageEmbeddingModel().compute_embedding_batch(batch)[0]
+
+
+@pytest.mark.parametrize("filename", filenames_assets)
+def test_padded_embedding_matches_unpadded(filename):
+    original = f"{filename[:13]}.jpg"
+    if not (Path(asset_path) / original).exists():
+        pytest.skip(f"original image {original} is not part of the test assets")
+
+    embedding = embed(filename, shape_bucket_size=None)
+    padded_embedding = embed(filename, shape_bucket_size=SHAPE_BUCKET_SIZE)
+    assert np.linalg.norm(embedding - padded_embedding) < MAX_PADDING_DISTANCE
+
+    # the padding must not change the classification against the original image (squared L2, like the database)
+    original_embedding = embed(original, shape_bucket_size=None)
+    distance = float(np.sum((embedding - original_embedding) ** 2))
+    padded_distance = float(np.sum((padded_embedding - original_embedding) ** 2))
+    assert classify_distance(distance) == classify_distance(padded_distance)
+
+
+def test_shape_buckets_reduce_number_of_batches(tmp_path):
+    # the resolutions of the test assets differ too much to share buckets, so resized copies with close resolutions
+    # are used: three resolutions, which all fall into the 512x384 bucket, and one in another bucket
+    resolutions = [(500, 370), (505, 380), (512, 384), (300, 200)]
+    with Image.open(Path(asset_path) / "feex_check001.jpg") as img:
+        for width, height in resolutions:
+            img.resize((width, height)).save(tmp_path / f"{width}x{height}.jpg")
+
+    reader = LocalImgReader(image_root=str(tmp_path), all_img_files=True, max_batch_size=100)
+    bucket_reader = LocalImgReader(
+        image_root=str(tmp_path), all_img_files=True, max_batch_size=100, shape_bucket_size=SHAPE_BUCKET_SIZE
+    )
+    assert len(reader) == 4
+    assert len(bucket_reader) == 2
+    for index in range(len(bucket_reader)):
+        _, height, width, _ = bucket_reader._get_batch_shape(index)
+        assert height % SHAPE_BUCKET_SIZE == 0
+        assert width % SHAPE_BUCKET_SIZE == 0
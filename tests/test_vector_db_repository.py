@@ -0,0 +1,427 @@
+import logging
+import threading
+from typing import Optional
+
+import numpy as np
+import psycopg2
+import pytest
+from psycopg2 import sql as pgsql
+
+from bube.config import config
+from bube.models import ImageEmbedding
+from bube.repository import EmbeddedChromaDB, EmbeddingProjection, IvfPqVectorDB, NumpyVectorDB, PgVector, ivfpq_vector_db
+
+
+def create_embeddings(num_embeddings: int, seed: int, prefix: str) -> list[ImageEmbedding]:
+    rng = np.random.default_rng(seed)
+    embeddings = rng.random((num_embeddings, 2048), dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return [ImageEmbedding(embedding=emb.tolist(), filename=f"{prefix}_{i}.jpg") for i, emb in enumerate(embeddings)]
+
+
+def test_chroma_neighbours_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CHROMA_DB_MODE", "embedded")
+    monkeypatch.setattr(config, "CHROMA_DB_EMBEDDED_PATH", str(tmp_path))
+    vector_db = EmbeddedChromaDB()
+    vector_db.store_embeddings(create_embeddings(20, seed=0, prefix="stored"))
+    search_embeddings = create_embeddings(5, seed=1, prefix="search")
+
+    # a single batched query returns the same neighbours as one query per embedding
+    neighbours_batch = vector_db.get_neighbours_batch(search_embeddings, threshold=0.5, limit=10)
+    assert len(neighbours_batch) == len(search_embeddings)
+    for search_embedding, neighbours in zip(search_embeddings, neighbours_batch):
+        expected = vector_db.get_neighbours(search_embedding, threshold=0.5, limit=10)
+        assert [n.filename for n in neighbours] == [n.filename for n in expected]
+        assert all(neighbour.distance <= 0.5 for neighbour in neighbours)
+
+    assert vector_db.get_neighbours_batch([]) == []
+
+
+def test_chroma_neighbours_include_embeddings(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CHROMA_DB_MODE", "embedded")
+    monkeypatch.setattr(config, "CHROMA_DB_EMBEDDED_PATH", str(tmp_path))
+    vector_db = EmbeddedChromaDB()
+    stored_embeddings = create_embeddings(3, seed=0, prefix="stored")
+    vector_db.store_embeddings(stored_embeddings)
+
+    # only filename and distance are returned by default
+    neighbours = vector_db.get_neighbours_top_n(stored_embeddings[0], limit=3)
+    assert neighbours[0].filename == "stored_0.jpg"
+    assert all(neighbour.embedding is None for neighbour in neighbours)
+
+    neighbours = vector_db.get_neighbours_top_n(stored_embeddings[0], limit=3, include_embeddings=True)
+    assert np.allclose(neighbours[0].embedding, stored_embeddings[0].embedding)
+
+
+def test_pgvector_binary_vector_format():
+    embedding = np.random.default_rng(0).random(2048, dtype=np.float32)
+    # binary format of pgvector: dimensions and an unused field as int16, followed by big-endian float32 values
+    data = np.array([2048, 0], dtype=">i2").tobytes() + embedding.astype(">f4").tobytes()
+    assert np.array_equal(PgVector._decode_vector(memoryview(data)), embedding)
+
+
+class FakeConnection:
+    def __init__(self, broken: bool, cursor: Optional["FakeCursor"] = None):
+        self.broken = broken
+        # psycopg2 marks connections, which were closed by the server, as closed
+        self.closed = 2 if broken else 0
+        self.autocommit = False
+        self.commits = 0
+        self._cursor = cursor or FakeCursor()
+
+    def cursor(self):
+        if self.broken:
+            raise psycopg2.InterfaceError("connection already closed")
+        return self._cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, rows: Optional[list[tuple]] = None):
+        self.rows = rows or []
+        self.queries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, parameters=None):
+        self.queries.append((query_text(query), parameters))
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0]
+
+
+def query_text(query: str | pgsql.Composable) -> str:
+    """Render a query without a database connection, identifiers are quoted and literals inserted as is."""
+    if isinstance(query, str):
+        return query
+    if isinstance(query, pgsql.Composed):
+        return "".join(query_text(part) for part in query.seq)
+    if isinstance(query, pgsql.Identifier):
+        return ".".join(f'"{name}"' for name in query.strings)
+    if isinstance(query, pgsql.Literal):
+        return str(query.wrapped)
+    return query.string
+
+
+class FakePool:
+    def __init__(self, connections: list[FakeConnection]):
+        self.connections = connections
+        self.closed_connections = []
+
+    def getconn(self):
+        return self.connections.pop(0)
+
+    def putconn(self, connection, close=False):
+        if close:
+            self.closed_connections.append(connection)
+
+
+def create_fake_pgvector(connections: list[FakeConnection]) -> PgVector:
+    pgvector = PgVector.__new__(PgVector)
+    pgvector._logger = logging.getLogger(__name__)
+    pgvector._pool_slots = threading.BoundedSemaphore(1)
+    pgvector._pool = FakePool(connections)
+    pgvector._table_name = pgsql.Identifier(config.PGVECTOR_DB_TABLE_NAME)
+    return pgvector
+
+
+def test_pgvector_reconnects_after_dropped_connection(monkeypatch):
+    monkeypatch.setattr(config, "PGVECTOR_DB_POOL_MAX_SIZE", 3)
+    broken_connections = [FakeConnection(broken=True) for _ in range(3)]
+    new_connection = FakeConnection(broken=False)
+    pgvector = create_fake_pgvector([*broken_connections, new_connection])
+
+    # after a restart of the server, all idle connections are discarded and the operation uses a new connection
+    assert pgvector._execute(lambda cursor: "result") == "result"
+    assert pgvector._pool.closed_connections == broken_connections
+    assert new_connection.commits == 1
+
+    # if new connections are broken as well, the error is raised
+    pgvector._pool = FakePool([FakeConnection(broken=True) for _ in range(5)])
+    with pytest.raises(psycopg2.InterfaceError):
+        pgvector._execute(lambda cursor: "result")
+    assert len(pgvector._pool.closed_connections) == 4
+
+
+def test_pgvector_index_name_contains_build_parameters(monkeypatch):
+    monkeypatch.setattr(config, "PGVECTOR_DB_TABLE_NAME", "feex_embeddings")
+    monkeypatch.setattr(config, "PGVECTOR_DB_INDEX_TYPE", "exact")
+    assert PgVector._get_index_name() is None
+
+    # a changed build parameter results in a new index name, so the index is rebuilt
+    monkeypatch.setattr(config, "PGVECTOR_DB_INDEX_TYPE", "hnsw")
+    assert PgVector._get_index_name() == "feex_embeddings_ann_hnsw_m16_efc64"
+    monkeypatch.setattr(config, "PGVECTOR_DB_HNSW_M", 32)
+    assert PgVector._get_index_name() == "feex_embeddings_ann_hnsw_m32_efc64"
+
+    monkeypatch.setattr(config, "PGVECTOR_DB_INDEX_TYPE", "hnsw_binary")
+    assert PgVector._get_index_name() == "feex_embeddings_ann_hnsw_binary_m32_efc64"
+
+    monkeypatch.setattr(config, "PGVECTOR_DB_INDEX_TYPE", "ivfflat")
+    assert PgVector._get_index_name() == "feex_embeddings_ann_ivfflat_lists100"
+
+    # Postgres truncates names to 63 bytes, so long names end with a hash of the parameters instead
+    monkeypatch.setattr(config, "PGVECTOR_DB_TABLE_NAME", "feex_embeddings_of_the_department_for_image_forensics")
+    ivfflat_index_name = PgVector._get_index_name()
+    monkeypatch.setattr(config, "PGVECTOR_DB_IVFFLAT_LISTS", 1000)
+    assert len(PgVector._get_index_name()) == len(ivfflat_index_name) == 63
+    assert PgVector._get_index_name() != ivfflat_index_name
+
+
+def test_pgvector_builds_index_concurrently(monkeypatch):
+    monkeypatch.setattr(config, "PGVECTOR_DB_TABLE_NAME", "feex_embeddings")
+    monkeypatch.setattr(config, "PGVECTOR_DB_INDEX_TYPE", "hnsw")
+    # the configured index was left invalid by an interrupted build, the other index has outdated parameters
+    cursor = FakeCursor(
+        rows=[("feex_embeddings_ann_hnsw_m16_efc64", False), ("feex_embeddings_ann_ivfflat_lists100", True)]
+    )
+    connection = FakeConnection(broken=False, cursor=cursor)
+    create_fake_pgvector([connection]).build_index()
+
+    # concurrent index operations only work outside a transaction
+    assert connection.autocommit
+    statements = [query for query, _ in cursor.queries[1:]]
+    assert statements == [
+        'DROP INDEX CONCURRENTLY IF EXISTS "feex_embeddings_ann_hnsw_m16_efc64";',
+        'DROP INDEX CONCURRENTLY IF EXISTS "feex_embeddings_ann_ivfflat_lists100";',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS "feex_embeddings_ann_hnsw_m16_efc64" ON "feex_embeddings" '
+        "USING hnsw ((embedding::halfvec(2048)) halfvec_l2_ops) WITH (m = 16, ef_construction = 64);",
+    ]
+
+
+def test_pgvector_migrates_storage_type(monkeypatch):
+    monkeypatch.setattr(config, "PGVECTOR_DB_TABLE_NAME", "feex_embeddings")
+    monkeypatch.setattr(config, "PGVECTOR_DB_STORAGE_TYPE", "halfvec")
+    cursor = FakeCursor(rows=[("vector(2048)",)])
+    create_fake_pgvector([FakeConnection(broken=False, cursor=cursor)])._setup_storage()
+    assert cursor.queries[-1][0] == (
+        'ALTER TABLE "feex_embeddings" ALTER COLUMN embedding TYPE halfvec(2048) USING embedding::halfvec(2048);'
+    )
+
+    # an already migrated column is not altered again
+    cursor = FakeCursor(rows=[("halfvec(2048)",)])
+    create_fake_pgvector([FakeConnection(broken=False, cursor=cursor)])._setup_storage()
+    assert len(cursor.queries) == 1
+
+
+def test_pgvector_binary_index_reranks_candidates(monkeypatch):
+    monkeypatch.setattr(config, "PGVECTOR_DB_INDEX_TYPE", "hnsw_binary")
+    monkeypatch.setattr(config, "PGVECTOR_DB_RERANK_FACTOR", 4)
+    cursor = FakeCursor(rows=[(1, "a.jpg", 0.1, None), (2, "b.jpg", 0.2, None), (2, "c.jpg", 0.3, None)])
+    pgvector = create_fake_pgvector([FakeConnection(broken=False, cursor=cursor) for _ in range(2)])
+    search_embeddings = [ImageEmbedding(filename=f"{i}.jpg", embedding=np.zeros(2048).tolist()) for i in range(2)]
+
+    neighbours = pgvector.get_neighbours_batch(search_embeddings, threshold=0.5, limit=10)
+    assert [[neighbour.filename for neighbour in image_neighbours] for image_neighbours in neighbours] == [
+        ["a.jpg"],
+        ["b.jpg", "c.jpg"],
+    ]
+    # the HNSW search has to return all candidates, which are re-ranked by `get_neighbours_binary`
+    (set_query, set_parameters), (query, parameters) = cursor.queries
+    assert set_query == "SET LOCAL hnsw.ef_search = %s;"
+    assert set_parameters == (100,)
+    assert "get_neighbours_binary(" in query
+    assert (parameters["limit"], parameters["num_candidates"]) == (10, 40)
+
+    # pgvector limits ef_search to 1000, so the number of candidates and the limit are capped
+    cursor.queries.clear()
+    pgvector.get_neighbours_batch(search_embeddings, limit=2000)
+    (_, set_parameters), (_, parameters) = cursor.queries
+    assert set_parameters == (1000,)
+    assert (parameters["limit"], parameters["num_candidates"]) == (1000, 1000)
+
+
+def test_iter_embedding_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CHROMA_DB_MODE", "embedded")
+    monkeypatch.setattr(config, "CHROMA_DB_EMBEDDED_PATH", str(tmp_path / "chroma"))
+    monkeypatch.setattr(config, "NUMPY_DB_PATH", str(tmp_path / "numpy"))
+    stored_embeddings = create_embeddings(20, seed=0, prefix="stored")
+    for vector_db in (EmbeddedChromaDB(), NumpyVectorDB()):
+        vector_db.store_embeddings(stored_embeddings)
+        vector_db.delete_embeddings(["stored_3.jpg"])
+
+        blocks = list(vector_db.iter_embedding_blocks(block_size=8))
+        assert [len(filenames) for filenames, _ in blocks] == [8, 8, 3]
+        embedding_by_filename = {
+            filename: embedding for filenames, embeddings in blocks for filename, embedding in zip(filenames, embeddings)
+        }
+        assert len(embedding_by_filename) == 19
+        for stored_embedding in stored_embeddings:
+            if stored_embedding.filename != "stored_3.jpg":
+                assert np.allclose(embedding_by_filename[stored_embedding.filename], stored_embedding.embedding)
+
+
+def create_numpy_db(tmp_path, monkeypatch) -> NumpyVectorDB:
+    monkeypatch.setattr(config, "NUMPY_DB_PATH", str(tmp_path))
+    # small blocks, so the search merges the results of multiple blocks
+    monkeypatch.setattr(config, "NUMPY_DB_BLOCK_SIZE", 7)
+    return NumpyVectorDB()
+
+
+def test_numpy_db_matches_brute_force(tmp_path, monkeypatch):
+    vector_db = create_numpy_db(tmp_path, monkeypatch)
+    stored_embeddings = create_embeddings(30, seed=0, prefix="stored")
+    vector_db.store_embeddings(stored_embeddings)
+    search_embeddings = create_embeddings(4, seed=1, prefix="search")
+
+    stored = np.array([emb.embedding for emb in stored_embeddings])
+    neighbours_batch = vector_db.get_neighbours_batch(search_embeddings, limit=5)
+    for search_embedding, neighbours in zip(search_embeddings, neighbours_batch):
+        distances = np.sum((stored - np.array(search_embedding.embedding)) ** 2, axis=1)
+        expected = np.argsort(distances)[:5]
+        assert [n.filename for n in neighbours] == [f"stored_{i}.jpg" for i in expected]
+        assert np.allclose([n.distance for n in neighbours], distances[expected], atol=1e-5)
+        assert all(neighbour.embedding is None for neighbour in neighbours)
+
+    threshold = float(np.median(np.sum((stored - np.array(search_embeddings[0].embedding)) ** 2, axis=1)))
+    neighbours = vector_db.get_neighbours_threshold(search_embeddings[0], threshold=threshold)
+    assert 0 < len(neighbours) < 30
+    assert all(neighbour.distance <= threshold for neighbour in neighbours)
+
+    neighbours = vector_db.get_neighbours_top_n(stored_embeddings[3], limit=1, include_embeddings=True)
+    assert neighbours[0].filename == "stored_3.jpg"
+    assert np.allclose(neighbours[0].embedding, stored_embeddings[3].embedding)
+
+
+def test_numpy_db_update_delete_and_reopen(tmp_path, monkeypatch):
+    vector_db = create_numpy_db(tmp_path, monkeypatch)
+    stored_embeddings = create_embeddings(10, seed=0, prefix="stored")
+    vector_db.store_embeddings(stored_embeddings)
+
+    # an existing filename is overwritten in place instead of appended
+    updated = ImageEmbedding(embedding=stored_embeddings[1].embedding, filename="stored_0.jpg")
+    vector_db.store_embeddings([updated])
+    assert (tmp_path / "embeddings.f32").stat().st_size == 10 * 2048 * 4
+    neighbours = vector_db.get_neighbours_top_n(stored_embeddings[1], limit=2)
+    assert {n.filename for n in neighbours} == {"stored_0.jpg", "stored_1.jpg"}
+
+    vector_db.delete_embeddings(["stored_1.jpg", "unknown.jpg"])
+    neighbours = vector_db.get_neighbours_top_n(stored_embeddings[1], limit=20)
+    assert len(neighbours) == 9
+    assert "stored_1.jpg" not in {n.filename for n in neighbours}
+
+    vector_db.store_embeddings(create_embeddings(2, seed=1, prefix="new"))
+    reopened = NumpyVectorDB()
+    assert reopened.health_check()
+    neighbours = reopened.get_neighbours_top_n(stored_embeddings[1], limit=20)
+    assert len(neighbours) == 11
+    assert neighbours[0].filename == "stored_0.jpg"
+
+    reopened._clear_database()
+    assert reopened.get_neighbours_top_n(stored_embeddings[1]) == []
+
+
+def create_grouped_embeddings(num_groups: int, group_size: int, seed: int) -> list[ImageEmbedding]:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_groups, 2048)).astype(np.float32)
+    embeddings = np.repeat(centers, group_size, axis=0)
+    embeddings += rng.normal(scale=0.3, size=embeddings.shape).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return [
+        ImageEmbedding(embedding=emb.tolist(), filename=f"group_{i // group_size}_{i}.jpg")
+        for i, emb in enumerate(embeddings)
+    ]
+
+
+def test_ivfpq_db_recall_and_persistence(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "NUMPY_DB_PATH", str(tmp_path))
+    monkeypatch.setattr(config, "IVFPQ_DB_NLIST", 8)
+    monkeypatch.setattr(config, "IVFPQ_DB_NUM_SUBSPACES", 16)
+    monkeypatch.setattr(config, "IVFPQ_DB_NPROBE", 3)
+    monkeypatch.setattr(config, "IVFPQ_DB_TRAIN_SIZE", 300)
+    monkeypatch.setattr(config, "IVFPQ_DB_TRAIN_ITERATIONS", 5)
+    vector_db = IvfPqVectorDB()
+    stored_embeddings = create_grouped_embeddings(num_groups=80, group_size=5, seed=0)
+
+    # the training is started in the background once enough embeddings are stored, the search stays exact until then
+    training_started, finish_training = threading.Event(), threading.Event()
+
+    def blocked_kmeans(*args):
+        training_started.set()
+        finish_training.wait()
+        return kmeans(*args)
+
+    kmeans = ivfpq_vector_db._kmeans
+    monkeypatch.setattr(ivfpq_vector_db, "_kmeans", blocked_kmeans)
+    vector_db.store_embeddings(stored_embeddings[:200])
+    assert not vector_db.is_trained
+    vector_db.store_embeddings(stored_embeddings[200:300])
+    assert training_started.wait(timeout=10)
+    vector_db.store_embeddings(stored_embeddings[300:])
+    assert not vector_db.is_trained
+    exact_db = NumpyVectorDB()
+    neighbours = vector_db.get_neighbours_threshold(stored_embeddings[-1], threshold=0.6)
+    assert neighbours == exact_db.get_neighbours_threshold(stored_embeddings[-1], threshold=0.6)
+    finish_training.set()
+    vector_db.build_index()
+    assert vector_db.is_trained
+    # PQ code, list id, row in the inverted list and valid flag
+    assert vector_db.bytes_per_embedding == 16 + 4 + 4 + 1
+
+    neighbours_batch = vector_db.get_neighbours_batch(stored_embeddings[::20], threshold=0.6, limit=10)
+    expected_batch = exact_db.get_neighbours_batch(stored_embeddings[::20], threshold=0.6, limit=10)
+    for neighbours, expected in zip(neighbours_batch, expected_batch):
+        # all near-duplicates within the threshold are found, with the exact distance
+        assert [n.filename for n in neighbours] == [n.filename for n in expected]
+        assert np.allclose([n.distance for n in neighbours], [n.distance for n in expected], atol=1e-5)
+
+    # updated and deleted embeddings are reflected in the index
+    vector_db.store_embeddings([ImageEmbedding(embedding=stored_embeddings[0].embedding, filename="group_1_5.jpg")])
+    vector_db.delete_embeddings(["group_0_1.jpg"])
+    neighbours = vector_db.get_neighbours_threshold(stored_embeddings[0], threshold=0.6)
+    assert {n.filename for n in neighbours} == {
+        "group_0_0.jpg",
+        "group_0_2.jpg",
+        "group_0_3.jpg",
+        "group_0_4.jpg",
+        "group_1_5.jpg",
+    }
+
+    # the index is loaded instead of re-trained
+    reopened = IvfPqVectorDB()
+    assert reopened.is_trained
+    assert np.array_equal(reopened._centroids, vector_db._centroids)
+    reopened_neighbours = reopened.get_neighbours_threshold(stored_embeddings[0], threshold=0.6)
+    assert [n.filename for n in reopened_neighbours] == [n.filename for n in neighbours]
+
+    reopened._clear_database()
+    assert not reopened.is_trained
+    assert reopened.get_neighbours_top_n(stored_embeddings[0]) == []
+
+
+def test_numpy_db_with_projection(tmp_path, monkeypatch):
+    stored_embeddings = create_grouped_embeddings(num_groups=60, group_size=5, seed=0)
+    vector_db = create_numpy_db(tmp_path, monkeypatch)
+    vector_db.store_embeddings(stored_embeddings[:200])
+
+    projection = EmbeddingProjection.fit(vector_db.iter_embeddings(sample_size=150), dimensions=32)
+    projection.save(str(tmp_path / "projection.npz"))
+    projection = EmbeddingProjection.load(str(tmp_path / "projection.npz"))
+    assert projection.dimensions == 32
+    stored = np.array([emb.embedding for emb in stored_embeddings])
+    # the projected distance is a lower bound of the full distance
+    projected = projection.project(stored)
+    assert np.all(np.sum((projected - projected[0]) ** 2, axis=1) <= np.sum((stored - stored[0]) ** 2, axis=1) + 1e-4)
+
+    # existing rows are projected when the projection is enabled, new rows when they are stored
+    projected_db = NumpyVectorDB(projection=projection)
+    projected_db.store_embeddings(stored_embeddings[200:])
+    exact_db = NumpyVectorDB()
+    for search_embedding in stored_embeddings[::25]:
+        neighbours = projected_db.get_neighbours(search_embedding, threshold=0.6, limit=10)
+        expected = exact_db.get_neighbours(search_embedding, threshold=0.6, limit=10)
+        assert [n.filename for n in neighbours] == [n.filename for n in expected]
+        assert np.allclose([n.distance for n in neighbours], [n.distance for n in expected], atol=1e-5)
+    assert len(list(tmp_path.glob("embeddings_*.f32"))) == 1